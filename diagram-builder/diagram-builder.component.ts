@@ -83,6 +83,11 @@ export class DiagramBuilderComponent
   // UI state management
   isDragging: boolean = false; // Whether an element is being dragged
   clickSaved: boolean = false; // Whether a click has been processed
+  layoutRevision: number | null = null; // Révision du diagramme connue du serveur
+  private savedCells = new Map<string, string>(); // Cellules telles que sauvegardées
+  private savedMapping = new Map<string, string>(); // Références backend sauvegardées
+  private layoutSaving = false; // Une sauvegarde du diagramme est en cours
+  private layoutSavePending = false; // Une sauvegarde a été demandée pendant la précédente
   // Map to store timeouts for debouncing resize operations
   private resizeTimeouts = new Map<string, any>();
 
@@ -112,6 +117,9 @@ export class DiagramBuilderComponent
       return;
     }
     this._version = value;
+    this.layoutRevision = null;
+    this.savedCells.clear();
+    this.savedMapping.clear();
     this.initAllInfoDiagram();
   }
 
@@ -2213,6 +2221,13 @@ export class DiagramBuilderComponent
   // Nouvelle méthode qui contient la logique de sauvegarde actuelle
   private updateDiagramVersion(): void {
     this.clickSaved = true;
+
+    // Une seule sauvegarde à la fois, la suivante partira de la nouvelle révision
+    if (this.layoutSaving) {
+      this.layoutSavePending = true;
+      return;
+    }
+
     const timestamp = Date.now();
 
     try {
@@ -2237,29 +2252,196 @@ export class DiagramBuilderComponent
         elementMapping,
       };
 
-      // 4. Sauvegarder avec la clé spécifique à la version
-      const formData = new FormData();
-      formData.append('onlyJson', '1');
-      formData.append('diagram_json', JSON.stringify(saveData));
+      // 4. Envoyer uniquement les cellules modifiées si la révision est connue
+      this.layoutSaving = true;
+      if (this.layoutRevision === null) {
+        this.saveFullDiagramLayout(saveData);
+        return;
+      }
 
-      this._versionService
-        .updateVersion(this.version.uuid, formData)
+      const patch = this.buildLayoutPatch(saveData);
+      if (!patch) {
+        this.onDiagramLayoutSaved(saveData, this.layoutRevision);
+        return;
+      }
+
+      this.diagramService
+        .patchDiagramLayout(this.version.uuid, patch)
         .subscribe({
           next: (val: any) => {
-            console.log('Diagramme sauvegardé avec succès');
-            this.actionProcess.emit({ action: 'refresh' });
+            this.onDiagramLayoutSaved(saveData, val.revision);
           },
           error: (err: any) => {
-            console.error('Erreur lors de la sauvegarde du diagramme:', err);
+            if (err?.status === 409) {
+              // Un autre utilisateur a sauvegardé entre-temps : ne rien écraser
+              this.rebaseDiagramLayout(saveData, patch);
+              return;
+            }
+            // Patch refusé : renvoyer tout le diagramme, toujours depuis la révision connue
+            console.warn('Sauvegarde incrémentale refusée, sauvegarde complète:', err);
+            this.saveFullDiagramLayout(saveData);
           },
         });
 
       console.log(`Diagramme sauvegardé pour la version ${this.versionId}`);
     } catch (error) {
+      this.layoutSaving = false;
       console.error('Erreur lors de la sauvegarde:', error);
     }
   }
 
+  // Sauvegarde complète du diagramme, refusée par le serveur si la révision connue est périmée
+  private saveFullDiagramLayout(saveData: any): void {
+    this.diagramService
+      .saveDiagramLayout(this.version.uuid, saveData, this.layoutRevision)
+      .subscribe({
+        next: (val: any) => {
+          this.onDiagramLayoutSaved(saveData, val.revision);
+        },
+        error: (err: any) => {
+          if (err?.status === 409) {
+            const patch = this.buildLayoutPatch(saveData);
+            if (patch) {
+              this.rebaseDiagramLayout(saveData, patch);
+              return;
+            }
+          }
+          this.layoutSaving = false;
+          console.error('Erreur lors de la sauvegarde du diagramme:', err);
+        },
+      });
+  }
+
+  // Révision périmée : rejouer nos modifications sur le diagramme du serveur,
+  // ou signaler le conflit si un autre utilisateur a modifié les mêmes cellules
+  private rebaseDiagramLayout(saveData: any, patch: any): void {
+    this.diagramService.getDiagramLayout(this.version.uuid).subscribe({
+      next: (val: any) => {
+        const serverCells = new Map<string, string>(
+          (val.diagram_json?.graphStructure?.cells || []).map((cell: any) => [
+            cell.id,
+            JSON.stringify(cell),
+          ])
+        );
+        const touched = [
+          ...patch.added.map((cell: any) => cell.id),
+          ...patch.changed.map((cell: any) => cell.id),
+          ...patch.removed,
+        ];
+        const conflicts = touched.filter(
+          (id: string) => serverCells.get(id) !== this.savedCells.get(id)
+        );
+        if (conflicts.length) {
+          this.onDiagramLayoutConflict(val, conflicts);
+          return;
+        }
+
+        this.diagramService
+          .patchDiagramLayout(this.version.uuid, { ...patch, base_revision: val.revision })
+          .subscribe({
+            next: (saved: any) => {
+              this.onDiagramLayoutSaved(saveData, saved.revision);
+              // Afficher aussi les modifications de l'autre utilisateur
+              this.loadSavedDiagram();
+            },
+            error: (err: any) => {
+              if (err?.status === 409) {
+                // Encore une sauvegarde concurrente : recommencer depuis la nouvelle révision
+                this.rebaseDiagramLayout(saveData, patch);
+                return;
+              }
+              this.layoutSaving = false;
+              console.error('Erreur lors de la sauvegarde du diagramme:', err);
+            },
+          });
+      },
+      error: (err: any) => {
+        this.layoutSaving = false;
+        console.error('Erreur lors du rechargement du diagramme:', err);
+      },
+    });
+  }
+
+  // Conflit : le diagramme du serveur est affiché, nos modifications des mêmes cellules sont abandonnées
+  private onDiagramLayoutConflict(val: any, conflicts: string[]): void {
+    console.warn('Conflit de sauvegarde du diagramme sur les cellules:', conflicts);
+    this._snackBar.open(
+      'The diagram was changed by another user: your last layout changes were not saved',
+      'Error',
+      { duration: 5000 }
+    );
+    this.layoutSaving = false;
+    this.layoutSavePending = false;
+    this.applyServerLayout(val);
+  }
+
+  // Calcule les cellules ajoutées, supprimées et modifiées depuis la dernière sauvegarde
+  private buildLayoutPatch(saveData: any): any | null {
+    const cells: any[] = saveData.graphStructure.cells;
+    const mappingCells: any[] = saveData.elementMapping.cells;
+    const currentIds = new Set(cells.map((cell) => cell.id));
+
+    const added = cells.filter((cell) => !this.savedCells.has(cell.id));
+    const changed = cells.filter(
+      (cell) =>
+        this.savedCells.has(cell.id) &&
+        this.savedCells.get(cell.id) !== JSON.stringify(cell)
+    );
+    const removed = Array.from(this.savedCells.keys()).filter(
+      (id) => !currentIds.has(id)
+    );
+    const mapping = mappingCells.filter(
+      (entry) => this.savedMapping.get(entry.id) !== JSON.stringify(entry)
+    );
+
+    if (!added.length && !changed.length && !removed.length && !mapping.length) {
+      return null;
+    }
+    return {
+      base_revision: this.layoutRevision,
+      timestamp: saveData.timestamp,
+      added,
+      changed,
+      removed,
+      mapping,
+    };
+  }
+
+  // Mémorise l'état sauvegardé pour la prochaine sauvegarde incrémentale
+  private onDiagramLayoutSaved(saveData: any, revision: number): void {
+    this.layoutRevision = revision;
+    this.rememberSavedLayout(saveData);
+    this.layoutSaving = false;
+    console.log('Diagramme sauvegardé avec succès');
+    this.actionProcess.emit({ action: 'refresh' });
+
+    if (this.layoutSavePending) {
+      this.layoutSavePending = false;
+      this.updateDiagramVersion();
+    }
+  }
+
+  // Cellules et références telles qu'elles sont sur le serveur
+  private rememberSavedLayout(document: any): void {
+    this.savedCells = new Map(
+      (document?.graphStructure?.cells || []).map((cell: any) => [cell.id, JSON.stringify(cell)])
+    );
+    this.savedMapping = new Map(
+      (document?.elementMapping?.cells || []).map((entry: any) => [entry.id, JSON.stringify(entry)])
+    );
+  }
+
+  // Affiche le diagramme du serveur et en fait la base des sauvegardes incrémentales
+  private applyServerLayout(val: any): void {
+    this.layoutRevision = val.revision;
+    this.rememberSavedLayout(val.diagram_json);
+    if (!val.diagram_json?.graphStructure?.cells?.length) {
+      console.warn('Aucune donnée de diagramme trouvée pour la version');
+      return;
+    }
+    this.restoreDiagram(val.diagram_json);
+  }
+
   // Nettoyage lors de la destruction du composant
   ngOnDestroy(): void {
     this.resizeTimeouts.forEach((timeout) => clearTimeout(timeout));
@@ -2560,63 +2742,71 @@ export class DiagramBuilderComponent
 
   // Restaurer les données des éléments depuis le backend
   private restoreElementData(cells: any[]): void {
-    cells.forEach((cellInfo) => {
-      const cell = this.graph.getCell(cellInfo.id);
-      const backendId = cellInfo.backendId;
-
-      if (!cell || !backendId) return;
-
-      // S'assurer que l'ID backend est bien attaché à l'élément
-      cell.set('backendId', backendId);
-
-      // Restaurer les données selon le type d'élément
-      switch (cellInfo.type) {
-        case 'component':
-          this.diagramService.getComponentDiagramById(backendId).subscribe({
-            next: (data) => {
-              cell.set('componentData', data);
-              cell.attr('label/text', data.name || 'Component');
-            },
-            error: (err) => {
-              console.error('Erreur chargement composant:', err);
-              // Ne pas faire échouer la restauration complète
-              // Mettre une valeur par défaut
-              cell.attr('label/text', 'Component');
-            },
-          });
-          break;
+    this.diagramService.getVersionDiagramElements(this.version.uuid).subscribe({
+      next: (elements) => {
+        cells.forEach((cellInfo) => {
+          const cell = this.graph.getCell(cellInfo.id);
+          const backendId = cellInfo.backendId;
 
-        case 'subcomponent':
-          this.diagramService.getSubComponentDiagramById(backendId).subscribe({
-            next: (data) => {
-              cell.set('componentData', data);
-              cell.attr('label/text', data.name || 'Subcomponent');
-            },
-            error: (err) => {
-              console.error('Erreur chargement sous-composant:', err);
-              cell.attr('label/text', 'Subcomponent');
-            },
-          });
-          break;
+          if (!cell || !backendId) return;
 
-        case 'port':
-          this.diagramService.getPortDiagramById(backendId).subscribe({
-            next: (data) => {
-              cell.set('componentData', data);
-            },
-            error: (err) => console.error('Erreur chargement port:', err),
-          });
-          break;
+          // S'assurer que l'ID backend est bien attaché à l'élément
+          cell.set('backendId', backendId);
 
-        case 'interface':
-          this.diagramService.getInterfaceDiagramById(backendId).subscribe({
-            next: (data) => {
-              cell.set('interfaceData', data);
-            },
-            error: (err) => console.error('Erreur chargement interface:', err),
-          });
-          break;
-      }
+          const data = (elements[cellInfo.type] || {})[backendId];
+
+          // Restaurer les données selon le type d'élément
+          switch (cellInfo.type) {
+            case 'component':
+              if (data) {
+                cell.set('componentData', data);
+              } else {
+                console.error('Composant introuvable:', backendId);
+              }
+              cell.attr('label/text', (data && data.name) || 'Component');
+              break;
+
+            case 'subcomponent':
+              if (data) {
+                cell.set('componentData', data);
+              } else {
+                console.error('Sous-composant introuvable:', backendId);
+              }
+              cell.attr('label/text', (data && data.name) || 'Subcomponent');
+              break;
+
+            case 'port':
+              if (data) {
+                cell.set('componentData', data);
+              } else {
+                console.error('Port introuvable:', backendId);
+              }
+              break;
+
+            case 'interface':
+              if (data) {
+                cell.set('interfaceData', data);
+              } else {
+                console.error('Interface introuvable:', backendId);
+              }
+              break;
+          }
+        });
+      },
+      error: (err) => {
+        console.error('Erreur chargement des éléments du diagramme:', err);
+        // Ne pas faire échouer la restauration complète
+        cells.forEach((cellInfo) => {
+          const cell = this.graph.getCell(cellInfo.id);
+          if (!cell || !cellInfo.backendId) return;
+          cell.set('backendId', cellInfo.backendId);
+          if (cellInfo.type === 'component') {
+            cell.attr('label/text', 'Component');
+          } else if (cellInfo.type === 'subcomponent') {
+            cell.attr('label/text', 'Subcomponent');
+          }
+        });
+      },
     });
   }
 
@@ -2633,6 +2823,18 @@ export class DiagramBuilderComponent
       return;
     }
 
+    // Le diagramme est lu avec sa révision, base de la première sauvegarde incrémentale
+    this.diagramService.getDiagramLayout(this.version.uuid).subscribe({
+      next: (val: any) => this.applyServerLayout(val),
+      error: (err: any) => {
+        console.warn('Lecture du diagramme impossible, chargement depuis la version:', err);
+        this.loadVersionDiagram();
+      },
+    });
+  }
+
+  // Chargement depuis le diagram_json de la version, sans révision connue
+  private loadVersionDiagram(): void {
     // Vérifier que diagram_json existe
     if (!this.version.diagram_json) {
       console.warn(
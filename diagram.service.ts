@@ -2,6 +2,7 @@ import { Injectable } from '@angular/core';
 import { HttpClient } from '@angular/common/http';
 import { Observable, throwError } from 'rxjs';
 import { tap, catchError } from 'rxjs/operators';
+import { webSocket } from 'rxjs/webSocket';
 import { environment } from '../../environments/environment';
 import { ComponentGetData, ComponentModel } from '../models/component';
 import { SubcomponentGetData, SubcomponentModel } from '../models/subcomponent';
@@ -146,6 +147,56 @@ export class DiagramService {
   getInterfaceDiagramById(uuid: string): Observable<any> {
     return this.http.get<any>(`${this.apiUrl}/interface/${uuid}/diagram/`);
   }
+
+  // Récupère tous les éléments du diagramme d'une version en un seul appel
+  getVersionDiagramElements(versionId: string): Observable<any> {
+    return this.http.get<any>(
+      `${this.apiUrl}/version/${versionId}/diagram-elements/`
+    );
+  }
+
+  // Crée, modifie et supprime plusieurs éléments d'une version en une seule requête.
+  // Les éléments créés peuvent être référencés par leur temp_id dans les opérations suivantes.
+  batchDiagramElements(versionId: string, operations: any[]): Observable<any> {
+    return this.http.post<any>(`${this.apiUrl}/version/${versionId}/batch/`, {
+      operations,
+    });
+  }
+
+  // Récupère les éléments modifiés ou supprimés depuis un curseur (sans curseur : le curseur courant)
+  getVersionChanges(versionId: string, since?: number): Observable<any> {
+    const params: any = since === undefined ? {} : { since: String(since) };
+    return this.http.get<any>(`${this.apiUrl}/version/${versionId}/changes/`, {
+      params,
+    });
+  }
+
+  // Événements de modification d'une version poussés par le serveur (WebSocket)
+  watchVersionChanges(versionId: string): Observable<any> {
+    const origin = new URL(this.apiUrl, window.location.href).origin.replace(/^http/, 'ws');
+    return webSocket<any>(`${origin}/ws/version/${versionId}/`);
+  }
+
+  // Récupère le diagramme (diagram_json) d'une version avec sa révision
+  getDiagramLayout(versionId: string): Observable<any> {
+    return this.http.get<any>(`${this.apiUrl}/version/${versionId}/diagram-json/`);
+  }
+
+  // Remplace tout le diagramme d'une version, depuis la révision de base si elle est connue
+  saveDiagramLayout(versionId: string, diagramJson: any, baseRevision: number | null = null): Observable<any> {
+    return this.http.put<any>(`${this.apiUrl}/version/${versionId}/diagram-json/`, {
+      diagram_json: diagramJson,
+      base_revision: baseRevision,
+    });
+  }
+
+  // Envoie uniquement les cellules modifiées depuis la révision de base
+  patchDiagramLayout(versionId: string, patch: any): Observable<any> {
+    return this.http.patch<any>(
+      `${this.apiUrl}/version/${versionId}/diagram-json/`,
+      patch
+    );
+  }
   getAllParameters(): Observable<any[]> {
     return this.http.get<any[]>(`${this.apiUrl}/parameter/`);
   }
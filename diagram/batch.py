@@ -0,0 +1,324 @@
+"""
+Batch of create, update and delete operations on the diagram elements of a version.
+
+A batch is an ordered list of operations::
+
+    {"op": "create", "type": "port", "temp_id": "p1", "data": {"name": "eth0", "component": "c1"}}
+    {"op": "update", "type": "component", "id": "<uuid>", "data": {"notes": "..."}}
+    {"op": "delete", "type": "interface", "id": "<uuid>"}
+
+References (``component``, ``port_from``, ``port_to_port``, ``port_to_subcomponent``)
+are either the uuid of an existing element of the version or the temp_id of an
+element created earlier in the batch. An element deleted by the batch, directly or
+through its component or port_from, can neither be referenced nor updated. Every operation is validated before anything
+is written, then the batch is executed in one transaction: creations are bulk
+inserted type by type in dependency order (their uuids are assigned upfront),
+updates are bulk updated and deletions run last, children first.
+
+Images are not part of a batch: they are uploaded with the element endpoints.
+"""
+from collections import defaultdict
+from uuid import UUID
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from uuid6 import uuid7
+
+from .caches import parameter_types
+from .changes import lock_version, record_changes
+from .cia import propagate
+from .models import Component, Interface, Parameter, Port, SubComponent
+from .signals import notify_version_changed
+
+
+MODELS = {
+    "component": Component,
+    "subcomponent": SubComponent,
+    "port": Port,
+    "interface": Interface,
+}
+# Order of creation; deletions run in the reverse order
+TYPE_ORDER = ("component", "subcomponent", "port", "interface")
+
+COMMON_FIELDS = ("name", "description", "notes", "availability", "integrity", "confidentiality")
+FIELDS = {
+    "component": COMMON_FIELDS,
+    "subcomponent": COMMON_FIELDS,
+    "port": COMMON_FIELDS,
+    "interface": COMMON_FIELDS + ("type",),
+}
+REFERENCES = {
+    "component": {},
+    "subcomponent": {"component": "component"},
+    "port": {"component": "component"},
+    "interface": {"port_from": "port", "port_to_port": "port", "port_to_subcomponent": "subcomponent"},
+}
+# (parent type, child type, reference) deleted with their parent
+CASCADES = (
+    ("component", "subcomponent", "component"),
+    ("component", "port", "component"),
+    ("port", "interface", "port_from"),
+)
+
+
+class BatchError(Exception):
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+
+def max_operations():
+    return getattr(settings, "DIAGRAM_BATCH_MAX_OPERATIONS", 5000)
+
+
+def _uuid(value):
+    try:
+        return UUID(str(value))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _parameter_rows(index, parameters):
+    if not isinstance(parameters, list) or not all(isinstance(param, dict) for param in parameters):
+        raise BatchError(index, "parameters must be a list of objects")
+    return parameters
+
+
+def _removed_elements(deleted, updated):
+    """The deleted elements and the ones their deletion cascades to"""
+    removed = defaultdict(set, {element_type: set(ids) for element_type, ids in deleted.items()})
+    for parent_type, child_type, field_name in CASCADES:
+        if not removed[parent_type]:
+            continue
+        children = MODELS[child_type].objects.filter(
+            **{f"{field_name}__in": removed[parent_type]}
+        ).values_list("pk", flat=True)
+        for pk in children:
+            instance = updated[child_type].get(pk)
+            # Les mises à jour passent avant les suppressions : un élément déplacé est conservé
+            if instance is None or getattr(instance, f"{field_name}_id") in removed[parent_type]:
+                removed[child_type].add(pk)
+    return removed
+
+
+def run_batch(version_id, operations):
+    """Validate and execute a batch; return (temp id mapping, per-operation results)"""
+    if not isinstance(operations, list) or not operations:
+        raise BatchError(None, "operations must be a non-empty list")
+    if len(operations) > max_operations():
+        raise BatchError(None, f"A batch is limited to {max_operations()} operations")
+
+    temp_ids = {}
+    parsed = []
+    # First pass: shape of the operations and ids of the created elements
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise BatchError(index, "An operation must be an object")
+        op, element_type = operation.get("op"), operation.get("type")
+        if op not in ("create", "update", "delete"):
+            raise BatchError(index, f"Unknown op {op!r}")
+        if element_type not in MODELS:
+            raise BatchError(index, f"Unknown type {element_type!r}")
+        data = operation.get("data") or {}
+        if not isinstance(data, dict):
+            raise BatchError(index, "data must be an object")
+
+        if op == "create":
+            temp_id = operation.get("temp_id")
+            if temp_id is not None:
+                temp_id = str(temp_id)
+                if temp_id in temp_ids:
+                    raise BatchError(index, f"Duplicate temp_id {temp_id!r}")
+                temp_ids[temp_id] = (element_type, uuid7())
+            element_id = temp_ids[temp_id][1] if temp_id is not None else uuid7()
+        else:
+            element_id = _uuid(operation.get("id"))
+            if element_id is None:
+                raise BatchError(index, f"{op} needs the id of an existing element")
+        parsed.append((index, op, element_type, element_id, data))
+
+    # Second pass: references, resolved against the batch then against the version
+    existing_refs = defaultdict(set)
+    resolved = []
+    for index, op, element_type, element_id, data in parsed:
+        references = {}
+        for field_name, target_type in REFERENCES[element_type].items():
+            if field_name not in data:
+                continue
+            value = data[field_name]
+            if value in (None, ""):
+                references[field_name] = None
+            elif str(value) in temp_ids:
+                created_type, created_id = temp_ids[str(value)]
+                if created_type != target_type:
+                    raise BatchError(index, f"{field_name} must reference a {target_type}")
+                references[field_name] = created_id
+            elif _uuid(value) is not None:
+                references[field_name] = _uuid(value)
+                existing_refs[target_type].add(references[field_name])
+            else:
+                raise BatchError(index, f"Unknown reference {value!r} for {field_name}")
+        resolved.append((index, op, element_type, element_id, data, references))
+
+    for target_type, ids in existing_refs.items():
+        found = set(MODELS[target_type].objects.filter(pk__in=ids, version=version_id).values_list("pk", flat=True))
+        for index, op, element_type, element_id, data, references in resolved:
+            for field_name, value in references.items():
+                if REFERENCES[element_type][field_name] == target_type and value in ids and value not in found:
+                    raise BatchError(index, f"{field_name} {value} does not exist in this version")
+
+    targets = defaultdict(set)
+    for index, op, element_type, element_id, data, references in resolved:
+        if op != "create":
+            targets[element_type].add(element_id)
+    instances = {
+        element_type: MODELS[element_type].objects.filter(version=version_id).in_bulk(list(ids))
+        for element_type, ids in targets.items()
+    }
+
+    type_ids = {
+        _uuid(param.get("parameter_type"))
+        for index, op, element_type, element_id, data, references in resolved
+        for param in _parameter_rows(index, data.get("parameters", []))
+    } - {None}
+    types_by_id = parameter_types.in_bulk(type_ids)
+
+    # Third pass: build and validate the model instances
+    created = defaultdict(list)
+    created_parameters = []
+    updated = defaultdict(dict)
+    synced_parameters = []
+    deleted = defaultdict(set)
+    # Previous parents and ends of the updated elements, for the CIA propagation
+    previous = defaultdict(set)
+    results = []
+    for index, op, element_type, element_id, data, references in resolved:
+        model = MODELS[element_type]
+        results.append({"op": op, "type": element_type, "id": str(element_id)})
+        if op == "delete":
+            if element_id not in instances[element_type]:
+                raise BatchError(index, f"{element_type} {element_id} does not exist in this version")
+            deleted[element_type].add(element_id)
+            continue
+
+        if op == "create":
+            instance = model(id=element_id, version_id=version_id)
+        else:
+            instance = updated[element_type].get(element_id) or instances[element_type].get(element_id)
+            if instance is None:
+                raise BatchError(index, f"{element_type} {element_id} does not exist in this version")
+        for field_name in FIELDS[element_type]:
+            if field_name in data:
+                setattr(instance, field_name, data[field_name])
+        for field_name, value in references.items():
+            old_value = getattr(instance, f"{field_name}_id")
+            if op == "update" and old_value is not None and old_value != value:
+                previous[REFERENCES[element_type][field_name]].add(old_value)
+            setattr(instance, f"{field_name}_id", value)
+
+        excluded = ["version", "images", *REFERENCES[element_type]]
+        try:
+            instance.clean_fields(exclude=excluded)
+            instance.clean()
+        except ValidationError as e:
+            raise BatchError(index, e.message_dict if hasattr(e, "error_dict") else e.messages)
+        for field_name in REFERENCES[element_type]:
+            if not model._meta.get_field(field_name).null and getattr(instance, f"{field_name}_id") is None:
+                raise BatchError(index, f"{field_name} is required")
+
+        if op == "create":
+            created[element_type].append(instance)
+            for param in _parameter_rows(index, data.get("parameters", [])):
+                parameter_type = types_by_id.get(_uuid(param.get("parameter_type")))
+                if parameter_type is None:
+                    raise BatchError(index, f"Unknown parameter type {param.get('parameter_type')}")
+                created_parameters.append(Parameter(
+                    **{f"{element_type}_id": element_id},
+                    version_id=version_id,
+                    name=param.get("name", ""),
+                    value=param.get("value", ""),
+                    secret=param.get("secret", False),
+                    parameter_type_id=parameter_type.id,
+                ))
+        else:
+            updated[element_type][element_id] = instance
+            if "parameters" in data:
+                synced_parameters.append((element_type, instance, data["parameters"]))
+
+    if deleted:
+        removed = _removed_elements(deleted, updated)
+        for index, op, element_type, element_id, data, references in resolved:
+            if op == "update" and element_id in removed[element_type]:
+                raise BatchError(index, f"A {element_type} cannot be updated and deleted in the same batch")
+            for field_name, value in references.items():
+                if value is not None and value in removed[REFERENCES[element_type][field_name]]:
+                    raise BatchError(index, f"{field_name} {value} is deleted by this batch")
+
+    with transaction.atomic():
+        # The Version is locked before the element rows, as in every write path
+        lock_version(version_id)
+        for element_type in TYPE_ORDER:
+            if created[element_type]:
+                MODELS[element_type].objects.bulk_create(created[element_type], batch_size=500)
+        Parameter.objects.bulk_create(created_parameters, batch_size=500)
+
+        for element_type in TYPE_ORDER:
+            instances_to_update = list(updated[element_type].values())
+            if instances_to_update:
+                for instance in instances_to_update:
+                    instance.revision = F("revision") + 1
+                fields = [*FIELDS[element_type], *REFERENCES[element_type], "revision"]
+                MODELS[element_type].objects.bulk_update(instances_to_update, fields, batch_size=500)
+
+        from .views import sync_parameters
+        for element_type, instance, parameters in synced_parameters:
+            sync_parameters(element_type, instance, parameters)
+
+        for element_type in reversed(TYPE_ORDER):
+            if deleted[element_type]:
+                MODELS[element_type].objects.filter(pk__in=deleted[element_type]).delete()
+
+        for element_type in TYPE_ORDER:
+            changed_ids = [instance.id for instance in created[element_type]] + list(updated[element_type])
+            record_changes(version_id, element_type, changed_ids, locked=True)
+        record_changes(version_id, "parameter", [parameter.id for parameter in created_parameters], locked=True)
+        # Deletions propagate through the signals; bulk writes skip them
+        for element_type in TYPE_ORDER:
+            previous[element_type].update(instance.id for instance in created[element_type])
+            previous[element_type].update(updated[element_type])
+        propagate(previous)
+        _bump_related(created, updated, deleted, instances)
+        notify_version_changed(version_id)
+
+    mapping = {temp_id: str(element_id) for temp_id, (element_type, element_id) in temp_ids.items()}
+    return mapping, results
+
+
+def _bump_related(created, updated, deleted, instances):
+    """Bulk writes skip the signals that keep the revisions of the related elements in line"""
+    changed = {
+        element_type: [
+            *created[element_type],
+            *updated[element_type].values(),
+            *(instances[element_type][pk] for pk in deleted[element_type]),
+        ]
+        for element_type in TYPE_ORDER
+    }
+    component_ids = {
+        instance.component_id for element_type in ("subcomponent", "port") for instance in changed[element_type]
+    }
+    port_ids = {instance.port_from_id for instance in changed["interface"] if instance.port_from_id}
+    if component_ids:
+        Component.bump_revision(pk__in=component_ids)
+    if port_ids:
+        Component.bump_revision(pk__in=Port.objects.filter(pk__in=port_ids).values("component"))
+    updated_components = list(updated["component"])
+    if updated_components:
+        SubComponent.bump_revision(component__in=updated_components)
+        Port.bump_revision(component__in=updated_components)
+    for element_type, model in (("subcomponent", SubComponent), ("port", Port)):
+        if updated[element_type]:
+            model.bump_interfaces(list(updated[element_type]))
@@ -0,0 +1,175 @@
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from .models import ParameterType
+
+
+class ParameterTypeCache:
+    """
+    In-process cache of the ParameterType catalogue, indexed by id and by name.
+
+    The catalogue is small and rarely changes, so it is loaded as a whole on the first
+    lookup and kept until it is invalidated (by the ParameterType signals, once the
+    transaction is committed) or until DIAGRAM_PARAMETER_TYPE_CACHE_TIMEOUT seconds
+    have passed, which bounds the staleness seen by the other worker processes.
+
+    A key missing from the catalogue is looked up alone, and remembered when it does
+    not exist either, so that unknown ids or names never reload the whole catalogue.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = None
+        self._by_name = None
+        self._missing_ids = set()
+        self._missing_names = set()
+        self._loaded_at = 0.0
+
+    @property
+    def timeout(self):
+        return getattr(settings, "DIAGRAM_PARAMETER_TYPE_CACHE_TIMEOUT", 300)
+
+    def _catalogue(self, reload=False):
+        by_id, by_name = self._by_id, self._by_name
+        if not reload and by_id is not None and time.monotonic() - self._loaded_at < self.timeout:
+            return by_id, by_name
+
+        with self._lock:
+            if not reload and self._by_id is not None and time.monotonic() - self._loaded_at < self.timeout:
+                return self._by_id, self._by_name
+            by_id = {}
+            by_name = {}
+            for parameter_type in ParameterType.objects.order_by("id"):
+                by_id[parameter_type.id] = parameter_type
+                # Names are not unique: the oldest type wins, as it does for the UI
+                by_name.setdefault(parameter_type.name, parameter_type)
+            self._by_id, self._by_name = by_id, by_name
+            self._missing_ids, self._missing_names = set(), set()
+            self._loaded_at = time.monotonic()
+            return by_id, by_name
+
+    def _load_missing(self, by_id, by_name, pks=(), names=()):
+        """Look up the keys absent from the catalogue, which may have been created by another process"""
+        pks = [pk for pk in pks if pk not in self._missing_ids]
+        names = [name for name in names if name not in self._missing_names]
+        if not pks and not names:
+            return
+        found = list(ParameterType.objects.filter(pk__in=pks)) if pks else []
+        if names:
+            found += ParameterType.objects.filter(name__in=names).order_by("id")
+        with self._lock:
+            for parameter_type in found:
+                by_id[parameter_type.id] = parameter_type
+                by_name.setdefault(parameter_type.name, parameter_type)
+            # Unless the catalogue was invalidated or reloaded meanwhile
+            if by_id is self._by_id:
+                self._missing_ids.update(pk for pk in pks if pk not in by_id)
+                self._missing_names.update(name for name in names if name not in by_name)
+
+    def get_by_id(self, pk):
+        """Retourne le ParameterType correspondant à l'id, ou None"""
+        if pk is None:
+            return None
+        by_id, by_name = self._catalogue()
+        if pk not in by_id:
+            self._load_missing(by_id, by_name, pks=[pk])
+        return by_id.get(pk)
+
+    def get_by_name(self, name):
+        """Retourne le ParameterType correspondant au nom, ou None"""
+        by_id, by_name = self._catalogue()
+        if name not in by_name:
+            self._load_missing(by_id, by_name, names=[name])
+        return by_name.get(name)
+
+    def in_bulk(self, pks):
+        """Retourne un dictionnaire {id: ParameterType} pour les ids connus"""
+        by_id, by_name = self._catalogue()
+        missing = {pk for pk in pks if pk not in by_id}
+        if missing:
+            self._load_missing(by_id, by_name, pks=missing)
+        return {pk: by_id[pk] for pk in pks if pk in by_id}
+
+    def invalidate(self):
+        with self._lock:
+            self._by_id = None
+            self._by_name = None
+            self._missing_ids, self._missing_names = set(), set()
+
+    def invalidate_on_commit(self):
+        """
+        Invalidate now, for the lookups of the current transaction, and again once it
+        is committed: a reload by another thread in between still reads the old rows.
+        """
+        self.invalidate()
+        transaction.on_commit(self.invalidate)
+
+
+parameter_types = ParameterTypeCache()
+
+
+class VersionResponseCache:
+    """
+    Cache of serialized GET representations, namespaced per Version.
+
+    Every key embeds the current generation of its Version (and a global generation for
+    the data shared by all Versions, like the ParameterTypes). A write to the elements,
+    parameters or images of a Version, or to the rows of other apps they show (the
+    Version, its SUT, vulnerabilities, flow executions), bumps its generation, which
+    makes all its previous entries unreachable until they expire.
+
+    It uses the Django cache named by DIAGRAM_RESPONSE_CACHE ("default" by default), so
+    the local-memory and file-based backends work without any external service.
+    """
+    GLOBAL = "all"
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "DIAGRAM_RESPONSE_CACHE", "default")]
+
+    @property
+    def timeout(self):
+        return getattr(settings, "DIAGRAM_RESPONSE_CACHE_TIMEOUT", 600)
+
+    def _generation_key(self, version_id):
+        return f"diagram:generation:{version_id}"
+
+    def _generations(self, version_id):
+        keys = [self._generation_key(version_id), self._generation_key(self.GLOBAL)]
+        generations = self.cache.get_many(keys)
+        for key in keys:
+            if key not in generations:
+                # Start from the clock so that an evicted generation never comes back
+                # to a value already used by older entries
+                self.cache.add(key, time.time_ns(), timeout=None)
+                generations[key] = self.cache.get(key)
+        return [generations[key] for key in keys]
+
+    def generation(self, version_id):
+        """Change marker of the data of a Version, including the data shared by all Versions"""
+        return ".".join(str(generation) for generation in self._generations(version_id))
+
+    def bump(self, version_id=None):
+        """Invalidate the entries of a Version, or of every Version when version_id is None"""
+        key = self._generation_key(version_id if version_id is not None else self.GLOBAL)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, time.time_ns(), timeout=None)
+
+    def get_or_build(self, version_id, name, build):
+        """Return the cached representation named ``name``, building it on a miss"""
+        if version_id is None:
+            return build()
+        generation, global_generation = self._generations(version_id)
+        key = f"diagram:response:{version_id}:{generation}:{global_generation}:{name}"
+        data = self.cache.get(key)
+        if data is None:
+            data = build()
+            self.cache.set(key, data, self.timeout)
+        return data
+
+
+response_cache = VersionResponseCache()
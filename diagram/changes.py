@@ -0,0 +1,124 @@
+"""
+Change feed of the diagram elements and parameters of a version.
+
+Every save or deletion of a Component, SubComponent, Port, Interface or Parameter
+(and every change of their images) appends a ChangeEvent, whose id is the change
+sequence, and stores it in the change_seq of the row: a saved row stores it with
+its own write. The bulk writes (batch, import, clone, parameter synchronisation)
+record their events explicitly.
+
+The events of a version are written while its Version row is locked, so they are
+committed in sequence order and a reader never skips an event committed late.
+Every write path takes this lock first (see lock_version), before the element
+rows, so that two writes of a version wait for each other instead of locking the
+rows in opposite orders.
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from .models import ChangeEvent, Component, Interface, Parameter, Port, SubComponent, Version
+from .realtime import broadcast_changes
+
+
+MODELS = {
+    "component": Component,
+    "subcomponent": SubComponent,
+    "port": Port,
+    "interface": Interface,
+    "parameter": Parameter,
+}
+BATCH_SIZE = 1000
+
+
+def page_size():
+    return getattr(settings, "DIAGRAM_CHANGES_PAGE_SIZE", 5000)
+
+
+def lock_version(version_id):
+    """Lock the Version row until the end of the transaction"""
+    if version_id is not None:
+        list(Version.objects.select_for_update().filter(pk=version_id).values_list("pk", flat=True))
+
+
+def record_changes(version_id, element_type, ids, operation=ChangeEvent.UPSERT, locked=False, stamp=True):
+    """
+    Append the change events of elements of a version; return the last sequence.
+    locked: the transaction already holds the lock of the Version; stamp: store the
+    sequence in the change_seq of the rows.
+    """
+    ids = list(ids)
+    if version_id is None or not ids:
+        return None
+    with transaction.atomic():
+        if not locked:
+            lock_version(version_id)
+        events = ChangeEvent.objects.bulk_create([
+            ChangeEvent(version_id=version_id, element_type=element_type, element_id=pk, operation=operation)
+            for pk in ids
+        ], batch_size=BATCH_SIZE)
+        sequence = events[-1].id
+        if sequence is None:
+            sequence = ChangeEvent.objects.filter(version=version_id).aggregate(last=Max("id"))["last"]
+        if operation == ChangeEvent.UPSERT and stamp:
+            for start in range(0, len(ids), BATCH_SIZE):
+                MODELS[element_type].objects.filter(pk__in=ids[start:start + BATCH_SIZE]).update(change_seq=sequence)
+        broadcast_changes(version_id, element_type, ids, operation, sequence)
+    return sequence
+
+
+def current_cursor(version_id):
+    return ChangeEvent.objects.filter(version=version_id).aggregate(last=Max("id"))["last"] or 0
+
+
+def changes_since(version_id, since, serializers):
+    """
+    Elements of a version changed after the cursor since. serializers maps the
+    element types to the serializer class of their upserted rows.
+
+    Returns {"cursor", "has_more", "changes": {type: {"upserted": [...], "deleted": [ids]}}}.
+    """
+    limit = page_size()
+    events = list(
+        ChangeEvent.objects.filter(version=version_id, id__gt=since)
+        .order_by("id")
+        .values_list("id", "element_type", "element_id", "operation")[:limit + 1]
+    )
+    has_more = len(events) > limit
+    events = events[:limit]
+
+    # Last operation of each element
+    latest = OrderedDict()
+    for sequence, element_type, element_id, operation in events:
+        latest.pop((element_type, element_id), None)
+        latest[(element_type, element_id)] = operation
+
+    changes = {element_type: {"upserted": [], "deleted": []} for element_type in MODELS}
+    upserted = {element_type: [] for element_type in MODELS}
+    for (element_type, element_id), operation in latest.items():
+        if element_type not in MODELS:
+            continue
+        if operation == ChangeEvent.DELETE:
+            changes[element_type]["deleted"].append(element_id)
+        else:
+            upserted[element_type].append(element_id)
+
+    for element_type, ids in upserted.items():
+        if not ids:
+            continue
+        queryset = MODELS[element_type].objects.filter(pk__in=ids, version=version_id)
+        if element_type != "parameter":
+            queryset = queryset.prefetch_related("images", "parameters")
+        found = serializers[element_type](queryset, many=True).data
+        changes[element_type]["upserted"] = found
+        # Moved to another version since: gone from this one
+        found_ids = {str(item["id"]) for item in found}
+        changes[element_type]["deleted"] += [pk for pk in ids if str(pk) not in found_ids]
+
+    return {
+        "cursor": events[-1][0] if events else since,
+        "has_more": has_more,
+        "changes": changes,
+    }
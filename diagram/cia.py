@@ -0,0 +1,170 @@
+"""
+Effective CIA (availability, confidentiality, integrity) requirements of the
+diagram elements.
+
+The availability, confidentiality and integrity fields of an element are its own
+requirements; the effective_* fields add the requirements it inherits:
+
+- an Interface carries the requirements of its ends (port_from and its target);
+- a Port or a SubComponent gets the effective requirements of the Interfaces
+  leaving or reaching it, so a confidential SubComponent flags the Interfaces that
+  reach it and the Ports they come from;
+- a Component rolls up the effective requirements of its Ports and SubComponents.
+
+Requirements are bit masks. Propagation stops after one Interface, so the elements
+affected by a change are bounded: the changed element, its Interfaces, their
+other ends and the Components of all of these. propagate() recomputes only them,
+with a few bulk queries, and writes the masks that changed with update(): the
+revision of these elements is incremented and their change events recorded, as
+for any other change of their representation. It is called by the element
+signals and by the bulk writes; recompute_version() rebuilds a whole Version (see
+the recompute_cia command).
+"""
+from django.db.models import F, Q
+
+from .changes import record_changes
+from .models import Component, Interface, Port, SubComponent
+
+
+FLAGS = ("availability", "confidentiality", "integrity")
+EFFECTIVE_FIELDS = tuple(f"effective_{flag}" for flag in FLAGS)
+PARTS = {"port": Port, "subcomponent": SubComponent}
+MODELS = {"component": Component, **PARTS, "interface": Interface}
+
+
+def mask(values):
+    return sum(1 << position for position, value in enumerate(values) if value)
+
+
+def effective_values(element_mask):
+    return {field_name: bool(element_mask & (1 << position)) for position, field_name in enumerate(EFFECTIVE_FIELDS)}
+
+
+def _recompute(interface_filter, part_filters, component_filter, part_components=True):
+    """
+    Recompute the interfaces, parts and components matching the filters (and the
+    components of the recomputed parts with part_components) and write the
+    changed masks.
+    Returns {(element_type, pk): mask} of the recomputed elements.
+    """
+    computed = {}
+    current = {}
+    versions = {}
+
+    # Interfaces: own requirements of the interface and of its ends
+    touching = {}
+    rows = Interface.objects.filter(interface_filter).values_list(
+        "pk", "port_from", "port_to_port", "port_to_subcomponent",
+        *FLAGS,
+        *(f"port_from__{flag}" for flag in FLAGS),
+        *(f"port_to_port__{flag}" for flag in FLAGS),
+        *(f"port_to_subcomponent__{flag}" for flag in FLAGS),
+        *EFFECTIVE_FIELDS,
+        "version",
+    )
+    for row in rows:
+        pk, port_from, to_port, to_sub = row[:4]
+        value = mask(row[4:7]) | mask(row[7:10]) | mask(row[10:13]) | mask(row[13:16])
+        computed[("interface", pk)] = value
+        current[("interface", pk)] = mask(row[16:19])
+        versions[("interface", pk)] = row[19]
+        for key in (("port", port_from), ("port", to_port), ("subcomponent", to_sub)):
+            if key[1] is not None:
+                touching[key] = touching.get(key, 0) | value
+
+    # Ports and sub-components: own requirements and those of their interfaces
+    component_ids = set()
+    for element_type, part_filter in part_filters.items():
+        rows = PARTS[element_type].objects.filter(part_filter).values_list(
+            "pk", "component", "version", *FLAGS, *EFFECTIVE_FIELDS
+        )
+        for pk, component_id, version_id, *values in rows:
+            computed[(element_type, pk)] = mask(values[:3]) | touching.get((element_type, pk), 0)
+            current[(element_type, pk)] = mask(values[3:])
+            versions[(element_type, pk)] = version_id
+            component_ids.add(component_id)
+
+    # Components: own requirements and the effective ones of their parts
+    if part_components:
+        component_filter |= Q(pk__in=component_ids)
+    components = Component.objects.filter(component_filter)
+    rolled_up = {}
+    for element_type, model in PARTS.items():
+        for pk, component_id, *values in model.objects.filter(component__in=components).values_list(
+            "pk", "component", *EFFECTIVE_FIELDS
+        ):
+            value = computed.get((element_type, pk), mask(values))
+            rolled_up[component_id] = rolled_up.get(component_id, 0) | value
+    for pk, version_id, *values in components.values_list("pk", "version", *FLAGS, *EFFECTIVE_FIELDS):
+        computed[("component", pk)] = mask(values[:3]) | rolled_up.get(pk, 0)
+        current[("component", pk)] = mask(values[3:])
+        versions[("component", pk)] = version_id
+
+    _write(computed, current, versions)
+    return computed
+
+
+def _write(computed, current, versions):
+    """Store the changed masks, with a new revision and a change event"""
+    from .signals import notify_version_changed
+
+    changed = {}
+    recorded = {}
+    for (element_type, pk), value in computed.items():
+        if current[(element_type, pk)] != value:
+            changed.setdefault((element_type, value), []).append(pk)
+            recorded.setdefault((versions[(element_type, pk)], element_type), []).append(pk)
+    for (element_type, value), ids in changed.items():
+        MODELS[element_type].objects.filter(pk__in=ids).update(
+            revision=F("revision") + 1, **effective_values(value)
+        )
+    for (version_id, element_type), ids in recorded.items():
+        record_changes(version_id, element_type, ids)
+    for version_id in {version_id for version_id, _ in recorded}:
+        notify_version_changed(version_id)
+
+
+def propagate(seeds):
+    """
+    Recompute the elements affected by a change of the seeds, a dict
+    {element_type: ids}; the ids of deleted elements are ignored.
+    """
+    seeds = {element_type: {pk for pk in ids if pk is not None} for element_type, ids in seeds.items()}
+    ports = seeds.get("port", set())
+    subcomponents = seeds.get("subcomponent", set())
+    interfaces = seeds.get("interface", set())
+    components = seeds.get("component", set())
+    if not (ports or subcomponents or interfaces or components):
+        return {}
+
+    # The other ends of the interfaces of the changed parts inherit their requirements
+    if ports or subcomponents:
+        seed_ports, seed_subcomponents = list(ports), list(subcomponents)
+        part_interfaces = (
+            Q(port_from__in=seed_ports) | Q(port_to_port__in=seed_ports) | Q(port_to_subcomponent__in=seed_subcomponents)
+        )
+        for port_from, to_port, to_sub in Interface.objects.filter(part_interfaces).values_list(
+            "port_from", "port_to_port", "port_to_subcomponent"
+        ):
+            ports.update(pk for pk in (port_from, to_port) if pk is not None)
+            if to_sub is not None:
+                subcomponents.add(to_sub)
+    if interfaces:
+        for port_from, to_port, to_sub in Interface.objects.filter(pk__in=interfaces).values_list(
+            "port_from", "port_to_port", "port_to_subcomponent"
+        ):
+            ports.update(pk for pk in (port_from, to_port) if pk is not None)
+            if to_sub is not None:
+                subcomponents.add(to_sub)
+
+    return _recompute(
+        Q(pk__in=interfaces) | Q(port_from__in=ports) | Q(port_to_port__in=ports) | Q(port_to_subcomponent__in=subcomponents),
+        {"port": Q(pk__in=ports), "subcomponent": Q(pk__in=subcomponents)},
+        Q(pk__in=components),
+    )
+
+
+def recompute_version(version_id):
+    """Recompute every element of a version"""
+    version = Q(version=version_id)
+    return _recompute(version, {"port": version, "subcomponent": version}, version, part_components=False)
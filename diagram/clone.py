@@ -0,0 +1,135 @@
+"""
+Cloning of the diagram graph of a Version.
+
+Every Component, SubComponent, Port, Interface, Parameter and image link of the
+source version is copied with new uuid7 ids, type by type with bulk_create, so
+the number of queries only depends on the number of batches. The foreign keys
+(including port_to_port and port_to_subcomponent) point to the copies, the
+backendIds of the copied diagram_json are rewritten and the images are shared:
+the copies are linked to the same ImageFile rows, no file is copied.
+"""
+from django.db import transaction
+from uuid6 import uuid7
+
+from .changes import lock_version, record_changes
+from .cia import recompute_version
+from .layout import dump_document, load_document
+from .models import Component, DiagramLayout, Interface, Parameter, Port, SubComponent, Version
+from .signals import notify_version_changed
+
+
+BATCH_SIZE = 1000
+
+ELEMENT_MODELS = (Component, SubComponent, Port, Interface)
+
+
+class CloneError(Exception):
+    pass
+
+
+def _copy_rows(model, queryset, target_id, id_map):
+    """Bulk copy the rows of queryset with new ids and remapped foreign keys"""
+    fields = model._meta.concrete_fields
+    count = 0
+    batch = []
+    for row in queryset.order_by("pk").values(*[field.attname for field in fields]).iterator(chunk_size=BATCH_SIZE):
+        values = {}
+        for field in fields:
+            value = row[field.attname]
+            if field.primary_key:
+                value = id_map.setdefault(value, uuid7())
+            elif field.name == "version":
+                value = target_id
+            elif field.is_relation and value in id_map:
+                value = id_map[value]
+            elif field.is_relation and field.related_model in ELEMENT_MODELS and value is not None:
+                # Référence vers un élément d'une autre version : conservée seulement si obligatoire
+                value = value if not field.null else None
+            elif field.name in ("revision", "change_seq"):
+                value = 0
+            values[field.attname] = value
+        batch.append(model(**values))
+        if len(batch) >= BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def _copy_image_links(model, source_id, id_map):
+    through = model.images.through
+    owner = f"{model._meta.model_name}_id"
+    links = through.objects.filter(**{f"{model._meta.model_name}__version": source_id})
+    batch = []
+    for row in links.values(owner, "imagefile_id").iterator(chunk_size=BATCH_SIZE):
+        batch.append(through(**{owner: id_map[row[owner]], "imagefile_id": row["imagefile_id"]}))
+        if len(batch) >= BATCH_SIZE:
+            through.objects.bulk_create(batch)
+            batch = []
+    through.objects.bulk_create(batch)
+
+
+def _remap_ids(value, id_map):
+    """Rewrite every string of the document that is the id of a copied element"""
+    if isinstance(value, dict):
+        return {key: _remap_ids(item, id_map) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_remap_ids(item, id_map) for item in value]
+    if isinstance(value, str) and value in id_map:
+        return id_map[value]
+    return value
+
+
+def _new_version(source):
+    version = Version.objects.get(pk=source.pk)
+    # Copie de la ligne Version, sous un nouvel id
+    pk_field = Version._meta.pk
+    version.pk = pk_field.get_default() if pk_field.has_default() else uuid7()
+    version._state.adding = True
+    version.save(force_insert=True)
+    return version
+
+
+def clone_version(source, target=None):
+    """
+    Copy the diagram graph of source into target (an empty Version), or into a copy
+    of the source Version row when target is None. Return (target, copied counts).
+    """
+    from .viewport import sync_cell_layouts
+
+    with transaction.atomic():
+        if target is None:
+            target = _new_version(source)
+        elif any(model.objects.filter(version=target).exists() for model in ELEMENT_MODELS):
+            raise CloneError("The target version already has diagram elements")
+        # The Version is locked before the element rows, as in every write path
+        lock_version(target.pk)
+
+        # old id -> new id, filled as the rows are copied (parents first)
+        id_map = {}
+        counts = {}
+        for model in ELEMENT_MODELS:
+            queryset = model.objects.filter(version=source.pk)
+            counts[model._meta.model_name] = _copy_rows(model, queryset, target.pk, id_map)
+        queryset = Parameter.objects.filter(version=source.pk)
+        counts["parameter"] = _copy_rows(Parameter, queryset, target.pk, id_map)
+        for model in ELEMENT_MODELS:
+            _copy_image_links(model, source.pk, id_map)
+        for model in (*ELEMENT_MODELS, Parameter):
+            ids = model.objects.filter(version=target.pk).values_list("pk", flat=True)
+            record_changes(target.pk, model._meta.model_name, ids.iterator(chunk_size=BATCH_SIZE), locked=True)
+
+        document = _remap_ids(
+            load_document(source.diagram_json),
+            {str(old): str(new) for old, new in id_map.items()},
+        )
+        Version.objects.filter(pk=target.pk).update(diagram_json=dump_document(document, like=source.diagram_json))
+        DiagramLayout.objects.update_or_create(version_id=target.pk, defaults={"revision": 0})
+        sync_cell_layouts(target.pk, document)
+        # The references to other versions are dropped, which may change the requirements
+        recompute_version(target.pk)
+        notify_version_changed(target.pk)
+    return target, counts
@@ -0,0 +1,38 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .models import Version
+from .realtime import group_name
+
+
+class VersionChangesConsumer(AsyncJsonWebsocketConsumer):
+    """
+    WebSocket receiving the change events of a Version (see diagram.realtime).
+    The client only listens: it refetches the changed elements through the change
+    feed or the element endpoints.
+    """
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if user is not None and not user.is_authenticated:
+            await self.close()
+            return
+        self.version_id = str(self.scope["url_route"]["kwargs"]["pk"])
+        if not await self.version_exists():
+            await self.close()
+            return
+        self.group = group_name(self.version_id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, "group"):
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def diagram_change(self, message):
+        for event in message["events"]:
+            await self.send_json(event)
+
+    @database_sync_to_async
+    def version_exists(self):
+        return Version.objects.filter(pk=self.version_id).exists()
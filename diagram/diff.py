@@ -0,0 +1,212 @@
+"""
+Structural diff between the diagrams of two Versions.
+
+Elements are matched by their name path rather than by id, parents first: a
+sub-component or a port is identified by its matched component and its name, an
+interface by its matched ends and its name, a parameter by its matched element and
+its name. When several elements share a path they are paired by content hash,
+then in id order. Elements left unmatched on both sides are paired when they have
+the same matched parent and their content hash (all the compared fields but the
+name) is unique under this parent on each side, which reports renamed elements as
+modified instead of removed and added. An interface paired this way under its
+port_from may have another target: it is then reported with a "target" change.
+
+Each version is read with one values() query per type and every step is a dict
+lookup, so the diff runs in linear time in the number of elements.
+"""
+import hashlib
+import json
+from collections import defaultdict
+
+from .caches import parameter_types
+from .models import Component, Interface, Parameter, Port, SubComponent
+
+
+COMMON_FIELDS = ("name", "description", "notes", "availability", "integrity", "confidentiality")
+COMPARED_FIELDS = {
+    "component": COMMON_FIELDS,
+    "subcomponent": COMMON_FIELDS,
+    "port": COMMON_FIELDS,
+    "interface": COMMON_FIELDS + ("type",),
+    "parameter": ("name", "value", "secret", "parameter_type"),
+}
+ELEMENT_TYPES = ("component", "subcomponent", "port", "interface", "parameter")
+
+
+def content_hash(row, fields):
+    content = [row.get(field_name) for field_name in fields if field_name != "name"]
+    return hashlib.sha1(json.dumps(content, default=str).encode()).hexdigest()
+
+
+def _pair_group(olds, news, pairs):
+    """Pair the elements sharing a key: same content first, then in id order"""
+    if len(olds) == 1 and len(news) == 1:
+        pairs.append((olds[0], news[0]))
+        return [], []
+    by_hash = defaultdict(list)
+    for new in news:
+        by_hash[new["_hash"]].append(new)
+    left_olds = []
+    for old in sorted(olds, key=lambda row: str(row["id"])):
+        candidates = by_hash.get(old["_hash"])
+        if candidates:
+            pairs.append((old, candidates.pop(0)))
+        else:
+            left_olds.append(old)
+    left_news = [new for candidates in by_hash.values() for new in candidates]
+    left_news.sort(key=lambda row: str(row["id"]))
+    for old, new in zip(left_olds, left_news):
+        pairs.append((old, new))
+    return left_olds[len(left_news):], left_news[len(left_olds):]
+
+
+def match(old_rows, new_rows, old_key, new_key, fields, old_parent=lambda row: None, new_parent=lambda row: None):
+    """Return (pairs, removed, added) of two lists of rows"""
+    for row in old_rows + new_rows:
+        row["_hash"] = content_hash(row, fields)
+    old_groups, new_groups = defaultdict(list), defaultdict(list)
+    for row in old_rows:
+        old_groups[old_key(row)].append(row)
+    for row in new_rows:
+        new_groups[new_key(row)].append(row)
+
+    pairs, removed, added = [], [], []
+    for key, olds in old_groups.items():
+        left_olds, left_news = _pair_group(olds, new_groups.pop(key, []), pairs)
+        removed += left_olds
+        added += left_news
+    for news in new_groups.values():
+        added += news
+
+    # Renamed elements: same parent and content, unique on both sides
+    old_by_hash, new_by_hash = defaultdict(list), defaultdict(list)
+    for row in removed:
+        old_by_hash[(old_parent(row), row["_hash"])].append(row)
+    for row in added:
+        new_by_hash[(new_parent(row), row["_hash"])].append(row)
+    renamed = set()
+    for content, olds in old_by_hash.items():
+        news = new_by_hash.get(content, [])
+        if len(olds) == 1 and len(news) == 1:
+            pairs.append((olds[0], news[0]))
+            renamed.update((id(olds[0]), id(news[0])))
+    removed = [row for row in removed if id(row) not in renamed]
+    added = [row for row in added if id(row) not in renamed]
+    return pairs, removed, added
+
+
+class VersionDiff:
+    def __init__(self, old_version_id, new_version_id):
+        self.old_version_id = old_version_id
+        self.new_version_id = new_version_id
+        # id of an element of the old version -> id of its match in the new one
+        self.matched = {}
+        self.paths = {}
+
+    def load(self, model, version_id, fields, extra=()):
+        rows = list(model.objects.filter(version=version_id).values("id", *fields, *extra))
+        for row in rows:
+            if "parameter_type" in row:
+                parameter_type = parameter_types.get_by_id(row["parameter_type"])
+                row["parameter_type"] = parameter_type.name if parameter_type else None
+        return rows
+
+    def token(self, element_id):
+        """Identity of an element shared by both versions once it is matched"""
+        return self.matched.get(element_id, element_id)
+
+    def path(self, row, parent_id=None):
+        name = row.get("name") or ""
+        return f"{self.paths[parent_id]}/{name}" if parent_id in self.paths else name
+
+    def compare(self, element_type, model, old_key, new_key, parent=lambda row: None, target=lambda row: None, extra=()):
+        fields = COMPARED_FIELDS[element_type]
+        old_rows = self.load(model, self.old_version_id, fields, extra)
+        new_rows = self.load(model, self.new_version_id, fields, extra)
+        pairs, removed, added = match(
+            old_rows, new_rows, old_key, new_key, fields,
+            old_parent=lambda row: self.token(parent(row)),
+            new_parent=parent,
+        )
+
+        result = {"added": [], "removed": [], "modified": [], "unchanged": 0}
+        for old, new in pairs:
+            self.matched[old["id"]] = new["id"]
+            self.paths[old["id"]] = self.path(old, parent(old))
+            self.paths[new["id"]] = self.path(new, parent(new))
+            # A renamed interface is paired under its port_from: its target may differ
+            retargeted = self.token(target(old)) != target(new)
+            if old["_hash"] == new["_hash"] and old.get("name") == new.get("name") and not retargeted:
+                result["unchanged"] += 1
+                continue
+            changes = {
+                field_name: {"from": old.get(field_name), "to": new.get(field_name)}
+                for field_name in fields
+                if old.get(field_name) != new.get(field_name)
+            }
+            if retargeted:
+                changes["target"] = {"from": self.paths.get(target(old)), "to": self.paths.get(target(new))}
+            result["modified"].append({
+                "path": self.paths[new["id"]],
+                "from_id": old["id"],
+                "to_id": new["id"],
+                "changes": changes,
+            })
+        for key, rows in (("removed", removed), ("added", added)):
+            for row in rows:
+                self.paths[row["id"]] = self.path(row, parent(row))
+                result[key].append({"path": self.paths[row["id"]], "id": row["id"]})
+        return result
+
+    def run(self):
+        diff = {"from": self.old_version_id, "to": self.new_version_id}
+        diff["component"] = self.compare(
+            "component", Component,
+            lambda row: row["name"],
+            lambda row: row["name"],
+        )
+        for element_type, model in (("subcomponent", SubComponent), ("port", Port)):
+            diff[element_type] = self.compare(
+                element_type, model,
+                lambda row: (self.token(row["component"]), row["name"]),
+                lambda row: (row["component"], row["name"]),
+                parent=lambda row: row["component"],
+                extra=("component",),
+            )
+        diff["interface"] = self.compare(
+            "interface", Interface,
+            lambda row: (
+                self.token(row["port_from"]),
+                self.token(row["port_to_port"] or row["port_to_subcomponent"]),
+                row["name"],
+            ),
+            lambda row: (row["port_from"], row["port_to_port"] or row["port_to_subcomponent"], row["name"]),
+            parent=lambda row: row["port_from"],
+            target=lambda row: row["port_to_port"] or row["port_to_subcomponent"],
+            extra=("port_from", "port_to_port", "port_to_subcomponent"),
+        )
+
+        def owner(row):
+            return row["component"] or row["subcomponent"] or row["port"] or row["interface"]
+
+        diff["parameter"] = self.compare(
+            "parameter", Parameter,
+            lambda row: (self.token(owner(row)), row["name"]),
+            lambda row: (owner(row), row["name"]),
+            parent=owner,
+            extra=Parameter.OWNER_FIELDS,
+        )
+        diff["summary"] = {
+            element_type: {
+                "added": len(diff[element_type]["added"]),
+                "removed": len(diff[element_type]["removed"]),
+                "modified": len(diff[element_type]["modified"]),
+                "unchanged": diff[element_type]["unchanged"],
+            }
+            for element_type in ELEMENT_TYPES
+        }
+        return diff
+
+
+def diff_versions(old_version_id, new_version_id):
+    return VersionDiff(old_version_id, new_version_id).run()
@@ -0,0 +1,99 @@
+"""
+Streaming export of a whole Version as one JSON document::
+
+    {
+        "version": "<uuid>",
+        "diagram_json": {...},
+        "component": [{...}, ...],
+        "subcomponent": [...],
+        "port": [...],
+        "interface": [...],
+        "parameter": [...],
+        "images": [{"element_type": "port", "element": "<uuid>", "image": "<uuid>"}, ...]
+    }
+
+The rows are read with values().iterator(), so neither model instances nor
+serializers are built, and written in chunks of about EXPORT_CHUNK_BYTES: the
+memory used does not depend on the size of the version and the first bytes are
+sent before the last rows are read.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .caches import parameter_types
+from .cia import EFFECTIVE_FIELDS
+from .layout import load_document
+from .models import Component, Interface, Parameter, Port, SubComponent, Version
+
+
+EXPORT_CHUNK_BYTES = 64 * 1024
+ITERATOR_CHUNK_SIZE = 2000
+
+ELEMENT_MODELS = (
+    ("component", Component),
+    ("subcomponent", SubComponent),
+    ("port", Port),
+    ("interface", Interface),
+)
+
+encoder = DjangoJSONEncoder(separators=(",", ":"))
+
+
+def exported_fields(model):
+    return [field.attname for field in model._meta.concrete_fields if field.name not in ("version", "revision", "change_seq", *EFFECTIVE_FIELDS)]
+
+
+def _rows(queryset, fields):
+    return queryset.order_by("pk").values(*fields).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+
+
+def _parameter_rows(version_id):
+    for row in _rows(Parameter.objects.filter(version=version_id), exported_fields(Parameter)):
+        parameter_type = parameter_types.get_by_id(row["parameter_type_id"])
+        row["parameter_type_name"] = parameter_type.name if parameter_type else None
+        yield row
+
+
+def _image_rows(version_id):
+    for element_type, model in ELEMENT_MODELS:
+        through = model.images.through
+        owner = f"{model._meta.model_name}_id"
+        for row in _rows(through.objects.filter(**{f"{model._meta.model_name}__version": version_id}), [owner, "imagefile_id"]):
+            yield {"element_type": element_type, "element": row[owner], "image": row["imagefile_id"]}
+
+
+def _array(rows):
+    yield "["
+    first = True
+    for row in rows:
+        yield encoder.encode(row) if first else "," + encoder.encode(row)
+        first = False
+    yield "]"
+
+
+def _document(version):
+    yield '{"version":' + encoder.encode(version.pk)
+    yield ',"diagram_json":' + encoder.encode(load_document(version.diagram_json))
+    for element_type, model in ELEMENT_MODELS:
+        yield f',"{element_type}":'
+        yield from _array(_rows(model.objects.filter(version=version.pk), exported_fields(model)))
+    yield ',"parameter":'
+    yield from _array(_parameter_rows(version.pk))
+    yield ',"images":'
+    yield from _array(_image_rows(version.pk))
+    yield "}"
+
+
+def export_version(version):
+    """Generator of the chunks of the JSON export of a Version"""
+    buffer = []
+    size = 0
+    for part in _document(version):
+        buffer.append(part)
+        size += len(part)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(buffer).encode("utf-8")
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
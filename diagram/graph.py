@@ -0,0 +1,167 @@
+"""
+Reachability over the Interface graph of a Version.
+
+The graph is directed: an Interface goes from its port_from to its port_to_port
+or port_to_subcomponent. A Component and its Ports and SubComponents reach each
+other (containment), unless containment is disabled. Elements without any
+Interface are not nodes of the graph; they are reached through their component.
+
+The adjacency index is built from a single query on the Interfaces of the version
+(their ends and the components of their ends), then every query is a breadth or
+depth first walk over Python dicts.
+"""
+from collections import deque
+
+from django.conf import settings
+
+from .models import Interface
+
+
+def max_paths():
+    return getattr(settings, "DIAGRAM_GRAPH_MAX_PATHS", 1000)
+
+
+class Edge:
+    __slots__ = ("target", "interface", "external")
+
+    def __init__(self, target, interface=None, external=False):
+        self.target = target
+        self.interface = interface
+        self.external = external
+
+
+class VersionGraph:
+    def __init__(self, containment=True):
+        self.containment = containment
+        self.adjacency = {}
+        self.kinds = {}
+
+    @classmethod
+    def load(cls, version_id, containment=True):
+        graph = cls(containment)
+        rows = Interface.objects.filter(version=version_id, port_from__isnull=False).values_list(
+            "id", "type",
+            "port_from", "port_from__component",
+            "port_to_port", "port_to_port__component",
+            "port_to_subcomponent", "port_to_subcomponent__component",
+        )
+        for interface_id, interface_type, port_from, from_component, to_port, to_port_component, to_sub, to_sub_component in rows:
+            graph.add_part(port_from, "port", from_component)
+            target = to_port or to_sub
+            if target is None:
+                continue
+            if to_port:
+                graph.add_part(to_port, "port", to_port_component)
+            else:
+                graph.add_part(to_sub, "subcomponent", to_sub_component)
+            graph.adjacency[port_from].append(Edge(target, interface_id, interface_type == "external"))
+        return graph
+
+    def add_node(self, node, kind):
+        if node not in self.kinds:
+            self.kinds[node] = kind
+            self.adjacency[node] = []
+
+    def add_part(self, node, kind, component):
+        """Add a port or a sub-component and its containment edges"""
+        if node in self.kinds:
+            return
+        self.add_node(node, kind)
+        if self.containment and component is not None:
+            self.add_node(component, "component")
+            self.adjacency[node].append(Edge(component))
+            self.adjacency[component].append(Edge(node))
+
+    def _edges(self, node, entered, external_only):
+        """Edges that may be followed from a state, with the state they lead to"""
+        for edge in self.adjacency.get(node, ()):
+            if edge.interface is None:
+                yield edge, entered
+            elif entered or not external_only:
+                yield edge, True
+            elif edge.external:
+                yield edge, True
+
+    def reachable(self, source, external_only=False, max_depth=None):
+        """{node: depth} of the nodes reachable from source"""
+        start = (source, not external_only)
+        depths = {start: 0}
+        reached = {}
+        queue = deque([start])
+        while queue:
+            state = queue.popleft()
+            node, entered = state
+            depth = depths[state]
+            if entered and node != source:
+                reached.setdefault(node, depth)
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for edge, next_entered in self._edges(node, entered, external_only):
+                next_state = (edge.target, next_entered)
+                if next_state not in depths:
+                    depths[next_state] = depth + 1
+                    queue.append(next_state)
+        return reached
+
+    def shortest_path(self, source, target, external_only=False, max_depth=None):
+        """List of (node, interface used to reach it) from source to target, or None"""
+        start = (source, not external_only)
+        parents = {start: None}
+        depths = {start: 0}
+        queue = deque([start])
+        while queue:
+            state = queue.popleft()
+            node, entered = state
+            if node == target and entered:
+                return self._unwind(parents, state)
+            if max_depth is not None and depths[state] >= max_depth:
+                continue
+            for edge, next_entered in self._edges(node, entered, external_only):
+                next_state = (edge.target, next_entered)
+                if next_state not in parents:
+                    parents[next_state] = (state, edge.interface)
+                    depths[next_state] = depths[state] + 1
+                    queue.append(next_state)
+        return None
+
+    def _unwind(self, parents, state):
+        path = []
+        while state is not None:
+            parent = parents[state]
+            path.append((state[0], parent[1] if parent else None))
+            state = parent[0] if parent else None
+        path.reverse()
+        return path
+
+    def simple_paths(self, source, target, max_depth, external_only=False, limit=None):
+        """Simple paths from source to target of at most max_depth edges; (paths, truncated)"""
+        limit = limit or max_paths()
+        paths = []
+        visited = {source}
+        steps = [(source, None)]
+        # Bound of the explored states: the number of simple paths grows exponentially
+        budget = [limit * 1000]
+
+        def walk(node, entered):
+            budget[0] -= 1
+            if len(paths) >= limit or budget[0] < 0:
+                return True
+            if node == target and entered and len(steps) > 1:
+                paths.append(list(steps))
+                return False
+            if len(steps) - 1 >= max_depth:
+                return False
+            for edge, next_entered in self._edges(node, entered, external_only):
+                if edge.target in visited:
+                    continue
+                visited.add(edge.target)
+                steps.append((edge.target, edge.interface))
+                truncated = walk(edge.target, next_entered)
+                steps.pop()
+                visited.discard(edge.target)
+                if truncated:
+                    return True
+            return False
+
+        truncated = walk(source, not external_only)
+        return paths, truncated or len(paths) >= limit
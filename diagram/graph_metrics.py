@@ -0,0 +1,169 @@
+"""
+Graph metrics of a Version, to rank its elements for testing.
+
+The metrics are computed with NumPy and SciPy sparse matrices over the CSR
+adjacency of the graph snapshot (see diagram.snapshot), whose arrays are read
+from the memory mapping without a Python loop over the nodes:
+
+- fan_in, fan_out: number of Interfaces entering and leaving each node;
+- component_size: size of the weakly connected component of each node, Components
+  being connected to their Ports and SubComponents;
+- centrality: betweenness centrality estimated by Brandes' algorithm from
+  DIAGRAM_METRICS_SAMPLES sources (every node of a smaller graph), each breadth
+  first level of a batch of sources being a sparse matrix product. It is
+  normalised by (n - 1)(n - 2).
+
+NumPy and SciPy are optional: without them MetricsUnavailable is raised. The
+results are kept in the Django cache named by DIAGRAM_RESPONSE_CACHE under the
+change sequence of the snapshot, so any change of the graph recomputes them.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from .snapshot import load_snapshot
+
+
+METRICS = ("fan_in", "fan_out", "centrality", "component_size")
+
+
+class MetricsUnavailable(Exception):
+    pass
+
+
+def samples():
+    return getattr(settings, "DIAGRAM_METRICS_SAMPLES", 64)
+
+
+def batch_size():
+    return getattr(settings, "DIAGRAM_METRICS_BATCH", 16)
+
+
+def _modules():
+    try:
+        import numpy
+        from scipy import sparse
+        from scipy.sparse import csgraph
+    except ImportError as e:
+        raise MetricsUnavailable("The graph metrics need numpy and scipy") from e
+    return numpy, sparse, csgraph
+
+
+def _matrices(snapshot, np, sparse):
+    """(interfaces, graph): the Interface adjacency and the one with the containment edges"""
+    n = snapshot.n
+    offsets = np.frombuffer(snapshot.offsets, dtype=np.int32)
+    targets = np.frombuffer(snapshot.targets, dtype=np.int32)
+    interfaces = sparse.csr_matrix((np.ones(len(targets), dtype=np.float64), targets, offsets), shape=(n, n))
+
+    parents = np.frombuffer(snapshot.parents, dtype=np.int32)
+    parts = np.flatnonzero(parents >= 0)
+    owners = parents[parts].astype(np.int64)
+    containment = sparse.csr_matrix(
+        (np.ones(2 * len(parts)), (np.concatenate([parts, owners]), np.concatenate([owners, parts]))),
+        shape=(n, n),
+    )
+    graph = (interfaces + containment).tocsr()
+    # Several interfaces between two nodes count as one edge for the shortest paths
+    graph.data[:] = 1.0
+    return interfaces, graph
+
+
+def _betweenness(graph, sources, np):
+    """Sum over the sources of Brandes' dependencies, batch by batch"""
+    n = graph.shape[0]
+    transposed = graph.T.tocsr()
+    centrality = np.zeros(n)
+    for start in range(0, len(sources), batch_size()):
+        batch = sources[start:start + batch_size()]
+        columns = np.arange(len(batch))
+        depth = np.full((n, len(batch)), -1, dtype=np.int32)
+        sigma = np.zeros((n, len(batch)))
+        depth[batch, columns] = 0
+        sigma[batch, columns] = 1.0
+        frontier = sigma.copy()
+        level = 0
+        # Forward: number of shortest paths from each source, one level at a time
+        while frontier.any():
+            level += 1
+            reached = transposed @ frontier
+            reached[depth >= 0] = 0.0
+            new = reached > 0
+            depth[new] = level
+            sigma[new] = reached[new]
+            frontier = reached
+        # Backward: accumulate the dependencies from the deepest level
+        delta = np.zeros((n, len(batch)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for current in range(level - 1, 0, -1):
+                coefficient = np.where(depth == current, (1.0 + delta) / sigma, 0.0)
+                delta += np.where(depth == current - 1, sigma * (graph @ coefficient), 0.0)
+        delta[batch, columns] = 0.0
+        centrality += delta.sum(axis=1)
+    return centrality
+
+
+def compute_metrics(snapshot):
+    """Dict of the metrics of every node of a snapshot, as arrays indexed by node"""
+    np, sparse, csgraph = _modules()
+    n = snapshot.n
+    interfaces, graph = _matrices(snapshot, np, sparse)
+    fan_out = np.diff(interfaces.indptr)
+    fan_in = np.bincount(interfaces.indices, minlength=n)
+
+    count, labels = csgraph.connected_components(graph, directed=True, connection="weak")
+    component_size = np.bincount(labels, minlength=count)[labels]
+
+    sources = np.arange(n)
+    if n > samples():
+        sources = np.sort(np.random.default_rng(0).choice(n, samples(), replace=False))
+    centrality = _betweenness(graph, sources, np)
+    if len(sources):
+        centrality *= n / len(sources)
+    if n > 2:
+        centrality /= (n - 1) * (n - 2)
+
+    return {
+        "fan_in": fan_in,
+        "fan_out": fan_out,
+        "centrality": centrality,
+        "component_size": component_size,
+        "components": count,
+        "exact": len(sources) == n,
+    }
+
+
+def version_metrics(version_id):
+    """
+    Metrics of the elements of a version: a dict with the change sequence they were
+    computed at and the metrics of each element, from the cache when the graph has
+    not changed.
+    """
+    snapshot = load_snapshot(version_id)
+    cache = caches[getattr(settings, "DIAGRAM_RESPONSE_CACHE", "default")]
+    key = f"diagram:graph-metrics:{version_id}:{snapshot.sequence}:{samples()}"
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    metrics = compute_metrics(snapshot)
+    result = {
+        "sequence": snapshot.sequence,
+        "nodes": snapshot.n,
+        "edges": snapshot.m,
+        "components": int(metrics["components"]),
+        "exact": metrics["exact"],
+        "elements": [
+            {
+                "id": snapshot.uuid(node),
+                "kind": snapshot.kind(node),
+                "name": snapshot.name(node),
+                "fan_in": int(metrics["fan_in"][node]),
+                "fan_out": int(metrics["fan_out"][node]),
+                "centrality": float(metrics["centrality"][node]),
+                "component_size": int(metrics["component_size"][node]),
+            }
+            for node in range(snapshot.n)
+        ],
+    }
+    cache.set(key, result, getattr(settings, "DIAGRAM_RESPONSE_CACHE_TIMEOUT", 600))
+    return result
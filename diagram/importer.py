@@ -0,0 +1,239 @@
+"""
+Streaming import of a SUT model written as NDJSON (one JSON object per line)::
+
+    {"type": "component", "key": "router", "name": "Router", "availability": true}
+    {"type": "port", "key": "router/eth0", "name": "eth0", "component": "router"}
+    {"type": "interface", "key": "link-1", "name": "uplink", "port_from": "router/eth0", "port_to_port": "switch/1"}
+    {"type": "parameter", "component": "router", "name": "ip", "value": "10.0.0.1", "parameter_type": "IP"}
+
+``key`` is any string unique in the file, used by the other lines to reference the
+element; a reference may also be the uuid of an element already in the version.
+The parent of a sub-component, port or parameter must appear before it. Interface
+ends are resolved in a second pass, so interfaces may come before their ports.
+``parameter_type`` is the name or the id of a ParameterType.
+
+Lines are parsed one at a time and inserted with bulk_create in batches of
+batch_size, so the memory used is the batch plus the key -> uuid map of the
+imported elements and their pending interface ends, whatever the size of the file. Invalid lines are reported with
+their line number and skipped (or roll back the whole import when strict).
+"""
+import json
+from collections import Counter, defaultdict
+from uuid import UUID
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from uuid6 import uuid7
+
+from .batch import FIELDS, MODELS, REFERENCES, TYPE_ORDER
+from .caches import parameter_types
+from .changes import lock_version, record_changes
+from .cia import recompute_version
+from .models import Component, Interface, Parameter
+from .signals import notify_version_changed
+
+
+DEFAULT_BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+# Interface ends are nullable and resolved once every element is inserted
+DEFERRED_REFERENCES = ("port_from", "port_to_port", "port_to_subcomponent")
+
+
+class ImportAborted(Exception):
+    """Raised inside the transaction of a strict import to roll it back"""
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = Counter()
+        self.errors = []
+        self.error_count = 0
+
+    def error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_number, "message": message})
+
+    def as_dict(self):
+        return {"created": dict(self.created), "errors": self.errors, "error_count": self.error_count}
+
+
+class LineError(Exception):
+    pass
+
+
+def _uuid(value):
+    try:
+        return UUID(str(value))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class NDJSONImporter:
+    def __init__(self, version_id, batch_size=DEFAULT_BATCH_SIZE):
+        self.version_id = version_id
+        self.batch_size = batch_size
+        self.report = ImportReport()
+        self.keys = {}
+        self.existing = {}
+        self.parameter_types = {}
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+        self.deferred = []
+        self.parents = set()
+        self.line_number = None
+
+    def run(self, lines, strict=False):
+        """Import an iterable of NDJSON lines (str or bytes) and return the report"""
+        try:
+            with transaction.atomic():
+                # The Version is locked before the element rows, as in every write path
+                lock_version(self.version_id)
+                for line_number, line in enumerate(lines, start=1):
+                    if isinstance(line, bytes):
+                        line = line.decode("utf-8")
+                    if not line.strip():
+                        continue
+                    self.line_number = line_number
+                    try:
+                        self.add(json.loads(line))
+                    except (LineError, ValueError) as e:
+                        self.report.error(line_number, str(e))
+                self.flush()
+                self.resolve_deferred()
+                # The imported elements may be connected to existing ones
+                recompute_version(self.version_id)
+                if strict and self.report.error_count:
+                    raise ImportAborted()
+                if self.parents:
+                    # Existing components get new children
+                    Component.bump_revision(pk__in=self.parents)
+                notify_version_changed(self.version_id)
+        except ImportAborted:
+            self.report.created.clear()
+        return self.report
+
+    def add(self, row):
+        if not isinstance(row, dict):
+            raise LineError("A line must be a JSON object")
+        element_type = row.get("type")
+        if element_type == "parameter":
+            self.buffers["parameter"].append(self.build_parameter(row))
+        elif element_type in MODELS:
+            instance = self.build_element(element_type, row)
+            self.buffers[element_type].append(instance)
+        else:
+            raise LineError(f"Unknown type {element_type!r}")
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def resolve(self, value, target_type):
+        """uuid of the element referenced by a key of the file or an existing uuid"""
+        if value in (None, ""):
+            return None
+        if str(value) in self.keys:
+            element_type, pk = self.keys[str(value)]
+            if element_type != target_type:
+                raise LineError(f"{value!r} is not a {target_type}")
+            return pk
+        pk = _uuid(value)
+        if pk is None:
+            raise LineError(f"Unknown reference {value!r}")
+        if (target_type, pk) not in self.existing:
+            self.existing[(target_type, pk)] = MODELS[target_type].objects.filter(
+                pk=pk, version=self.version_id
+            ).exists()
+        if not self.existing[(target_type, pk)]:
+            raise LineError(f"{target_type} {value} does not exist in this version")
+        if target_type == "component":
+            self.parents.add(pk)
+        return pk
+
+    def build_element(self, element_type, row):
+        key = row.get("key")
+        if key is not None and str(key) in self.keys:
+            raise LineError(f"Duplicate key {key!r}")
+
+        model = MODELS[element_type]
+        instance = model(id=uuid7(), version_id=self.version_id)
+        for field_name in FIELDS[element_type]:
+            if field_name in row:
+                setattr(instance, field_name, row[field_name])
+        deferred = []
+        for field_name, target_type in REFERENCES[element_type].items():
+            if field_name in DEFERRED_REFERENCES:
+                if row.get(field_name) not in (None, ""):
+                    deferred.append((self.line_number, instance.id, field_name, row[field_name], target_type))
+            else:
+                setattr(instance, f"{field_name}_id", self.resolve(row.get(field_name), target_type))
+                if getattr(instance, f"{field_name}_id") is None:
+                    raise LineError(f"{field_name} is required")
+        try:
+            instance.clean_fields(exclude=["version", "images", *REFERENCES[element_type]])
+            instance.clean()
+        except ValidationError as e:
+            raise LineError(e.message_dict if hasattr(e, "error_dict") else e.messages)
+
+        if key is not None:
+            self.keys[str(key)] = (element_type, instance.id)
+        self.deferred += deferred
+        return instance
+
+    def build_parameter(self, row):
+        owners = [field_name for field_name in Parameter.OWNER_FIELDS if row.get(field_name) not in (None, "")]
+        if len(owners) != 1:
+            raise LineError("A parameter needs exactly one of " + ", ".join(Parameter.OWNER_FIELDS))
+        owner_field = owners[0]
+        owner_id = self.resolve(row[owner_field], owner_field)
+
+        type_ref = row.get("parameter_type")
+        if not isinstance(type_ref, str):
+            raise LineError("parameter_type must be the name or the id of a parameter type")
+        if type_ref not in self.parameter_types:
+            type_id = _uuid(type_ref)
+            parameter_type = parameter_types.get_by_id(type_id) if type_id else parameter_types.get_by_name(type_ref)
+            # Remember the misses too, to not reload the catalogue for every line
+            self.parameter_types[type_ref] = parameter_type
+        parameter_type = self.parameter_types[type_ref]
+        if parameter_type is None:
+            raise LineError(f"Unknown parameter type {type_ref!r}")
+
+        return Parameter(
+            id=uuid7(),
+            version_id=self.version_id,
+            name=row.get("name", ""),
+            value=row.get("value", ""),
+            secret=bool(row.get("secret", False)),
+            parameter_type_id=parameter_type.id,
+            **{f"{owner_field}_id": owner_id},
+        )
+
+    def flush(self):
+        # Parents first: the rows of a batch may reference each other
+        for element_type in (*TYPE_ORDER, "parameter"):
+            rows = self.buffers.pop(element_type, [])
+            if rows:
+                model = Parameter if element_type == "parameter" else MODELS[element_type]
+                model.objects.bulk_create(rows, batch_size=self.batch_size)
+                record_changes(self.version_id, element_type, [row.id for row in rows], locked=True)
+                self.report.created[element_type] += len(rows)
+        self.buffered = 0
+
+    def resolve_deferred(self):
+        """Second pass: set the interface ends, field by field, in batches"""
+        updates = defaultdict(list)
+        for line_number, interface_id, field_name, value, target_type in self.deferred:
+            try:
+                updates[field_name].append(
+                    Interface(id=interface_id, **{f"{field_name}_id": self.resolve(value, target_type)})
+                )
+            except LineError as e:
+                self.report.error(line_number, f"{field_name}: {e}")
+        self.deferred = []
+        for field_name, interfaces in updates.items():
+            Interface.objects.bulk_update(interfaces, [field_name], batch_size=self.batch_size)
+
+
+def import_ndjson(version_id, lines, batch_size=DEFAULT_BATCH_SIZE, strict=False):
+    return NDJSONImporter(version_id, batch_size).run(lines, strict=strict)
@@ -0,0 +1,214 @@
+"""
+Per-request instrumentation of the diagram endpoints.
+
+Add ``"diagram.instrumentation.DiagramMetricsMiddleware"`` to ``MIDDLEWARE`` to record,
+for every request routed to the diagram app, its latency, SQL query count and time,
+serializer time and response size. The serializer time is measured by the
+serializers of the app, which derive from TimedSerializerMixin. The metrics are
+kept per process and exposed in the Prometheus text format by ``metrics_view``,
+which only answers local clients.
+
+Settings:
+
+- DIAGRAM_SLOW_REQUEST_MS: requests slower than this are logged on the
+  ``diagram.instrumentation`` logger with their most repeated SQL statements
+  (default 1000, None to disable).
+- DIAGRAM_METRICS_ALLOWED_ADDRESSES: client addresses allowed to read the metrics
+  (default localhost only).
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_LOG_TOP_STATEMENTS = 5
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.response_bytes = 0
+
+
+class DiagramMetrics:
+    """Thread-safe registry of the per-route request metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = defaultdict(RouteStats)
+
+    def record(self, route, method, status_code, duration, sql_queries, sql_seconds, serializer_seconds, response_bytes):
+        with self._lock:
+            stats = self._routes[(route, method, str(status_code))]
+            stats.requests += 1
+            index = bisect.bisect_left(LATENCY_BUCKETS, duration)
+            if index < len(LATENCY_BUCKETS):
+                stats.latency_buckets[index] += 1
+            stats.latency_sum += duration
+            stats.sql_queries += sql_queries
+            stats.sql_seconds += sql_seconds
+            stats.serializer_seconds += serializer_seconds
+            stats.response_bytes += response_bytes
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def to_prometheus(self):
+        with self._lock:
+            routes = sorted(self._routes.items())
+
+        def labels(key, **extra):
+            route, method, status_code = key
+            pairs = {"route": route, "method": method, "status": status_code, **extra}
+            return ",".join(f'{name}="{value}"' for name, value in pairs.items())
+
+        lines = [
+            "# HELP diagram_request_duration_seconds Latency of the diagram requests.",
+            "# TYPE diagram_request_duration_seconds histogram",
+        ]
+        for key, stats in routes:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.latency_buckets):
+                cumulative += count
+                lines.append(f"diagram_request_duration_seconds_bucket{{{labels(key, le=bound)}}} {cumulative}")
+            lines.append(f'diagram_request_duration_seconds_bucket{{{labels(key, le="+Inf")}}} {stats.requests}')
+            lines.append(f"diagram_request_duration_seconds_sum{{{labels(key)}}} {stats.latency_sum}")
+            lines.append(f"diagram_request_duration_seconds_count{{{labels(key)}}} {stats.requests}")
+
+        for name, help_text, attribute in (
+            ("diagram_sql_queries_total", "SQL queries issued by the diagram requests.", "sql_queries"),
+            ("diagram_sql_seconds_total", "Time spent in SQL by the diagram requests.", "sql_seconds"),
+            ("diagram_serializer_seconds_total", "Time spent in serializers by the diagram requests.", "serializer_seconds"),
+            ("diagram_response_bytes_total", "Size of the diagram responses.", "response_bytes"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, stats in routes:
+                lines.append(f"{name}{{{labels(key)}}} {getattr(stats, attribute)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = DiagramMetrics()
+
+
+class RequestRecorder:
+    """SQL and serializer measures of the request being processed"""
+
+    def __init__(self):
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.statements = Counter()
+        self.serializer_seconds = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - start
+            self.sql_queries += 1
+            self.statements[sql] += 1
+
+
+_current_recorder = contextvars.ContextVar("diagram_request_recorder", default=None)
+
+
+class TimedSerializerMixin:
+    """Add the time spent in to_representation to the serializer time of the request"""
+
+    def to_representation(self, instance):
+        recorder = _current_recorder.get()
+        if recorder is None:
+            return super().to_representation(instance)
+        # Nested serializers are counted once, by the outermost one
+        recorder.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            recorder.serializer_depth -= 1
+            if recorder.serializer_depth == 0:
+                recorder.serializer_seconds += time.perf_counter() - start
+
+
+def is_diagram_request(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return False
+    return "diagram" in match.app_names or match.func.__module__.startswith("diagram.")
+
+
+class DiagramMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = RequestRecorder()
+        token = _current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(recorder):
+                response = self.get_response(request)
+        finally:
+            _current_recorder.reset(token)
+        duration = time.perf_counter() - start
+
+        if not is_diagram_request(request) or request.resolver_match.url_name == "metrics":
+            return response
+
+        route = request.resolver_match.view_name
+        response_bytes = 0 if response.streaming else len(response.content)
+        metrics.record(
+            route,
+            request.method,
+            response.status_code,
+            duration,
+            recorder.sql_queries,
+            recorder.sql_seconds,
+            recorder.serializer_seconds,
+            response_bytes,
+        )
+
+        slow_ms = getattr(settings, "DIAGRAM_SLOW_REQUEST_MS", 1000)
+        if slow_ms is not None and duration * 1000 >= slow_ms:
+            top = "\n".join(
+                f"  {count} x {sql}" for sql, count in recorder.statements.most_common(SLOW_LOG_TOP_STATEMENTS)
+            )
+            logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, serializers %.0f ms, %d bytes\n%s",
+                request.method,
+                request.get_full_path(),
+                route,
+                duration * 1000,
+                recorder.sql_queries,
+                recorder.sql_seconds * 1000,
+                recorder.serializer_seconds * 1000,
+                response_bytes,
+                top,
+            )
+        return response
+
+
+def metrics_view(request):
+    """Expose the diagram metrics in the Prometheus text format"""
+    allowed = getattr(settings, "DIAGRAM_METRICS_ALLOWED_ADDRESSES", ("127.0.0.1", "::1"))
+    if request.META.get("REMOTE_ADDR") not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.to_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,206 @@
+"""
+Incremental saves of the diagram layout stored in Version.diagram_json.
+
+The layout document saved by the editor looks like::
+
+    {
+        "timestamp": 1700000000000,
+        "graphStructure": {"cells": [<JointJS cell>, ...]},
+        "elementMapping": {"cells": [{"id": <cell id>, "backendId": <uuid>, "type": "port"}, ...]}
+    }
+
+A patch carries only the cells touched since the revision the client last saw::
+
+    {
+        "base_revision": 12,
+        "added": [<cell>, ...],
+        "removed": [<cell id>, ...],
+        "changed": [<cell>, ...] or [{"id": <cell id>, "ops": [<JSON Patch operation>, ...]}, ...],
+        "mapping": [{"id": <cell id>, "backendId": <uuid>, "type": "port"}, ...],
+        "timestamp": 1700000000000
+    }
+
+``changed`` entries either replace the whole cell or apply JSON Patch (RFC 6902)
+``add``, ``replace`` and ``remove`` operations to it.
+"""
+import copy
+import json
+from django.db import transaction
+
+
+class LayoutPatchError(ValueError):
+    pass
+
+
+class StaleLayoutRevision(Exception):
+    """The patch was computed from an older revision than the current one"""
+
+    def __init__(self, revision):
+        super().__init__(f"The diagram has changed since the base revision (current revision {revision})")
+        self.revision = revision
+
+
+def empty_document():
+    return {"graphStructure": {"cells": []}, "elementMapping": {"cells": []}}
+
+
+def load_document(raw):
+    """Parse Version.diagram_json, which is stored as a JSON string"""
+    if not raw:
+        return empty_document()
+    document = json.loads(raw) if isinstance(raw, str) else copy.deepcopy(raw)
+    document.setdefault("graphStructure", {}).setdefault("cells", [])
+    document.setdefault("elementMapping", {}).setdefault("cells", [])
+    return document
+
+
+def dump_document(document, like=None):
+    """Serialize the document the way the previous value was stored"""
+    if like is not None and not isinstance(like, str):
+        return document
+    return json.dumps(document, separators=(",", ":"))
+
+
+def _pointer_tokens(path):
+    if path == "":
+        return []
+    if not path.startswith("/"):
+        raise LayoutPatchError(f"Invalid JSON pointer {path!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+
+
+def _child(container, token, path):
+    try:
+        if isinstance(container, list):
+            return container[int(token)]
+        return container[token]
+    except (KeyError, IndexError, ValueError, TypeError):
+        raise LayoutPatchError(f"Path {path!r} does not exist")
+
+
+def apply_operations(cell, operations):
+    """Apply JSON Patch add/replace/remove operations to a cell"""
+    for operation in operations:
+        op = operation.get("op")
+        path = operation.get("path", "")
+        tokens = _pointer_tokens(path)
+        if not tokens or tokens == ["id"]:
+            raise LayoutPatchError(f"Operation on {path!r} is not allowed")
+
+        parent = cell
+        for token in tokens[:-1]:
+            parent = _child(parent, token, path)
+        last = tokens[-1]
+
+        if op in ("add", "replace"):
+            if "value" not in operation:
+                raise LayoutPatchError(f"Operation {op} on {path!r} has no value")
+            value = operation["value"]
+            if isinstance(parent, list):
+                if last == "-" and op == "add":
+                    parent.append(value)
+                    continue
+                index = int(last) if last.isdigit() else None
+                if index is None or index > len(parent) or (op == "replace" and index == len(parent)):
+                    raise LayoutPatchError(f"Path {path!r} does not exist")
+                if op == "add":
+                    parent.insert(index, value)
+                else:
+                    parent[index] = value
+            elif isinstance(parent, dict):
+                if op == "replace" and last not in parent:
+                    raise LayoutPatchError(f"Path {path!r} does not exist")
+                parent[last] = value
+            else:
+                raise LayoutPatchError(f"Path {path!r} does not exist")
+        elif op == "remove":
+            _child(parent, last, path)
+            if isinstance(parent, list):
+                del parent[int(last)]
+            else:
+                del parent[last]
+        else:
+            raise LayoutPatchError(f"Unsupported operation {op!r}")
+    return cell
+
+
+def apply_patch(document, patch):
+    """Apply a cell patch to a layout document and return the new document"""
+    document = copy.deepcopy(document)
+    cells = document["graphStructure"]["cells"]
+    mapping = document["elementMapping"]["cells"]
+
+    removed = set(patch.get("removed") or [])
+    existing = {cell.get("id") for cell in cells}
+    for cell_id in removed:
+        if cell_id not in existing:
+            raise LayoutPatchError(f"Cell {cell_id} does not exist")
+    if removed:
+        cells[:] = [cell for cell in cells if cell.get("id") not in removed]
+        mapping[:] = [entry for entry in mapping if entry.get("id") not in removed]
+
+    index = {cell.get("id"): position for position, cell in enumerate(cells)}
+    for change in patch.get("changed") or []:
+        cell_id = change.get("id") if isinstance(change, dict) else None
+        if cell_id not in index:
+            raise LayoutPatchError(f"Cell {cell_id} does not exist")
+        if "ops" in change:
+            apply_operations(cells[index[cell_id]], change["ops"])
+        else:
+            cells[index[cell_id]] = change
+
+    for cell in patch.get("added") or []:
+        cell_id = cell.get("id") if isinstance(cell, dict) else None
+        if cell_id is None:
+            raise LayoutPatchError("Added cells need an id")
+        if cell_id in index:
+            raise LayoutPatchError(f"Cell {cell_id} already exists")
+        index[cell_id] = len(cells)
+        cells.append(cell)
+
+    mapping_index = {entry.get("id"): position for position, entry in enumerate(mapping)}
+    for entry in patch.get("mapping") or []:
+        if entry.get("id") in mapping_index:
+            mapping[mapping_index[entry["id"]]] = entry
+        else:
+            mapping_index[entry.get("id")] = len(mapping)
+            mapping.append(entry)
+
+    if "timestamp" in patch:
+        document["timestamp"] = patch["timestamp"]
+    return document
+
+
+def read_layout(version_id):
+    """Return the layout document of a version and its revision"""
+    from .models import DiagramLayout, Version
+
+    version = Version.objects.get(pk=version_id)
+    layout = DiagramLayout.objects.filter(version=version).first()
+    return load_document(version.diagram_json), (layout.revision if layout else 0), version.diagram_json
+
+
+def write_layout(version_id, base_revision, build):
+    """
+    Atomically replace the layout of a version by ``build(current document)``.
+
+    Raises StaleLayoutRevision when base_revision is given and is not the current
+    revision. Returns the new revision.
+    """
+    from .models import DiagramLayout, Version
+    from .realtime import broadcast_layout
+    from .viewport import sync_cell_layouts
+
+    with transaction.atomic():
+        version = Version.objects.select_for_update().get(pk=version_id)
+        layout, _ = DiagramLayout.objects.select_for_update().get_or_create(version=version)
+        if base_revision is not None and base_revision != layout.revision:
+            raise StaleLayoutRevision(layout.revision)
+        document = build(load_document(version.diagram_json))
+        version.diagram_json = dump_document(document, like=version.diagram_json)
+        version.save(update_fields=["diagram_json"])
+        sync_cell_layouts(version_id, document)
+        layout.revision += 1
+        layout.save(update_fields=["revision"])
+        broadcast_layout(version_id, layout.revision)
+    return layout.revision
@@ -0,0 +1,210 @@
+"""
+Optional write-behind buffer of the diagram layout saves.
+
+By default every layout save is written to the database at once, with the revision
+check of write_layout: the buffer is off. It is opt-in, for deployments where the
+saves of a version always reach the same worker process (a single worker or
+sticky sessions).
+
+Once enabled, instead of writing the whole Version.diagram_json on every drag end
+and resize, the saves are applied to an in-process copy of the layout of the
+version and acknowledged at once with the new revision. The buffered layouts are
+written to the database at most once per flush interval, on process shutdown and
+on an explicit flush. Until then they are only visible through GET diagram-json
+(the editor reads the layout there) and the diagram views, which flush first; the
+Version representation of the api app shows the last flushed layout.
+
+Settings:
+
+- DIAGRAM_LAYOUT_FLUSH_INTERVAL: seconds a save may stay buffered before it is
+  written (default 0: no buffer).
+
+The revision check of a buffered patch is made against the buffer of the worker.
+A flush compares the revision stored in the database with the one the buffered
+saves started from, under the row lock: when another worker wrote meanwhile, the
+buffered saves are replayed over the stored layout. If a patch no longer applies,
+the buffered saves are lost: the error is logged and the stored revision is
+broadcast, so that the editors reload the layout. This is the trade-off of
+enabling the buffer without sticky sessions.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .layout import LayoutPatchError, StaleLayoutRevision, dump_document, load_document, read_layout, write_layout
+from .realtime import broadcast_layout
+
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedLayout:
+    def __init__(self, document, revision):
+        self.document = document
+        self.revision = revision
+        # Revision stored in the database when the buffered saves started
+        self.base_revision = revision
+        # Saves not written yet, replayed if another worker wrote meanwhile
+        self.pending = []
+        self.dirty = False
+        self.lock = threading.Lock()
+
+
+class LayoutWriteBehindBuffer:
+    """Per-version buffer of the layout saves, flushed on a timer"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._timer = None
+
+    @property
+    def interval(self):
+        return getattr(settings, "DIAGRAM_LAYOUT_FLUSH_INTERVAL", 0)
+
+    def _entry(self, version_id):
+        with self._lock:
+            entry = self._entries.get(version_id)
+        if entry is not None:
+            return entry
+        document, revision, _ = read_layout(version_id)
+        with self._lock:
+            return self._entries.setdefault(version_id, BufferedLayout(document, revision))
+
+    def read(self, version_id):
+        """Return the buffered (document, revision) of a version, or None"""
+        with self._lock:
+            entry = self._entries.get(version_id)
+        if entry is None:
+            return None
+        with entry.lock:
+            return entry.document, entry.revision
+
+    def write(self, version_id, base_revision, build):
+        """
+        Replace the layout of a version by ``build(current document)`` and return
+        the new revision. Raises StaleLayoutRevision when base_revision is given and
+        is not the current revision.
+        """
+        if not self.interval:
+            revision = write_layout(version_id, base_revision, build)
+            self.discard(version_id)
+            return revision
+
+        while True:
+            entry = self._entry(version_id)
+            with entry.lock:
+                with self._lock:
+                    # The entry may have been flushed and dropped meanwhile
+                    if self._entries.get(version_id) is not entry:
+                        continue
+                revision = self._apply(entry, base_revision, build)
+                break
+        self._schedule()
+        # Les autres clients lisent le layout en attente par GET diagram-json
+        broadcast_layout(version_id, revision)
+        return revision
+
+    def _apply(self, entry, base_revision, build):
+        if base_revision is not None and base_revision != entry.revision:
+            raise StaleLayoutRevision(entry.revision)
+        entry.document = build(entry.document)
+        entry.pending.append(build)
+        entry.revision += 1
+        entry.dirty = True
+        return entry.revision
+
+    def discard(self, version_id):
+        with self._lock:
+            self._entries.pop(version_id, None)
+
+    def _schedule(self):
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.interval, self._flush_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not flush the buffered diagram layouts")
+        finally:
+            close_old_connections()
+
+    def flush(self, version_id=None):
+        """Write the buffered layouts (or the one of version_id) to the database"""
+        with self._lock:
+            if version_id is None:
+                entries = list(self._entries.items())
+            else:
+                entries = [(version_id, self._entries[version_id])] if version_id in self._entries else []
+
+        flushed = 0
+        for key, entry in entries:
+            with entry.lock:
+                if entry.dirty:
+                    try:
+                        self._store(key, entry)
+                        flushed += 1
+                    except LayoutPatchError:
+                        logger.error(
+                            "Dropped %s buffered layout saves of version %s: the layout was changed by another worker",
+                            len(entry.pending), key,
+                        )
+                        # Les éditeurs rechargent le layout enregistré
+                        self._broadcast_stored(key)
+                    entry.dirty = False
+                    entry.pending = []
+                # Les layouts écrits sont oubliés et relus au prochain enregistrement
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+        return flushed
+
+    def _store(self, version_id, entry):
+        from .models import DiagramLayout, Version
+        from .viewport import sync_cell_layouts
+
+        with transaction.atomic():
+            version = Version.objects.select_for_update().get(pk=version_id)
+            layout, _ = DiagramLayout.objects.select_for_update().get_or_create(version=version)
+            document, revision = entry.document, entry.revision
+            if layout.revision != entry.base_revision:
+                # Another worker wrote the layout since the buffered saves started
+                document = load_document(version.diagram_json)
+                for build in entry.pending:
+                    document = build(document)
+                revision = layout.revision + len(entry.pending)
+            version.diagram_json = dump_document(document, like=version.diagram_json)
+            version.save(update_fields=["diagram_json"])
+            sync_cell_layouts(version_id, document)
+            layout.revision = revision
+            layout.save(update_fields=["revision"])
+            if revision != entry.revision:
+                broadcast_layout(version_id, revision)
+
+
+    def _broadcast_stored(self, version_id):
+        from .models import DiagramLayout
+
+        revision = DiagramLayout.objects.filter(version=version_id).values_list("revision", flat=True).first()
+        broadcast_layout(version_id, revision or 0)
+
+
+layout_buffer = LayoutWriteBehindBuffer()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        layout_buffer.flush()
+    except Exception:
+        logger.exception("Could not flush the buffered diagram layouts at exit")
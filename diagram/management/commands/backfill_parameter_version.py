@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from diagram.models import Component, SubComponent, Port, Interface, Parameter
+
+
+class Command(BaseCommand):
+    help = "Fill Parameter.version from the version of the element owning each parameter"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for owner_field, model in (
+                ("component", Component),
+                ("subcomponent", SubComponent),
+                ("port", Port),
+                ("interface", Interface),
+            ):
+                owner_version = model.objects.filter(pk=OuterRef(owner_field)).values("version")[:1]
+                updated = Parameter.objects.filter(**{f"{owner_field}__isnull": False}).update(
+                    version=Subquery(owner_version)
+                )
+                self.stdout.write(f"{updated} {owner_field} parameters updated")
+        self.stdout.write(self.style.SUCCESS("Parameter versions backfilled"))
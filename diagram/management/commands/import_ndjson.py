@@ -0,0 +1,32 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from api.models import Version
+from diagram.importer import DEFAULT_BATCH_SIZE, import_ndjson
+
+
+class Command(BaseCommand):
+    help = "Import the components, sub-components, ports, interfaces and parameters of an NDJSON file into a Version"
+
+    def add_arguments(self, parser):
+        parser.add_argument("version", help="uuid of the target Version")
+        parser.add_argument("path", help="NDJSON file, - for the standard input")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument("--strict", action="store_true", help="Import nothing if a line is invalid")
+
+    def handle(self, *args, **options):
+        if not Version.objects.filter(pk=options["version"]).exists():
+            raise CommandError(f"Version {options['version']} does not exist")
+
+        if options["path"] == "-":
+            report = import_ndjson(options["version"], sys.stdin.buffer, options["batch_size"], options["strict"])
+        else:
+            with open(options["path"], "rb") as lines:
+                report = import_ndjson(options["version"], lines, options["batch_size"], options["strict"])
+
+        for error in report.errors:
+            self.stderr.write(f"line {error['line']}: {error['message']}")
+        for element_type, count in report.created.items():
+            self.stdout.write(f"{count} {element_type} created")
+        if report.error_count:
+            raise CommandError(f"{report.error_count} invalid lines")
+        self.stdout.write(self.style.SUCCESS("Import done"))
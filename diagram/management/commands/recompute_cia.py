@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.models import Version
+from diagram.cia import recompute_version
+
+
+class Command(BaseCommand):
+    help = "Recompute the effective availability, confidentiality and integrity requirements of the diagram elements"
+
+    def add_arguments(self, parser):
+        parser.add_argument("versions", nargs="*", help="uuids of the Versions, every Version by default")
+
+    def handle(self, *args, **options):
+        versions = options["versions"] or Version.objects.values_list("pk", flat=True)
+        for version_id in versions:
+            if not Version.objects.filter(pk=version_id).exists():
+                raise CommandError(f"Version {version_id} does not exist")
+            with transaction.atomic():
+                computed = recompute_version(version_id)
+            self.stdout.write(f"{len(computed)} elements of version {version_id} recomputed")
+        self.stdout.write(self.style.SUCCESS("CIA requirements recomputed"))
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from uuid6 import uuid7
 from django.core.exceptions import ValidationError
 from django.contrib.contenttypes.fields import GenericForeignKey
@@ -28,6 +28,19 @@ class Element(models.Model):
         blank=True,
         null=True,
     )
+    # Change token, incremented whenever the element, its parameters, its images
+    # or the related elements shown in its representations change
+    revision = models.PositiveIntegerField(default=0, editable=False)
+    # Sequence (ChangeEvent id) of the last change of the element
+    change_seq = models.PositiveBigIntegerField(default=0, editable=False, db_index=True)
+    # Effective CIA requirements: the element's own ones plus those inherited from
+    # its parts and interfaces, maintained by diagram.cia
+    effective_availability = models.BooleanField(default=False, editable=False)
+    effective_confidentiality = models.BooleanField(default=False, editable=False)
+    effective_integrity = models.BooleanField(default=False, editable=False)
+
+    # Interface fields referencing the model: the interfaces show their ends
+    INTERFACE_ENDS = ()
 
     class Meta:
         abstract = True
@@ -35,6 +48,50 @@ class Element(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        from .changes import lock_version, record_changes
+
+        adding = self._state.adding
+        if adding:
+            self.revision = (self.revision or 0) + 1
+        else:
+            # Incremented by the database: concurrent saves never share a revision
+            self.revision = models.F("revision") + 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = [*update_fields, *({"revision", "change_seq"} - set(update_fields))]
+        with transaction.atomic():
+            # The Version is locked before the element row, as in every write path
+            lock_version(self.version_id)
+            sequence = record_changes(self.version_id, self._meta.model_name, [self.pk], locked=True, stamp=False)
+            if sequence is not None:
+                self.change_seq = sequence
+            super().save(*args, **kwargs)
+        if not adding:
+            self.refresh_from_db(fields=["revision"])
+
+    def delete(self, *args, **kwargs):
+        from .changes import lock_version
+
+        with transaction.atomic():
+            lock_version(self.version_id)
+            return super().delete(*args, **kwargs)
+
+    @classmethod
+    def bump_revision(cls, *conditions, **filters):
+        """Increment the revision of the elements matching the filters, and of the interfaces showing them"""
+        if cls.INTERFACE_ENDS:
+            cls.bump_interfaces(cls.objects.filter(*conditions, **filters).values("pk"))
+        return cls.objects.filter(*conditions, **filters).update(revision=models.F("revision") + 1)
+
+    @classmethod
+    def bump_interfaces(cls, elements):
+        """Increment the revision of the interfaces ending at elements (ids or a queryset)"""
+        condition = models.Q()
+        for field_name in cls.INTERFACE_ENDS:
+            condition |= models.Q(**{f"{field_name}__in": elements})
+        return Interface.bump_revision(condition)
+
 
 class Component(Element):
     """
@@ -56,6 +113,8 @@ class SubComponent(Element):
         Component, on_delete=models.CASCADE, related_name="subcomponents"
     )
 
+    INTERFACE_ENDS = ("port_to_subcomponent",)
+
     class Meta:
         db_table = "subcomponent"
 
@@ -72,6 +131,8 @@ class Port(Element):
         Component, on_delete=models.CASCADE, related_name="ports"
     )
 
+    INTERFACE_ENDS = ("port_from", "port_to_port")
+
     class Meta:
         db_table = "port"
 
@@ -116,7 +177,24 @@ class Interface(Element):
         db_table = "interface"
 
     def clean(self):
-        pass
+        """
+        Checks that need no query: the related ends are only compared when they are
+        already loaded (see diagram.validation for the checks of a whole Version).
+        """
+        errors = {}
+        if self.port_to_port_id is not None and self.port_to_subcomponent_id is not None:
+            errors["port_to_subcomponent"] = "An interface targets either a port or a sub-component, not both"
+        if self.port_from_id is not None and self.port_from_id == self.port_to_port_id:
+            errors["port_to_port"] = "An interface cannot go from a port to the same port"
+        for field_name in ("port_from", "port_to_port", "port_to_subcomponent"):
+            if field_name in errors or getattr(self, f"{field_name}_id") is None:
+                continue
+            if self._meta.get_field(field_name).is_cached(self):
+                end = getattr(self, field_name)
+                if end is not None and end.version_id != self.version_id:
+                    errors[field_name] = "The ends of an interface must belong to its version"
+        if errors:
+            raise ValidationError(errors)
 
     def __str__(self):
         return f"{self.port_from} <--> {self.port_to_port or self.port_to_subcomponent}"
@@ -153,6 +231,8 @@ class Parameter(models.Model):
     )
     secret = models.BooleanField(default=False)
     value = models.TextField(blank=True, null=True)
+    # Sequence (ChangeEvent id) of the last change of the parameter
+    change_seq = models.PositiveBigIntegerField(default=0, editable=False, db_index=True)
     parameter_type = models.ForeignKey(
         ParameterType,
         on_delete=models.CASCADE,
@@ -184,9 +264,172 @@ class Parameter(models.Model):
         null=True,
         blank=True,
     )
+    # Version of the owning element, denormalised for fast per-version filtering
+    version = models.ForeignKey(
+        Version,
+        on_delete=models.CASCADE,
+        related_name="parameter",
+        null=True,
+        blank=True,
+    )
+
+    OWNER_FIELDS = ("component", "subcomponent", "port", "interface")
 
     class Meta:
         db_table = "parameter"
+        indexes = [models.Index(fields=["version", "id"])]
 
     def __str__(self):
         return f"{self.name}"
+
+    def owner_version_id(self):
+        """Return the version id of the element owning the parameter"""
+        for field_name in self.OWNER_FIELDS:
+            if getattr(self, f"{field_name}_id") is None:
+                continue
+            field = self._meta.get_field(field_name)
+            if field.is_cached(self):
+                return getattr(self, field_name).version_id
+            return (
+                field.related_model.objects.filter(pk=getattr(self, f"{field_name}_id"))
+                .values_list("version", flat=True)
+                .first()
+            )
+        return None
+
+    def save(self, *args, **kwargs):
+        from .changes import lock_version, record_changes
+
+        self.version_id = self.owner_version_id()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = [*update_fields, *({"version", "change_seq"} - set(update_fields))]
+        with transaction.atomic():
+            # The Version is locked before the parameter and owner rows, as in every write path
+            lock_version(self.version_id)
+            sequence = record_changes(self.version_id, "parameter", [self.pk], locked=True, stamp=False)
+            if sequence is not None:
+                self.change_seq = sequence
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        from .changes import lock_version
+
+        with transaction.atomic():
+            lock_version(self.version_id)
+            return super().delete(*args, **kwargs)
+
+
+
+class DiagramLayout(models.Model):
+    """
+    The diagram layout class tracks the revision of the layout (Version.diagram_json)
+    of a version, so that incremental saves are applied on top of the state the client
+    last saw.
+    """
+    version = models.OneToOneField(
+        Version,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="diagram_layout",
+    )
+    revision = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "diagram_layout"
+
+    def __str__(self):
+        return f"{self.version_id} - {self.revision}"
+
+
+class CellLayout(models.Model):
+    """
+    The cell layout class stores the geometry of one cell of the diagram layout of a
+    version, extracted from Version.diagram_json on every layout write, so that the
+    cells visible in a viewport can be queried without loading the whole layout.
+    """
+    version = models.ForeignKey(
+        Version,
+        on_delete=models.CASCADE,
+        related_name="cell_layouts",
+    )
+    cell_id = models.CharField(max_length=255)
+    backend_id = models.UUIDField(blank=True, null=True, db_index=True)
+    element_type = models.CharField(max_length=32, blank=True)
+    x = models.FloatField(default=0)
+    y = models.FloatField(default=0)
+    width = models.FloatField(default=0)
+    height = models.FloatField(default=0)
+    parent = models.CharField(max_length=255, blank=True, null=True)
+    z = models.IntegerField(default=0)
+    # Cells covering too many tiles are not in the tile index and always checked
+    oversized = models.BooleanField(default=False)
+    cell = models.JSONField()
+
+    class Meta:
+        db_table = "diagram_cell_layout"
+        constraints = [
+            models.UniqueConstraint(fields=["version", "cell_id"], name="diagram_cell_layout_unique_cell"),
+        ]
+
+    def __str__(self):
+        return f"{self.version_id} - {self.cell_id}"
+
+
+class CellLayoutTile(models.Model):
+    """
+    The cell layout tile class is the grid index of the cell layouts: one row for each
+    tile of DIAGRAM_LAYOUT_TILE_SIZE units covered by the bounding box of a cell.
+    """
+    layout = models.ForeignKey(
+        CellLayout,
+        on_delete=models.CASCADE,
+        related_name="tiles",
+    )
+    version = models.ForeignKey(
+        Version,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    tile_x = models.IntegerField()
+    tile_y = models.IntegerField()
+
+    class Meta:
+        db_table = "diagram_cell_layout_tile"
+        indexes = [
+            models.Index(fields=["version", "tile_x", "tile_y"]),
+        ]
+
+
+class ChangeEvent(models.Model):
+    """
+    The change event class is the append-only log of the changes of the diagram
+    elements and parameters of a version. Its id is the change sequence used as the
+    cursor of the change feed; deleted elements are kept as "delete" tombstones.
+    """
+    UPSERT = "upsert"
+    DELETE = "delete"
+    OPERATION_CHOICES = [
+        (UPSERT, "Created or updated"),
+        (DELETE, "Deleted"),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    # Sans contrainte : les événements sont écrits pendant la suppression en cascade d'une version
+    version = models.ForeignKey(
+        Version,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+    )
+    element_type = models.CharField(max_length=32)
+    element_id = models.UUIDField()
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES)
+
+    class Meta:
+        db_table = "diagram_change_event"
+        indexes = [
+            models.Index(fields=["version", "id"]),
+        ]
+
+    def __str__(self):
+        return f"{self.id} {self.operation} {self.element_type} {self.element_id}"
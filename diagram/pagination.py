@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination
+
+
+class UUIDCursorPagination(CursorPagination):
+    """
+    Keyset pagination ordered by the uuid7 primary key.
+
+    uuid7 ids are time-ordered and unique, so the cursor is simply the last id seen:
+    pages stay stable under concurrent inserts and never scan with OFFSET.
+    Pagination is opt-in, it only applies when the request carries a ``cursor`` or
+    ``page_size`` query parameter, so existing clients still receive the whole list.
+    """
+    ordering = "id"
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
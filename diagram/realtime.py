@@ -0,0 +1,70 @@
+"""
+Push of the changes of a Version to the browsers editing it, over Channels.
+
+Each Version has a channel group; the ChangeEvents (see diagram.changes) and the
+layout saves are broadcast to it once their transaction is committed, as compact
+events::
+
+    {"type": "port", "id": "<uuid>", "op": "upsert", "seq": 1234}
+    {"type": "layout", "op": "update", "revision": 12}
+    {"type": "bulk", "op": "upsert", "seq": 1300}
+
+A bulk event replaces the events of a write touching more than
+MAX_BROADCAST_EVENTS elements: the client then reads the change feed.
+
+Channels is optional: without it, or without a channel layer, nothing is sent.
+A single node can use the in-memory layer::
+
+    CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+and route ``diagram.routing.websocket_urlpatterns`` in the ASGI application.
+"""
+import logging
+
+from django.db import transaction
+
+try:
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+except ImportError:  # pragma: no cover - Channels is not installed
+    get_channel_layer = None
+
+
+logger = logging.getLogger(__name__)
+
+MAX_BROADCAST_EVENTS = 200
+
+
+def group_name(version_id):
+    return f"diagram.version.{version_id}"
+
+
+def _send(version_id, events):
+    layer = get_channel_layer() if get_channel_layer is not None else None
+    if layer is None:
+        return
+    try:
+        async_to_sync(layer.group_send)(group_name(version_id), {"type": "diagram.change", "events": events})
+    except Exception:
+        # Les notifications ne doivent jamais faire échouer l'enregistrement
+        logger.exception("Could not broadcast the changes of version %s", version_id)
+
+
+def broadcast(version_id, events):
+    """Send the events to the group of the version once the transaction is committed"""
+    if get_channel_layer is None or version_id is None or not events:
+        return
+    if len(events) > MAX_BROADCAST_EVENTS:
+        last = events[-1]
+        events = [{"type": "bulk", "op": last.get("op"), "seq": last.get("seq")}]
+    transaction.on_commit(lambda: _send(str(version_id), events))
+
+
+def broadcast_changes(version_id, element_type, ids, operation, sequence):
+    broadcast(version_id, [
+        {"type": element_type, "id": str(pk), "op": operation, "seq": sequence} for pk in ids
+    ])
+
+
+def broadcast_layout(version_id, revision):
+    broadcast(version_id, [{"type": "layout", "op": "update", "revision": revision}])
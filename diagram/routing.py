@@ -0,0 +1,6 @@
+from django.urls import path
+from .consumers import VersionChangesConsumer
+
+websocket_urlpatterns = [
+    path('ws/version/<uuid:pk>/', VersionChangesConsumer.as_asgi(), name='ws-version-changes'),
+]
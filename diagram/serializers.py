@@ -1,37 +1,67 @@
 from rest_framework import serializers
+from django.utils.encoding import smart_str
 from .models import *
+from .caches import parameter_types
+from .instrumentation import TimedSerializerMixin
 
-class ImageFileSerializer(serializers.ModelSerializer):
+
+class TimedModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    pass
+
+
+class ImageFileSerializer(TimedModelSerializer):
     
     class Meta:
         model = ImageFile
         fields = ['uuid', 'file', 'default']
 
-class ParameterTypeSerializer(serializers.ModelSerializer):
+class ParameterTypeSerializer(TimedModelSerializer):
 
     class Meta:
         model = ParameterType
         fields = "__all__"
 
-class MinimalParameterTypeSerializer(serializers.ModelSerializer):
+class MinimalParameterTypeSerializer(TimedModelSerializer):
     class Meta:
         model = ParameterType
         fields = ["id", "name", "description", "generic"]
 
-class ParameterSerializer(serializers.ModelSerializer):
+class CachedParameterTypeField(serializers.SlugRelatedField):
+    """
+    SlugRelatedField on ParameterType.name resolved through the in-process
+    ParameterType cache instead of one query per row.
+    """
+    def __init__(self, **kwargs):
+        kwargs.setdefault("slug_field", "name")
+        kwargs.setdefault("queryset", ParameterType.objects.all())
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return parameter_types.get_by_id(instance.parameter_type_id)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, (str, int)):
+            self.fail("invalid")
+        parameter_type = parameter_types.get_by_name(smart_str(data))
+        if parameter_type is None:
+            self.fail("does_not_exist", slug_name=self.slug_field, value=smart_str(data))
+        return parameter_type
+
+class ParameterSerializer(TimedModelSerializer):
     element_type = serializers.SerializerMethodField()
     element_detail = serializers.SerializerMethodField()  
-    parameter_type = serializers.SlugRelatedField(
-        slug_field='name',
-        queryset=ParameterType.objects.all()
-    )
-    parameter_type_detail = MinimalParameterTypeSerializer(source="parameter_type", read_only=True)
+    parameter_type = CachedParameterTypeField()
+    parameter_type_detail = serializers.SerializerMethodField()
 
     class Meta:
         model = Parameter
         fields = ["id", "name", "value", "secret", "element_type", "element_detail", "parameter_type", "parameter_type_detail"]
 
 
+    def get_parameter_type_detail(self, obj):
+        parameter_type = parameter_types.get_by_id(obj.parameter_type_id)
+        return MinimalParameterTypeSerializer(parameter_type).data if parameter_type else None
+
     def get_element_type(self, obj):
         if obj.component:
             return "component"
@@ -54,31 +84,37 @@ class ParameterSerializer(serializers.ModelSerializer):
             return MinimalInterfaceSerializer(obj.interface).data
         return None
     
-class DiagramParameterSerializer(serializers.ModelSerializer):
+class DiagramParameterSerializer(TimedModelSerializer):
     class Meta:
         model = Parameter
         fields = ["id", "name", "value", "secret", "parameter_type"]
 
-class MinimalParameterSerializer(serializers.ModelSerializer):
+class ChangedParameterSerializer(TimedModelSerializer):
+    class Meta:
+        model = Parameter
+        fields = ["id", "name", "value", "secret", "parameter_type", *Parameter.OWNER_FIELDS, "change_seq"]
+
+class MinimalParameterSerializer(TimedModelSerializer):
 
     class Meta:
         model = Parameter
         fields = ["id", "name", "value", "secret", "parameter_type"]
 
-class ParameterGETSerializer(serializers.ModelSerializer):
-    parameter_type = ParameterTypeSerializer()
+class ParameterGETSerializer(TimedModelSerializer):
+    parameter_type = serializers.SerializerMethodField()
     class Meta:
         model = Parameter
         fields =  "__all__"
 
-class CompleteParameterSerializer(serializers.ModelSerializer):
+    def get_parameter_type(self, obj):
+        parameter_type = parameter_types.get_by_id(obj.parameter_type_id)
+        return ParameterTypeSerializer(parameter_type).data if parameter_type else None
+
+class CompleteParameterSerializer(TimedModelSerializer):
     element_type = serializers.SerializerMethodField()
     element_detail = serializers.SerializerMethodField()
-    parameter_type = serializers.SlugRelatedField(
-        slug_field='name',
-        queryset=ParameterType.objects.all()
-    )
-    parameter_type_detail = MinimalParameterTypeSerializer(source="parameter_type", read_only=True)
+    parameter_type = CachedParameterTypeField()
+    parameter_type_detail = serializers.SerializerMethodField()
     parent_info = serializers.SerializerMethodField()
     parent_component = serializers.SerializerMethodField()
     connection_details = serializers.SerializerMethodField()
@@ -88,6 +124,10 @@ class CompleteParameterSerializer(serializers.ModelSerializer):
         fields = ["id", "name", "value", "secret", "element_type", "element_detail", 
                   "parameter_type", "parameter_type_detail", "parent_info", "parent_component", "connection_details"]
 
+    def get_parameter_type_detail(self, obj):
+        parameter_type = parameter_types.get_by_id(obj.parameter_type_id)
+        return MinimalParameterTypeSerializer(parameter_type).data if parameter_type else None
+
     def get_element_type(self, obj):
         if obj.component:
             return "component"
@@ -186,12 +226,12 @@ class CompleteParameterSerializer(serializers.ModelSerializer):
             return result
         return None
     
-class MinimalComponentSerializer(serializers.ModelSerializer):
+class MinimalComponentSerializer(TimedModelSerializer):
     class Meta:
         model = Component
         fields = ["id", "name", "description", "availability", "confidentiality", "integrity", "notes"]
 
-class MinimalSubComponentSerializer(serializers.ModelSerializer):
+class MinimalSubComponentSerializer(TimedModelSerializer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if self.context.get('hide_component', False):
@@ -200,7 +240,7 @@ class MinimalSubComponentSerializer(serializers.ModelSerializer):
         model = SubComponent
         fields = ["id","name", "description", "availability", "confidentiality", "integrity", "notes","component"]
 
-class MinimalPortSerializer(serializers.ModelSerializer):
+class MinimalPortSerializer(TimedModelSerializer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if self.context.get('hide_component', False):
@@ -209,17 +249,17 @@ class MinimalPortSerializer(serializers.ModelSerializer):
         model = Port
         fields = ["id","name", "description", "availability", "confidentiality", "integrity", "notes","component"]
 
-class MinimalInterfaceSerializer(serializers.ModelSerializer):
+class MinimalInterfaceSerializer(TimedModelSerializer):
     class Meta:
         model = Interface
         fields = ["id", "name", "description", "availability", "confidentiality", "integrity", "notes"]
 
-class ComponentSerializer(serializers.ModelSerializer):
+class ComponentSerializer(TimedModelSerializer):
     class Meta:
         model = Component
         fields = "__all__"
     
-class DiagramComponentSerializer(serializers.ModelSerializer):
+class DiagramComponentSerializer(TimedModelSerializer):
     parameters = DiagramParameterSerializer(many=True, required=False)
     images = serializers.SerializerMethodField()
     
@@ -270,13 +310,13 @@ class ComponentGETSerializer(ComponentSerializer):
         from api.serializers import VersionSerializer
         return VersionSerializer(obj.version).data if obj.version else None
 
-class SubComponentSerializer(serializers.ModelSerializer):
+class SubComponentSerializer(TimedModelSerializer):
 
     class Meta:
         model = SubComponent
         fields = "__all__"
 
-class DiagramSubComponentSerializer(serializers.ModelSerializer):
+class DiagramSubComponentSerializer(TimedModelSerializer):
     parameters = DiagramParameterSerializer(many=True, required=False)
     images = serializers.SerializerMethodField()
     
@@ -288,7 +328,7 @@ class DiagramSubComponentSerializer(serializers.ModelSerializer):
         model = SubComponent
         fields = "__all__"
 
-class SubComponentGETSerializer(serializers.ModelSerializer):
+class SubComponentGETSerializer(TimedModelSerializer):
     parameters = ParameterGETSerializer(many=True, required=False)
     vulnerabilities = serializers.SerializerMethodField()
     flowexecutions = serializers.SerializerMethodField()
@@ -321,12 +361,12 @@ class SubComponentGETSerializer(serializers.ModelSerializer):
         from api.serializers import ImageFileSerializer
         return ImageFileSerializer(instance.images.all(), many=True).data
 
-class PortSerializer(serializers.ModelSerializer):
+class PortSerializer(TimedModelSerializer):
     class Meta:
         model = Port
         fields = "__all__"
 
-class DiagramPortSerializer(serializers.ModelSerializer):
+class DiagramPortSerializer(TimedModelSerializer):
     parameters = DiagramParameterSerializer(many=True, required=False)
     images = serializers.SerializerMethodField()
     def get_images(self, instance):
@@ -336,7 +376,7 @@ class DiagramPortSerializer(serializers.ModelSerializer):
         model = Port
         fields = "__all__"
 
-class PortGETSerializer(serializers.ModelSerializer):
+class PortGETSerializer(TimedModelSerializer):
     parameters = ParameterGETSerializer(many=True, required=False)
     vulnerabilities = serializers.SerializerMethodField()
     flowexecutions = serializers.SerializerMethodField()
@@ -369,12 +409,12 @@ class PortGETSerializer(serializers.ModelSerializer):
         from api.serializers import ImageFileSerializer
         return ImageFileSerializer(instance.images.all(), many=True).data
 
-class InterfaceSerializer(serializers.ModelSerializer):
+class InterfaceSerializer(TimedModelSerializer):
     class Meta:
         model = Interface
         fields = "__all__"
 
-class DiagramInterfaceSerializer(serializers.ModelSerializer):
+class DiagramInterfaceSerializer(TimedModelSerializer):
     parameters = DiagramParameterSerializer(many=True, required=False)
     images = serializers.SerializerMethodField()
 
@@ -386,7 +426,7 @@ class DiagramInterfaceSerializer(serializers.ModelSerializer):
         model = Interface
         fields = "__all__"
 
-class InterfaceGETSerializer(serializers.ModelSerializer):
+class InterfaceGETSerializer(TimedModelSerializer):
     parameters = ParameterGETSerializer(many=True, required=False)
     sut = serializers.SerializerMethodField()
     version = serializers.SerializerMethodField()
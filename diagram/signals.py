@@ -0,0 +1,359 @@
+import threading
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.dispatch import receiver, Signal
+from .models import Component, SubComponent, Port, Interface, Parameter, ParameterType, ImageFile, Version, ChangeEvent
+from .caches import parameter_types, response_cache
+from .changes import record_changes
+from .cia import FLAGS, EFFECTIVE_FIELDS, mask, propagate
+
+
+# Sent once the transaction is committed, whenever the diagram elements, parameters
+# or images of a Version change, or the rows of other apps that their representations
+# show (the Version itself, its SUT, vulnerabilities...). Arguments: version_id.
+version_changed = Signal()
+
+
+def notify_version_changed(version_id):
+    if version_id is None:
+        return
+    transaction.on_commit(lambda: version_changed.send(sender=Version, version_id=version_id))
+
+
+@receiver(version_changed)
+def invalidate_version_responses(sender, version_id, **kwargs):
+    response_cache.bump(version_id)
+
+
+@receiver(post_save, sender=ParameterType)
+@receiver(post_delete, sender=ParameterType)
+def invalidate_parameter_types(sender, **kwargs):
+    parameter_types.invalidate_on_commit()
+    # Parameter types are shown by the representations of every Version
+    transaction.on_commit(response_cache.bump)
+
+
+# Relations of the elements to the models of other apps (vulnerabilities, flow
+# executions...), shown by the element representations:
+# {related model: [(element model, relation)]}
+FOREIGN_RELATIONS = {}
+for element_model in (Component, SubComponent, Port, Interface):
+    for relation in element_model._meta.related_objects:
+        if relation.related_model._meta.app_label != element_model._meta.app_label:
+            FOREIGN_RELATIONS.setdefault(relation.related_model, []).append((element_model, relation))
+
+
+def notify_related_versions(sender, instance, **kwargs):
+    """A row of another app shown by the element representations changed"""
+    if kwargs.get("signal") is pre_save and instance._state.adding:
+        return
+    for element_model, relation in FOREIGN_RELATIONS.get(sender, ()):
+        versions = element_model.objects.filter(**{relation.name: instance.pk}).values_list("version", flat=True)
+        for version_id in set(versions):
+            notify_version_changed(version_id)
+
+
+def notify_related_links(sender, instance, action, model, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if isinstance(instance, (Component, SubComponent, Port, Interface)):
+        notify_version_changed(instance.version_id)
+    elif action == "pre_clear":
+        notify_related_versions(type(instance), instance)
+    elif pk_set:
+        for version_id in set(model.objects.filter(pk__in=pk_set).values_list("version", flat=True)):
+            notify_version_changed(version_id)
+
+
+for related_model, relations in FOREIGN_RELATIONS.items():
+    # Before a save or a deletion for the elements it was linked to, after a save for the new ones
+    for signal in (pre_save, post_save, pre_delete):
+        signal.connect(notify_related_versions, sender=related_model)
+    for _, relation in relations:
+        if relation.many_to_many:
+            m2m_changed.connect(notify_related_links, sender=relation.through)
+
+
+@receiver(post_save, sender=Version)
+def notify_version_saved(sender, instance, **kwargs):
+    """The detail representations of the elements show their Version"""
+    notify_version_changed(instance.pk)
+
+
+@receiver(post_save, sender=Version._meta.get_field("sut").related_model)
+@receiver(pre_delete, sender=Version._meta.get_field("sut").related_model)
+def notify_sut_versions(sender, instance, **kwargs):
+    """The detail representations of the elements show the SUT of their Version"""
+    for version_id in Version.objects.filter(sut=instance.pk).values_list("pk", flat=True):
+        notify_version_changed(version_id)
+
+
+@receiver(post_save, sender=ParameterType)
+@receiver(pre_delete, sender=ParameterType)
+def bump_parameter_type_elements(sender, instance, created=False, **kwargs):
+    """Element representations show the type of their parameters"""
+    if created:
+        return
+    for element_model in (Component, SubComponent, Port, Interface):
+        element_model.bump_revision(parameters__parameter_type=instance)
+
+
+@receiver(post_save, sender=Component)
+@receiver(post_save, sender=SubComponent)
+@receiver(post_save, sender=Port)
+@receiver(post_save, sender=Interface)
+def sync_parameters_version(sender, instance, update_fields=None, **kwargs):
+    """Keep the denormalised Parameter.version in line with its element"""
+    if update_fields is not None and "version" not in update_fields:
+        return
+    owner_field = sender._meta.model_name
+    Parameter.objects.filter(**{owner_field: instance}).exclude(
+        version=instance.version_id
+    ).update(version=instance.version_id)
+
+
+@receiver(post_save, sender=Component)
+def bump_component_children(sender, instance, **kwargs):
+    """Sub-components and ports embed their parent component"""
+    SubComponent.bump_revision(component=instance)
+    Port.bump_revision(component=instance)
+
+
+@receiver(post_save, sender=SubComponent)
+@receiver(post_save, sender=Port)
+def bump_parent_component(sender, instance, **kwargs):
+    """Components list their sub-components and ports"""
+    Component.bump_revision(pk=instance.component_id)
+
+
+@receiver(post_save, sender=SubComponent)
+@receiver(post_save, sender=Port)
+def bump_end_interfaces(sender, instance, created=False, **kwargs):
+    """Interfaces show their ends"""
+    if not created:
+        sender.bump_interfaces([instance.pk])
+
+
+@receiver(post_save, sender=Interface)
+def bump_interface_component(sender, instance, **kwargs):
+    """Components list the interfaces leaving their ports"""
+    if instance.port_from_id:
+        Component.bump_revision(ports=instance.port_from_id)
+
+
+@receiver(post_save, sender=Parameter)
+def bump_parameter_owner(sender, instance, **kwargs):
+    for field_name in Parameter.OWNER_FIELDS:
+        owner_id = getattr(instance, f"{field_name}_id")
+        if owner_id is not None:
+            Parameter._meta.get_field(field_name).related_model.bump_revision(pk=owner_id)
+
+
+def bump_image_owners(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        type(instance).bump_revision(pk=instance.pk)
+        record_changes(instance.version_id, instance._meta.model_name, [instance.pk])
+        notify_version_changed(instance.version_id)
+    elif pk_set:
+        model.bump_revision(pk__in=pk_set)
+        record_image_owner_changes(model, pk__in=pk_set)
+
+
+def record_image_owner_changes(model, **filters):
+    """Record a change of the elements matching the filters, grouped by version"""
+    owners = {}
+    for pk, version_id in model.objects.filter(**filters).values_list("pk", "version"):
+        owners.setdefault(version_id, []).append(pk)
+    for version_id, ids in owners.items():
+        record_changes(version_id, model._meta.model_name, ids)
+        notify_version_changed(version_id)
+
+
+for element_model in (Component, SubComponent, Port, Interface):
+    m2m_changed.connect(bump_image_owners, sender=element_model.images.through)
+
+
+@receiver(post_save, sender=ImageFile)
+def bump_image_elements(sender, instance, created, **kwargs):
+    if created:
+        return
+    for element_model in (Component, SubComponent, Port, Interface):
+        element_model.bump_revision(images=instance)
+        record_image_owner_changes(element_model, images=instance)
+
+
+@receiver(post_save, sender=Component)
+@receiver(post_save, sender=SubComponent)
+@receiver(post_save, sender=Port)
+@receiver(post_save, sender=Interface)
+@receiver(post_save, sender=Parameter)
+@receiver(post_delete, sender=Component)
+@receiver(post_delete, sender=SubComponent)
+@receiver(post_delete, sender=Port)
+@receiver(post_delete, sender=Interface)
+@receiver(post_delete, sender=Parameter)
+def notify_element_version(sender, instance, **kwargs):
+    notify_version_changed(instance.version_id)
+
+
+class PendingDeletions:
+    """Tombstones of the rows deleted by a transaction, by version and type"""
+
+    def __init__(self):
+        self.events = {}
+        self.callback = self.flush
+
+    def add(self, version_id, element_type, pk):
+        self.events.setdefault(version_id, {}).setdefault(element_type, []).append(pk)
+
+    def flush(self):
+        if getattr(_deletions, "pending", None) is self:
+            _deletions.pending = None
+        # The rows deleted with their version need no tombstone
+        existing = set(Version.objects.filter(pk__in=list(self.events)).values_list("pk", flat=True))
+        with transaction.atomic():
+            for version_id, types in self.events.items():
+                if version_id in existing:
+                    for element_type, ids in types.items():
+                        record_changes(version_id, element_type, ids, ChangeEvent.DELETE)
+
+
+_deletions = threading.local()
+
+
+def record_deleted(version_id, element_type, pk):
+    """
+    Queue the tombstone of a deleted row. A cascade deletes many rows in one
+    transaction: their tombstones are recorded together once it is committed,
+    with one lock of the Version and one insert per type.
+    """
+    if version_id is None:
+        return
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        record_changes(version_id, element_type, [pk], ChangeEvent.DELETE)
+        return
+    pending = getattr(_deletions, "pending", None)
+    # The queue of a rolled back transaction is dropped with its callback
+    if pending is None or not any(entry[1] is pending.callback for entry in connection.run_on_commit):
+        pending = PendingDeletions()
+        _deletions.pending = pending
+        transaction.on_commit(pending.callback)
+    pending.add(version_id, element_type, pk)
+
+
+@receiver(post_delete, sender=Component)
+@receiver(post_delete, sender=SubComponent)
+@receiver(post_delete, sender=Port)
+@receiver(post_delete, sender=Interface)
+@receiver(post_delete, sender=Parameter)
+def record_element_deleted(sender, instance, **kwargs):
+    record_deleted(instance.version_id, sender._meta.model_name, instance.pk)
+
+
+@receiver(post_delete, sender=Version)
+def delete_change_events(sender, instance, **kwargs):
+    ChangeEvent.objects.filter(version=instance.pk).delete()
+
+
+# Fields of the effective CIA requirements' inputs, by model: own requirements and references
+CIA_REFERENCES = {
+    Component: (),
+    SubComponent: ("component",),
+    Port: ("component",),
+    Interface: ("port_from", "port_to_port", "port_to_subcomponent"),
+}
+REFERENCE_TYPES = {
+    "component": "component",
+    "port_from": "port",
+    "port_to_port": "port",
+    "port_to_subcomponent": "subcomponent",
+}
+
+
+def cia_inputs_changed(sender, update_fields):
+    return update_fields is None or bool(set(update_fields) & {*FLAGS, *CIA_REFERENCES[sender]})
+
+
+@receiver(pre_save, sender=Component)
+@receiver(pre_save, sender=SubComponent)
+@receiver(pre_save, sender=Port)
+@receiver(pre_save, sender=Interface)
+def remember_cia_references(sender, instance, update_fields=None, **kwargs):
+    """
+    Whether the save changes the requirements or the references of the element;
+    the previous ends and parent of a moved element lose its requirements
+    """
+    instance._cia_changed = False
+    instance._cia_previous = {}
+    if not cia_inputs_changed(sender, update_fields):
+        return
+    fields = CIA_REFERENCES[sender]
+    flags = [getattr(instance, field_name) for field_name in FLAGS]
+    references = [getattr(instance, f"{field_name}_id") for field_name in fields]
+    previous = None
+    if not instance._state.adding:
+        previous = sender.objects.filter(pk=instance.pk).values_list(*FLAGS, *fields).first()
+    if previous is None:
+        # Sans exigence, seule une nouvelle interface hérite de celles de ses extrémités
+        instance._cia_changed = any(flags) or (sender is Interface and any(references))
+        return
+    instance._cia_changed = list(previous) != flags + references
+    for field_name, old, new in zip(fields, previous[len(FLAGS):], references):
+        if old is not None and old != new:
+            instance._cia_previous.setdefault(REFERENCE_TYPES[field_name], []).append(old)
+
+
+@receiver(post_save, sender=Component)
+@receiver(post_save, sender=SubComponent)
+@receiver(post_save, sender=Port)
+@receiver(post_save, sender=Interface)
+def propagate_cia(sender, instance, update_fields=None, **kwargs):
+    if not cia_inputs_changed(sender, update_fields) or not getattr(instance, "_cia_changed", True):
+        return
+    element_type = sender._meta.model_name
+    seeds = getattr(instance, "_cia_previous", None) or {}
+    seeds.setdefault(element_type, []).append(instance.pk)
+    instance._cia_previous = None
+    computed = propagate(seeds)
+    value = computed.get((element_type, instance.pk))
+    if value is not None and value != mask(getattr(instance, field_name) for field_name in EFFECTIVE_FIELDS):
+        # The in-memory instance is serialized by the views right after the save
+        for position, field_name in enumerate(EFFECTIVE_FIELDS):
+            setattr(instance, field_name, bool(value & (1 << position)))
+        instance.revision, instance.change_seq = sender.objects.values_list("revision", "change_seq").get(pk=instance.pk)
+
+
+@receiver(pre_delete, sender=SubComponent)
+@receiver(pre_delete, sender=Port)
+@receiver(pre_delete, sender=Interface)
+def remember_cia_neighbours(sender, instance, **kwargs):
+    """Neighbours of a deleted element, recomputed once it is gone"""
+    if sender is Interface:
+        instance._cia_neighbours = {
+            "port": [instance.port_from_id, instance.port_to_port_id],
+            "subcomponent": [instance.port_to_subcomponent_id],
+        }
+        return
+    # Les interfaces qui visent l'élément perdent leur cible (SET_NULL)
+    target_field = "port_to_port" if sender is Port else "port_to_subcomponent"
+    instance._cia_neighbours = {
+        "component": [instance.component_id],
+        "interface": list(Interface.objects.filter(**{target_field: instance.pk}).values_list("pk", flat=True)),
+    }
+
+
+@receiver(post_delete, sender=SubComponent)
+@receiver(post_delete, sender=Port)
+@receiver(post_delete, sender=Interface)
+def propagate_cia_deletion(sender, instance, **kwargs):
+    neighbours = getattr(instance, "_cia_neighbours", None)
+    if neighbours:
+        # The interfaces that lost their target (SET_NULL) have a new representation
+        targeting = neighbours.get("interface")
+        if targeting:
+            Interface.bump_revision(pk__in=targeting)
+            record_changes(instance.version_id, "interface", targeting)
+        propagate(neighbours)
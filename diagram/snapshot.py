@@ -0,0 +1,272 @@
+"""
+Compact, array-backed snapshot of the diagram graph of a Version.
+
+Nodes are the Components, SubComponents and Ports of the version, numbered 0..n-1
+in the order of their uuids; edges are the Interfaces, from port_from to
+port_to_port or port_to_subcomponent, stored as a CSR adjacency. The snapshot is
+written once to a file of DIAGRAM_GRAPH_SNAPSHOT_DIR (default: a "diagram-graphs"
+directory of the temporary directory) and memory-mapped read-only by every worker
+process, so its arrays are shared by the processes and never copied.
+
+The file is named after the last ChangeEvent of the version (see diagram.changes):
+any change of an element or an interface gives a new name, so a stale snapshot is
+never read.
+
+File layout (native byte order, sections aligned on 8 bytes)::
+
+    header        magic, format, version uuid, change sequence, n, m, names size
+    ids           n x 16 bytes     uuid of each node, sorted
+    kinds         n x uint8        0 component, 1 sub-component, 2 port
+    parents       n x int32        node of the component of a part, -1 otherwise
+    offsets       (n + 1) x uint32 CSR row offsets
+    targets       m x uint32       CSR column indices
+    external      m x uint8        1 for an external interface
+    availability, confidentiality, integrity
+                  ceil(n / 8) bytes each, bit i of node i
+    name_offsets  (n + 1) x uint32
+    names         utf-8 names
+"""
+import glob
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import uuid
+from array import array
+
+from django.conf import settings
+
+from .changes import current_cursor
+from .models import Component, Interface, Port, SubComponent
+
+
+MAGIC = b"DGS1"
+FORMAT = 1
+HEADER = struct.Struct("<4sI16sQIIQ")
+KINDS = ("component", "subcomponent", "port")
+CIA_FIELDS = ("availability", "confidentiality", "integrity")
+
+assert array("I").itemsize == 4 and array("i").itemsize == 4
+
+
+def snapshot_dir():
+    return getattr(settings, "DIAGRAM_GRAPH_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "diagram-graphs"))
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+def _sections(n, m, names_size):
+    """(name, offset, size) of every section for the given counts"""
+    bitset = (n + 7) // 8
+    sizes = (
+        ("ids", n * 16),
+        ("kinds", n),
+        ("parents", n * 4),
+        ("offsets", (n + 1) * 4),
+        ("targets", m * 4),
+        ("external", m),
+        ("availability", bitset),
+        ("confidentiality", bitset),
+        ("integrity", bitset),
+        ("name_offsets", (n + 1) * 4),
+        ("names", names_size),
+    )
+    offset = _align(HEADER.size)
+    sections = []
+    for name, size in sizes:
+        sections.append((name, offset, size))
+        offset = _align(offset + size)
+    return sections
+
+
+def build_snapshot(version_id, sequence, path):
+    """Read the graph of a version with a few values_list queries and write its snapshot file"""
+    nodes = []
+    for kind, model, parent_field in (
+        (0, Component, None),
+        (1, SubComponent, "component"),
+        (2, Port, "component"),
+    ):
+        fields = ["id", "name", *CIA_FIELDS] + ([parent_field] if parent_field else [])
+        for row in model.objects.filter(version=version_id).values_list(*fields):
+            nodes.append((row[0].bytes, kind, row[1] or "", row[2:5], row[5] if parent_field else None))
+    nodes.sort(key=lambda node: node[0])
+    index = {node[0]: position for position, node in enumerate(nodes)}
+    n = len(nodes)
+
+    ids = bytearray()
+    kinds = array("B")
+    parents = array("i")
+    bitsets = {field_name: bytearray((n + 7) // 8) for field_name in CIA_FIELDS}
+    name_offsets = array("I", [0])
+    names = bytearray()
+    for position, (node_id, kind, name, flags, parent) in enumerate(nodes):
+        ids += node_id
+        kinds.append(kind)
+        parents.append(index.get(parent.bytes, -1) if parent else -1)
+        for field_name, flag in zip(CIA_FIELDS, flags):
+            if flag:
+                bitsets[field_name][position >> 3] |= 1 << (position & 7)
+        names += name.encode("utf-8")
+        name_offsets.append(len(names))
+
+    edges = []
+    rows = Interface.objects.filter(version=version_id, port_from__isnull=False).values_list(
+        "port_from", "port_to_port", "port_to_subcomponent", "type"
+    )
+    for port_from, to_port, to_sub, interface_type in rows:
+        source = index.get(port_from.bytes)
+        target = to_port or to_sub
+        target = index.get(target.bytes) if target else None
+        if source is not None and target is not None:
+            edges.append((source, target, interface_type == "external"))
+    edges.sort()
+
+    offsets = array("I", [0] * (n + 1))
+    targets = array("I")
+    external = array("B")
+    for source, target, is_external in edges:
+        offsets[source + 1] += 1
+        targets.append(target)
+        external.append(is_external)
+    for position in range(n):
+        offsets[position + 1] += offsets[position]
+
+    data = {
+        "ids": bytes(ids),
+        "kinds": kinds.tobytes(),
+        "parents": parents.tobytes(),
+        "offsets": offsets.tobytes(),
+        "targets": targets.tobytes(),
+        "external": external.tobytes(),
+        "name_offsets": name_offsets.tobytes(),
+        "names": bytes(names),
+        **{field_name: bytes(bitset) for field_name, bitset in bitsets.items()},
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as output:
+        output.write(HEADER.pack(MAGIC, FORMAT, uuid.UUID(str(version_id)).bytes, sequence, n, len(edges), len(names)))
+        for name, offset, size in _sections(n, len(edges), len(names)):
+            output.seek(offset)
+            output.write(data[name])
+        output.truncate(_align(output.tell()))
+    # The new file replaces a concurrent build of the same snapshot atomically
+    os.replace(temporary, path)
+
+
+class GraphSnapshot:
+    """Read-only view of a snapshot file; the arrays are memoryviews of the mapping"""
+
+    def __init__(self, path):
+        with open(path, "rb") as snapshot:
+            self._map = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._map)
+        magic, file_format, version, self.sequence, self.n, self.m, names_size = HEADER.unpack_from(buffer)
+        if magic != MAGIC or file_format != FORMAT:
+            raise ValueError(f"{path} is not a diagram graph snapshot")
+        self.version_id = uuid.UUID(bytes=version)
+        views = {name: buffer[offset:offset + size] for name, offset, size in _sections(self.n, self.m, names_size)}
+        self.ids = views["ids"]
+        self.kinds = views["kinds"]
+        self.parents = views["parents"].cast("i")
+        self.offsets = views["offsets"].cast("I")
+        self.targets = views["targets"].cast("I")
+        self.external = views["external"]
+        self.flags = {field_name: views[field_name] for field_name in CIA_FIELDS}
+        self.name_offsets = views["name_offsets"].cast("I")
+        self.names = views["names"]
+
+    def __len__(self):
+        return self.n
+
+    def uuid(self, node):
+        return uuid.UUID(bytes=bytes(self.ids[node * 16:node * 16 + 16]))
+
+    def index(self, element_id):
+        """Node of an element uuid (binary search over the sorted ids), or None"""
+        key = uuid.UUID(str(element_id)).bytes
+        low, high = 0, self.n
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(self.ids[middle * 16:middle * 16 + 16]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n and bytes(self.ids[low * 16:low * 16 + 16]) == key:
+            return low
+        return None
+
+    def kind(self, node):
+        return KINDS[self.kinds[node]]
+
+    def parent(self, node):
+        parent = self.parents[node]
+        return None if parent < 0 else parent
+
+    def name(self, node):
+        return bytes(self.names[self.name_offsets[node]:self.name_offsets[node + 1]]).decode("utf-8")
+
+    def flag(self, node, field_name):
+        return bool(self.flags[field_name][node >> 3] & (1 << (node & 7)))
+
+    def neighbors(self, node):
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+
+_lock = threading.Lock()
+_opened = {}
+
+
+def snapshot_path(version_id, sequence):
+    return os.path.join(snapshot_dir(), f"{version_id}-{sequence}.graph")
+
+
+def _remove_older(key, sequence):
+    """Remove the snapshots of older sequences; a newer one may have been built by another worker"""
+    for stale in glob.glob(os.path.join(snapshot_dir(), f"{key}-*.graph")):
+        try:
+            stale_sequence = int(os.path.basename(stale)[len(key) + 1:-len(".graph")])
+        except ValueError:
+            continue
+        if stale_sequence < sequence:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+def load_snapshot(version_id):
+    """
+    Snapshot of the current graph of a version: the mapping opened by this process,
+    the file written by another worker, or a new build.
+    """
+    sequence = current_cursor(version_id)
+    key = str(version_id)
+    with _lock:
+        snapshot = _opened.get(key)
+        if snapshot is not None and snapshot.sequence == sequence:
+            return snapshot
+
+    path = snapshot_path(key, sequence)
+    built = False
+    for attempt in range(3):
+        try:
+            snapshot = GraphSnapshot(path)
+            break
+        except FileNotFoundError:
+            # Not built yet, or removed by a worker that has just built a newer one
+            if attempt == 2:
+                raise
+            build_snapshot(version_id, sequence, path)
+            built = True
+    if built:
+        _remove_older(key, sequence)
+    with _lock:
+        # The views of the previous snapshot may still be used by another thread:
+        # the mapping is closed when it is garbage collected
+        _opened[key] = snapshot
+    return snapshot
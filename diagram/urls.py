@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from diagram.views import *
+from diagram.instrumentation import metrics_view
 
 
 app_name = "diagram"
@@ -18,6 +19,20 @@ urlpatterns = [
     path('subcomponent/<uuid:pk>/diagram/', SubComponentView.as_view({"get": "retrieve_diagram"}), name='subcomponent-diagram'),
     path('port/<uuid:pk>/diagram/', PortView.as_view({"get": "retrieve_diagram"}), name='port-diagram'),
     path('interface/<uuid:pk>/diagram/', InterfaceView.as_view({"get": "retrieve_diagram"}), name='interface-diagram'),
+    path('metrics/', metrics_view, name='metrics'),
+    path('version/<uuid:pk>/diagram-elements/', VersionDiagramView.as_view({"get": "diagram_elements"}), name='version-diagram-elements'),
+    path('version/<uuid:pk>/diagram-json/', VersionDiagramView.as_view({"get": "retrieve_diagram_json", "put": "save_diagram_json", "patch": "patch_diagram_json"}), name='version-diagram-json'),
+    path('version/<uuid:pk>/diagram-json/flush/', VersionDiagramView.as_view({"post": "flush_diagram_json"}), name='version-diagram-json-flush'),
+    path('version/<uuid:pk>/layout/', VersionDiagramView.as_view({"get": "layout"}), name='version-layout'),
+    path('version/<uuid:pk>/batch/', VersionDiagramView.as_view({"post": "batch"}), name='version-batch'),
+    path('version/<uuid:pk>/import/', VersionDiagramView.as_view({"post": "import_elements"}), name='version-import'),
+    path('version/<uuid:pk>/export/', VersionDiagramView.as_view({"get": "export"}), name='version-export'),
+    path('version/<uuid:pk>/clone/', VersionDiagramView.as_view({"post": "clone"}), name='version-clone'),
+    path('version/<uuid:pk>/diff/', VersionDiagramView.as_view({"get": "diff"}), name='version-diff'),
+    path('version/<uuid:pk>/changes/', VersionDiagramView.as_view({"get": "changes"}), name='version-changes'),
+    path('version/<uuid:pk>/reachability/', VersionDiagramView.as_view({"get": "reachability"}), name='version-reachability'),
+    path('version/<uuid:pk>/metrics/', VersionDiagramView.as_view({"get": "graph_metrics"}), name='version-graph-metrics'),
+    path('version/<uuid:pk>/validate/', VersionDiagramView.as_view({"get": "validate"}), name='version-validate'),
     path('api/component/<uuid:pk>/diagram/', ComponentView.as_view({"get": "retrieve_diagram"}), name='api-component-diagram'),
     path('api/subcomponent/<uuid:pk>/diagram/', SubComponentView.as_view({"get": "retrieve_diagram"}), name='api-subcomponent-diagram'),
     path('api/port/<uuid:pk>/diagram/', PortView.as_view({"get": "retrieve_diagram"}), name='api-port-diagram'),
@@ -0,0 +1,161 @@
+"""
+Integrity checks of the diagram of a Version.
+
+The whole Version is read with one values_list() query per model (the versions of
+the referenced elements come from joins) and every check is a pass over these
+rows with dict and set lookups, so a validation runs in O(V + E).
+
+Each issue of the report is machine readable::
+
+    {"code": "targetless_interface", "type": "interface", "id": "<uuid>",
+     "message": "...", "related": ["<uuid>", ...]}
+
+Codes:
+
+- dangling_interface: interface without a port_from;
+- targetless_interface: interface without a port_to_port nor a port_to_subcomponent,
+  typically because its target was deleted (SET_NULL);
+- ambiguous_interface: interface with both a port_to_port and a port_to_subcomponent;
+- self_loop: interface from a port to the same port;
+- cross_version: element or parameter referencing an element of another Version;
+- orphan_parameter: parameter without any owner element; it has no version
+  either (Parameter.version follows the owner), so every validation reports it
+  (a separate query on the null version, which keeps the version index usable);
+- duplicate_name: elements of the same type sharing a name under the same parent
+  (the Version for components, the component for sub-components and ports, the
+  source port for interfaces).
+"""
+from collections import Counter, defaultdict
+
+from .models import Component, Interface, Parameter, Port, SubComponent
+
+
+CODES = (
+    "dangling_interface",
+    "targetless_interface",
+    "ambiguous_interface",
+    "self_loop",
+    "cross_version",
+    "orphan_parameter",
+    "duplicate_name",
+)
+
+
+class ValidationReport:
+    def __init__(self, version_id):
+        self.version_id = version_id
+        self.issues = []
+        self.checked = Counter()
+
+    def add(self, code, element_type, element_id, message, related=()):
+        self.issues.append({
+            "code": code,
+            "type": element_type,
+            "id": element_id,
+            "message": message,
+            "related": list(related),
+        })
+
+    @property
+    def valid(self):
+        return not self.issues
+
+    def as_dict(self):
+        return {
+            "version": self.version_id,
+            "valid": self.valid,
+            "checked": dict(self.checked),
+            "counts": dict(Counter(issue["code"] for issue in self.issues)),
+            "issues": self.issues,
+        }
+
+
+def _duplicates(report, element_type, rows):
+    """rows: (id, parent, name); report every group of more than one element"""
+    groups = defaultdict(list)
+    for element_id, parent, name in rows:
+        if name:
+            groups[(parent, name)].append(element_id)
+    for (parent, name), ids in groups.items():
+        if len(ids) > 1:
+            for element_id in ids:
+                report.add(
+                    "duplicate_name", element_type, element_id,
+                    f"{len(ids)} {element_type}s are named {name!r} under the same parent",
+                    [other for other in ids if other != element_id],
+                )
+
+
+def _cross_version(report, element_type, element_id, version_id, references):
+    """references: (field name, referenced id, version of the referenced element)"""
+    for field_name, referenced_id, referenced_version in references:
+        if referenced_id is not None and referenced_version != version_id:
+            report.add(
+                "cross_version", element_type, element_id,
+                f"{field_name} belongs to version {referenced_version}",
+                [referenced_id],
+            )
+
+
+def validate_version(version_id):
+    """Check the elements and parameters of a version; return a ValidationReport"""
+    report = ValidationReport(version_id)
+
+    components = list(Component.objects.filter(version=version_id).values_list("pk", "name"))
+    report.checked["component"] = len(components)
+    _duplicates(report, "component", ((pk, None, name) for pk, name in components))
+
+    for element_type, model in (("subcomponent", SubComponent), ("port", Port)):
+        rows = list(model.objects.filter(version=version_id).values_list("pk", "name", "component", "component__version"))
+        report.checked[element_type] = len(rows)
+        for pk, name, component_id, component_version in rows:
+            _cross_version(report, element_type, pk, version_id, [("component", component_id, component_version)])
+        _duplicates(report, element_type, ((pk, component_id, name) for pk, name, component_id, _ in rows))
+
+    rows = list(Interface.objects.filter(version=version_id).values_list(
+        "pk", "name",
+        "port_from", "port_from__version",
+        "port_to_port", "port_to_port__version",
+        "port_to_subcomponent", "port_to_subcomponent__version",
+    ))
+    report.checked["interface"] = len(rows)
+    for pk, name, port_from, from_version, to_port, to_port_version, to_sub, to_sub_version in rows:
+        if port_from is None:
+            report.add("dangling_interface", "interface", pk, "The interface has no port_from")
+        if to_port is None and to_sub is None:
+            report.add("targetless_interface", "interface", pk, "The interface has no port_to_port nor port_to_subcomponent")
+        elif to_port is not None and to_sub is not None:
+            report.add(
+                "ambiguous_interface", "interface", pk,
+                "The interface has both a port_to_port and a port_to_subcomponent", [to_port, to_sub],
+            )
+        if port_from is not None and port_from == to_port:
+            report.add("self_loop", "interface", pk, "The interface goes from a port to the same port", [port_from])
+        _cross_version(report, "interface", pk, version_id, [
+            ("port_from", port_from, from_version),
+            ("port_to_port", to_port, to_port_version),
+            ("port_to_subcomponent", to_sub, to_sub_version),
+        ])
+    _duplicates(report, "interface", ((pk, port_from, name) for pk, name, port_from, *_ in rows))
+
+    owner_fields = [
+        lookup for field_name in Parameter.OWNER_FIELDS for lookup in (field_name, f"{field_name}__version")
+    ]
+    rows = Parameter.objects.filter(version=version_id).values_list("pk", *owner_fields)
+    for pk, *owners in rows.iterator(chunk_size=2000):
+        report.checked["parameter"] += 1
+        references = [
+            (field_name, owners[2 * position], owners[2 * position + 1])
+            for position, field_name in enumerate(Parameter.OWNER_FIELDS)
+        ]
+        _cross_version(report, "parameter", pk, version_id, references)
+
+    # Une requête à part : un OR avec la version empêcherait l'usage de son index
+    orphans = Parameter.objects.filter(
+        version__isnull=True, **{f"{field_name}__isnull": True for field_name in Parameter.OWNER_FIELDS}
+    ).values_list("pk", flat=True)
+    for pk in orphans.iterator(chunk_size=2000):
+        report.checked["parameter"] += 1
+        report.add("orphan_parameter", "parameter", pk, "The parameter has no owner element")
+
+    return report
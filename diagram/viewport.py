@@ -0,0 +1,183 @@
+"""
+Normalised storage of the diagram layout and viewport queries.
+
+Every write of Version.diagram_json is mirrored in CellLayout (one row per cell
+with its bounding box, parent and z-order) and in the CellLayoutTile grid index, so
+that ``cells_in_bbox`` only reads the cells intersecting a rectangle.
+
+Settings:
+
+- DIAGRAM_LAYOUT_TILE_SIZE: size of the grid tiles, in diagram units (default 512).
+- DIAGRAM_LAYOUT_MAX_TILES: cells covering more tiles are not indexed and are
+  always checked against the viewport (default 256).
+"""
+import math
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Value
+
+from .models import CellLayout, CellLayoutTile
+
+
+GEOMETRY_FIELDS = ("backend_id", "element_type", "x", "y", "width", "height", "parent", "z", "cell")
+
+
+def tile_size():
+    return getattr(settings, "DIAGRAM_LAYOUT_TILE_SIZE", 512)
+
+
+def max_tiles():
+    return getattr(settings, "DIAGRAM_LAYOUT_MAX_TILES", 256)
+
+
+def _number(value, default=0.0):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    return number if math.isfinite(number) else default
+
+
+def _element_box(cell):
+    position = cell.get("position") or {}
+    size = cell.get("size") or {}
+    return (
+        _number(position.get("x")),
+        _number(position.get("y")),
+        max(_number(size.get("width")), 0.0),
+        max(_number(size.get("height")), 0.0),
+    )
+
+
+def _link_box(cell, boxes):
+    """Bounding box of a link: its end cells or points and its vertices"""
+    points = []
+    for end in (cell.get("source") or {}, cell.get("target") or {}):
+        if end.get("id") in boxes:
+            x, y, width, height = boxes[end["id"]]
+            points += [(x, y), (x + width, y + height)]
+        elif "x" in end and "y" in end:
+            points.append((_number(end["x"]), _number(end["y"])))
+    points += [(_number(vertex.get("x")), _number(vertex.get("y"))) for vertex in cell.get("vertices") or []]
+    if not points:
+        return 0.0, 0.0, 0.0, 0.0
+    xs, ys = [point[0] for point in points], [point[1] for point in points]
+    return min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)
+
+
+def _backend_id(value):
+    try:
+        return uuid.UUID(str(value)) if value else None
+    except ValueError:
+        return None
+
+
+def extract_cells(document):
+    """Return {cell id: geometry fields} for the cells of a layout document"""
+    cells = [cell for cell in document["graphStructure"]["cells"] if isinstance(cell, dict) and cell.get("id")]
+    mapping = {entry.get("id"): entry for entry in document["elementMapping"]["cells"] if isinstance(entry, dict)}
+    boxes = {cell["id"]: _element_box(cell) for cell in cells if "source" not in cell}
+
+    rows = {}
+    for cell in cells:
+        cell_id = str(cell["id"])
+        x, y, width, height = boxes[cell["id"]] if cell["id"] in boxes else _link_box(cell, boxes)
+        entry = mapping.get(cell["id"], {})
+        rows[cell_id] = {
+            "backend_id": _backend_id(entry.get("backendId")),
+            "element_type": str(entry.get("type") or "")[:32],
+            "x": x,
+            "y": y,
+            "width": width,
+            "height": height,
+            "parent": str(cell["parent"]) if cell.get("parent") else None,
+            "z": int(_number(cell.get("z"))),
+            "cell": cell,
+        }
+    return rows
+
+
+def tiles_of(x, y, width, height):
+    size = tile_size()
+    return (
+        range(math.floor(x / size), math.floor((x + width) / size) + 1),
+        range(math.floor(y / size), math.floor((y + height) / size) + 1),
+    )
+
+
+def sync_cell_layouts(version_id, document):
+    """Mirror a layout document in CellLayout and its tile index, writing only the changed cells"""
+    rows = extract_cells(document)
+    existing = {layout.cell_id: layout for layout in CellLayout.objects.filter(version=version_id)}
+
+    created, updated = [], []
+    for cell_id, fields in rows.items():
+        layout = existing.get(cell_id)
+        if layout is None:
+            created.append(CellLayout(version_id=version_id, cell_id=cell_id, **fields))
+        elif any(getattr(layout, name) != value for name, value in fields.items()):
+            for name, value in fields.items():
+                setattr(layout, name, value)
+            updated.append(layout)
+    removed = [layout.pk for cell_id, layout in existing.items() if cell_id not in rows]
+
+    with transaction.atomic():
+        if removed:
+            CellLayout.objects.filter(pk__in=removed).delete()
+        CellLayout.objects.bulk_create(created)
+        created = list(CellLayout.objects.filter(version=version_id, cell_id__in=[layout.cell_id for layout in created]))
+        if updated:
+            CellLayout.objects.bulk_update(updated, GEOMETRY_FIELDS)
+            CellLayoutTile.objects.filter(layout__in=updated).delete()
+
+        tiles = []
+        oversized, indexed = [], []
+        for layout in created + updated:
+            columns, lines = tiles_of(layout.x, layout.y, layout.width, layout.height)
+            if len(columns) * len(lines) > max_tiles():
+                oversized.append(layout.pk)
+                continue
+            indexed.append(layout.pk)
+            tiles += [
+                CellLayoutTile(layout_id=layout.pk, version_id=version_id, tile_x=tile_x, tile_y=tile_y)
+                for tile_x in columns
+                for tile_y in lines
+            ]
+        CellLayoutTile.objects.bulk_create(tiles, batch_size=1000)
+        CellLayout.objects.filter(pk__in=oversized).update(oversized=True)
+        CellLayout.objects.filter(pk__in=indexed, oversized=True).update(oversized=False)
+
+
+def parse_bbox(value):
+    """Parse a "min_x,min_y,max_x,max_y" viewport"""
+    try:
+        min_x, min_y, max_x, max_y = (float(part) for part in value.split(","))
+    except (AttributeError, ValueError):
+        raise ValueError("bbox must be min_x,min_y,max_x,max_y")
+    if not all(math.isfinite(number) for number in (min_x, min_y, max_x, max_y)) or min_x > max_x or min_y > max_y:
+        raise ValueError("bbox must be min_x,min_y,max_x,max_y")
+    return min_x, min_y, max_x, max_y
+
+
+def cells_in_bbox(version_id, bbox):
+    """CellLayouts of a version intersecting the bbox, ordered by z"""
+    min_x, min_y, max_x, max_y = bbox
+    columns, lines = tiles_of(min_x, min_y, max_x - min_x, max_y - min_y)
+    tiles = CellLayoutTile.objects.filter(
+        version=version_id,
+        tile_x__range=(columns.start, columns.stop - 1),
+        tile_y__range=(lines.start, lines.stop - 1),
+    ).values("layout")
+    return (
+        CellLayout.objects.filter(version=version_id)
+        .filter(Q(pk__in=tiles) | Q(oversized=True))
+        .filter(
+            x__lte=max_x,
+            y__lte=max_y,
+            x__gte=Value(min_x) - F("width"),
+            y__gte=Value(min_y) - F("height"),
+        )
+        .order_by("z", "cell_id")
+    )
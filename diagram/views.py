@@ -2,6 +2,21 @@ from django.shortcuts import render, get_object_or_404
 from rest_framework import viewsets
 from .models import *
 from .serializers import *
+from .caches import parameter_types, response_cache
+from .signals import notify_version_changed
+from .changes import changes_since, current_cursor, lock_version, record_changes
+from .pagination import UUIDCursorPagination
+from .layout import LayoutPatchError, StaleLayoutRevision, load_document, apply_patch
+from .layout_buffer import layout_buffer
+from .viewport import cells_in_bbox, parse_bbox, sync_cell_layouts
+from .batch import BatchError, run_batch
+from .importer import import_ndjson
+from .export import export_version
+from .clone import CloneError, clone_version
+from .diff import diff_versions
+from .graph import VersionGraph
+from .graph_metrics import METRICS, MetricsUnavailable, version_metrics
+from .validation import validate_version
 from rest_framework.response import Response
 from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
@@ -12,7 +27,16 @@ import json
 import uuid6 as uuid
 import os
 import shutil
+from uuid import UUID
 from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.core.exceptions import ValidationError
+from django.utils.http import parse_etags
+import logging
+
+
+logger = logging.getLogger(__name__)
 
 
 def get_parameter_detail(request, parameter_id):
@@ -26,6 +50,159 @@ def get_parameter_detail(request, parameter_id):
     }
     return render(request, "parameter_detail.html", context)
 
+
+def list_response(request, queryset, serializer_class):
+    """Sérialise une liste, paginée par curseur si le client le demande"""
+    paginator = UUIDCursorPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    if page is None:
+        return Response(serializer_class(queryset, many=True).data)
+    return paginator.get_paginated_response(serializer_class(page, many=True).data)
+
+
+def element_etag(model, pk, representation, shared=False):
+    """
+    Compute the strong ETag of an element representation without serializing it,
+    along with the version of the element.
+
+    The ETag is derived from the element revision, which changes with the element, its
+    parameters, its images and the related diagram elements it shows. A representation
+    that also shows rows of other apps (``shared``: vulnerabilities, flow executions,
+    the Version and its SUT) adds the generation of the Version in the response cache,
+    which their writes bump.
+    """
+    row = model.objects.filter(pk=pk).values_list("version", "revision").first()
+    if row is None:
+        return None, None
+    version_id, revision = row
+    token = str(revision)
+    if shared:
+        token = f"{token}-{response_cache.generation(version_id)}"
+    return f'"{model._meta.model_name}-{representation}-{pk}-{token}"', version_id
+
+
+def etag_matches(request, etag):
+    if etag is None:
+        return False
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return "*" in etags or etag in etags
+
+
+def not_modified(etag):
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(etag))
+
+
+def etag_headers(etag):
+    # no-cache makes the browser revalidate its copy with If-None-Match on every request
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def to_uuid(value):
+    """Convertit une valeur en UUID, ou retourne None si elle n'est pas valide"""
+    if isinstance(value, UUID):
+        return value
+    try:
+        return UUID(str(value).strip('"'))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def image_in_use(image, owner):
+    """
+    Whether an image is also linked to another element than owner: cloned versions
+    share the ImageFile rows and files of their source, which must then be kept.
+    """
+    for model in (Component, SubComponent, Port, Interface):
+        queryset = model.objects.filter(images=image)
+        if isinstance(owner, model):
+            queryset = queryset.exclude(pk=owner.pk)
+        if queryset.exists():
+            return True
+    return False
+
+
+def write_image_default(image, owner, default):
+    """
+    Set the default flag of an image of owner. An image shared with another element
+    (cloned versions share their images) is copied first, so the change does not
+    reach the other version. Returns the image to link to owner.
+    """
+    default = ImageFile._meta.get_field("default").to_python(default)
+    if image.default == default:
+        return image
+    if not image_in_use(image, owner):
+        image.default = default
+        image.save(update_fields=["default"])
+        return image
+    copy = ImageFile(uuid=uuid.uuid7(), default=default)
+    with image.file.open("rb") as content:
+        copy.file.save(os.path.basename(image.file.name), content, save=False)
+    copy.save()
+    return copy
+
+
+def sync_parameters(owner_field, owner, parameters):
+    """
+    Synchronise the parameters of an element with the received list.
+
+    The received parameters are matched by id against the existing rows of the element:
+    unchanged rows are left alone, changed rows are updated, unknown ones are created and
+    missing ones are deleted, each with a single bulk query inside one transaction.
+    Parameters with an unknown parameter type are skipped.
+    """
+    parameters = parameters or []
+    type_ids = {to_uuid(param.get("parameter_type")) for param in parameters} - {None}
+    types_by_id = parameter_types.in_bulk(type_ids)
+    existing = {param.id: param for param in Parameter.objects.filter(**{owner_field: owner})}
+
+    to_create = []
+    to_update = []
+    kept = set()
+    for param in parameters:
+        parameter_type = types_by_id.get(to_uuid(param.get("parameter_type")))
+        if parameter_type is None:
+            logger.warning("Error synchronising parameter: unknown parameter type %s", param.get("parameter_type"))
+            # Continue even if parameter synchronisation fails
+            continue
+
+        values = {
+            "name": param.get("name", ""),
+            "value": param.get("value", ""),
+            "secret": param.get("secret", False),
+            "parameter_type_id": parameter_type.id,
+        }
+        instance = existing.get(to_uuid(param.get("id")))
+        if instance is None or instance.id in kept:
+            to_create.append(Parameter(**{owner_field: owner}, version_id=owner.version_id, **values))
+            continue
+
+        kept.add(instance.id)
+        changed = False
+        for field, value in values.items():
+            if getattr(instance, field) != value:
+                setattr(instance, field, value)
+                changed = True
+        if changed:
+            to_update.append(instance)
+
+    to_delete = [pk for pk in existing if pk not in kept]
+
+    with transaction.atomic():
+        lock_version(owner.version_id)
+        if to_delete:
+            Parameter.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            Parameter.objects.bulk_update(to_update, ["name", "value", "secret", "parameter_type"])
+        if to_create:
+            Parameter.objects.bulk_create(to_create)
+        record_changes(owner.version_id, "parameter", [param.id for param in to_update + to_create], locked=True)
+        if to_delete or to_update or to_create:
+            type(owner).bump_revision(pk=owner.pk)
+            notify_version_changed(owner.version_id)
+
 class ComponentView(viewsets.ViewSet):
     queryset = Component.objects.all()
     serializer_class = ComponentSerializer
@@ -33,23 +210,31 @@ class ComponentView(viewsets.ViewSet):
 
     def list(self, request):
         queryset = Component.objects.all()
-        serializer = self.serializer_class(queryset, many=True)
-        return Response(serializer.data)
+        return list_response(request, queryset, self.serializer_class)
 
     def retrieve(self, request, pk):
+        etag, version_id = element_etag(Component, pk, "detail", shared=True)
+        if etag_matches(request, etag):
+            return not_modified(etag)
         try:
-            item = Component.objects.select_related("version", "version__sut").prefetch_related("flowexecutions", "vulnerabilities", "parameters", "images").get(pk=pk)
-            serializer = ComponentGETSerializer(item)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            def build():
+                item = Component.objects.select_related("version", "version__sut").prefetch_related("flowexecutions", "vulnerabilities", "parameters", "images").get(pk=pk)
+                return ComponentGETSerializer(item).data
+
+            data = response_cache.get_or_build(version_id, f"component:{etag}", build)
+            return Response(data, status=status.HTTP_200_OK, headers=etag_headers(etag))
         except Component.DoesNotExist:
             return Response({"message": "The object does not exist"},
                             status=status.HTTP_404_NOT_FOUND)
     
     def retrieve_diagram(self, request, pk):
+        etag, _ = element_etag(Component, pk, "diagram")
+        if etag_matches(request, etag):
+            return not_modified(etag)
         try:
             item = Component.objects.prefetch_related("images", "parameters").get(pk=pk)
             serializer = DiagramComponentSerializer(item)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(serializer.data, status=status.HTTP_200_OK, headers=etag_headers(etag))
         except Component.DoesNotExist:
             return Response({"message": "The object does not exist"},
                             status=status.HTTP_404_NOT_FOUND)
@@ -93,19 +278,7 @@ class ComponentView(viewsets.ViewSet):
     
         # Handle parameters
         if parameters:
-            for param in parameters:
-                try:
-                    parameter_type = ParameterType.objects.get(id=param.get('parameter_type'))
-                    Parameter.objects.create(
-                        component=component_instance,
-                        name=param.get('name', ''),
-                        value=param.get('value', ''),
-                        secret=param.get('secret', False),
-                        parameter_type=parameter_type
-                    )
-                except Exception as e:
-                    print(f"Error creating parameter: {e}")
-                    # Continue even if parameter creation fails
+            sync_parameters("component", component_instance, parameters)
     
         # Handle images
         path = f"images/component/{pk}/"
@@ -192,8 +365,7 @@ class ComponentView(viewsets.ViewSet):
                         try:
                             img_update = ImageFile.objects.get(pk=image["uuid"])
                             try:
-                                img_update.default = image["default"]
-                                img_update.save(update_fields=["default"])
+                                img_update = write_image_default(img_update, component, image["default"])
                             except Exception as e:
                                 return Response({"message": e.__str__()}, status=500)
                             component_images.append(img_update)
@@ -209,6 +381,8 @@ class ComponentView(viewsets.ViewSet):
                     if img not in [img.uuid for img in component_images]
                 ]:
                     img = ImageFile.objects.get(pk=item)
+                    if image_in_use(img, component):
+                        continue
                     full_path = img.file.path
                     if os.path.exists(full_path):
                         os.remove(full_path)  # Delete from filesystem
@@ -229,25 +403,8 @@ class ComponentView(viewsets.ViewSet):
                     component.notes = component_data["notes"]
                     component.save()
 
-                    # First, delete existing parameters (need to be improve)
-                    Parameter.objects.filter(component=component).delete()
-        
                     # Update parameters
-                    if parameters:
-                        # Then create new ones
-                        for param in parameters:
-                            try:
-                                parameter_type = ParameterType.objects.get(id=param.get('parameter_type'))
-                                Parameter.objects.create(
-                                    component=component,
-                                    name=param.get('name', ''),
-                                    value=param.get('value', ''),
-                                    secret=param.get('secret', False),
-                                    parameter_type=parameter_type
-                                )
-                            except Exception as e:
-                                print(f"Error updating parameter: {e}")
-                                # Continue even if parameter update fails
+                    sync_parameters("component", component, parameters)
                                 
                 except Exception as e:
                     return Response({"message": e.__str__()}, status=500)
@@ -266,6 +423,9 @@ class ComponentView(viewsets.ViewSet):
             
             # Delete file paths first
             for img in images:
+                if image_in_use(img, component):
+                    # Image partagée avec une version clonée
+                    continue
                 try:
                     if img.file and os.path.exists(img.file.path):
                         os.remove(img.file.path)
@@ -306,14 +466,19 @@ class SubComponentView(viewsets.ViewSet):
 
     def list(self, request):
         queryset = SubComponent.objects.all()
-        serializer = self.serializer_class(queryset, many=True)
-        return Response(serializer.data)
+        return list_response(request, queryset, self.serializer_class)
 
     def retrieve(self, request, pk):
+        etag, version_id = element_etag(SubComponent, pk, "detail", shared=True)
+        if etag_matches(request, etag):
+            return not_modified(etag)
         try:
-            item = SubComponent.objects.select_related("version", "version__sut").prefetch_related("flowexecutions", "vulnerabilities", "parameters", "images").get(pk=pk)
-            serializer = SubComponentGETSerializer(item)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            def build():
+                item = SubComponent.objects.select_related("version", "version__sut").prefetch_related("flowexecutions", "vulnerabilities", "parameters", "images").get(pk=pk)
+                return SubComponentGETSerializer(item).data
+
+            data = response_cache.get_or_build(version_id, f"subcomponent:{etag}", build)
+            return Response(data, status=status.HTTP_200_OK, headers=etag_headers(etag))
         except SubComponent.DoesNotExist:
             return Response(
                 {"message": "The object does not exist"},
@@ -321,10 +486,13 @@ class SubComponentView(viewsets.ViewSet):
             )
     
     def retrieve_diagram(self, request, pk):
+        etag, _ = element_etag(SubComponent, pk, "diagram")
+        if etag_matches(request, etag):
+            return not_modified(etag)
         try:
             item = SubComponent.objects.prefetch_related("images", "parameters").get(pk=pk)
             serializer = DiagramSubComponentSerializer(item)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(serializer.data, status=status.HTTP_200_OK, headers=etag_headers(etag))
         except SubComponent.DoesNotExist:
             return Response(
                 {"message": "The object does not exist"},
@@ -381,19 +549,7 @@ class SubComponentView(viewsets.ViewSet):
         
                 # Handle parameters
         if parameters:
-            for param in parameters:
-                try:
-                    parameter_type = ParameterType.objects.get(id=param.get('parameter_type'))
-                    Parameter.objects.create(
-                        subcomponent=subcomponent_instance,
-                        name=param.get('name', ''),
-                        value=param.get('value', ''),
-                        secret=param.get('secret', False),
-                        parameter_type=parameter_type
-                    )
-                except Exception as e:
-                    print(f"Error creating parameter: {e}")
-                    # Continue even if parameter creation fails
+            sync_parameters("subcomponent", subcomponent_instance, parameters)
         # Handle images if any
         if files:
             pk = subcomponent_instance.id
@@ -492,8 +648,7 @@ class SubComponentView(viewsets.ViewSet):
                         try:
                             img_update = ImageFile.objects.get(pk=image["uuid"])
                             try:
-                                img_update.default = image["default"]
-                                img_update.save(update_fields=["default"])
+                                img_update = write_image_default(img_update, subcomponent, image["default"])
                             except Exception as e:
                                 return Response({"message": e.__str__()}, status=500)
                             subcomponent_images.append(img_update)
@@ -509,6 +664,8 @@ class SubComponentView(viewsets.ViewSet):
                     if img not in [img.uuid for img in subcomponent_images]
                 ]:
                     img = ImageFile.objects.get(pk=item)
+                    if image_in_use(img, subcomponent):
+                        continue
                     full_path = img.file.path
                     if os.path.exists(full_path):
                         os.remove(full_path)  # Delete from filesystem
@@ -533,23 +690,7 @@ class SubComponentView(viewsets.ViewSet):
 
 
                     # Update parameters
-                    # First, delete existing parameters (need to be improved)
-                    Parameter.objects.filter(subcomponent=subcomponent).delete()
-                    if parameters:
-                        # Then create new ones
-                        for param in parameters:
-                            try:
-                                parameter_type = ParameterType.objects.get(id=param.get('parameter_type'))
-                                Parameter.objects.create(
-                                    subcomponent=subcomponent,
-                                    name=param.get('name', ''),
-                                    value=param.get('value', ''),
-                                    secret=param.get('secret', False),
-                                    parameter_type=parameter_type
-                                )
-                            except Exception as e:
-                                print(f"Error updating parameter: {e}")
-                                # Continue even if parameter update fails
+                    sync_parameters("subcomponent", subcomponent, parameters)
                 except Exception as e:
                     return Response({"message": e.__str__()}, status=500)
 
@@ -567,6 +708,9 @@ class SubComponentView(viewsets.ViewSet):
             
             # Delete file paths first
             for img in images:
+                if image_in_use(img, subcomponent):
+                    # Image partagée avec une version clonée
+                    continue
                 try:
                     if img.file and os.path.exists(img.file.path):
                         os.remove(img.file.path)
@@ -577,6 +721,7 @@ class SubComponentView(viewsets.ViewSet):
             
             # Now delete the component (will cascade delete the images too)
             subcomponent.delete()
+            Component.bump_revision(pk=subcomponent.component_id)
             
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Component.DoesNotExist:
@@ -606,14 +751,19 @@ class PortView(viewsets.ViewSet):
 
     def list(self, request):
         queryset = Port.objects.all()
-        serializer = self.serializer_class(queryset, many=True)
-        return Response(serializer.data)
+        return list_response(request, queryset, self.serializer_class)
 
     def retrieve(self, request, pk):
+        etag, version_id = element_etag(Port, pk, "detail", shared=True)
+        if etag_matches(request, etag):
+            return not_modified(etag)
         try:
-            item = Port.objects.select_related("version", "version__sut").prefetch_related("flowexecutions", "vulnerabilities", "parameters", "images").get(pk=pk)
-            serializer = PortGETSerializer(item)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            def build():
+                item = Port.objects.select_related("version", "version__sut").prefetch_related("flowexecutions", "vulnerabilities", "parameters", "images").get(pk=pk)
+                return PortGETSerializer(item).data
+
+            data = response_cache.get_or_build(version_id, f"port:{etag}", build)
+            return Response(data, status=status.HTTP_200_OK, headers=etag_headers(etag))
         except Port.DoesNotExist:
             return Response(
                 {"message": "The object does not exist"},
@@ -621,10 +771,13 @@ class PortView(viewsets.ViewSet):
             )
 
     def retrieve_diagram(self, request, pk):
+        etag, _ = element_etag(Port, pk, "diagram")
+        if etag_matches(request, etag):
+            return not_modified(etag)
         try:
             item = Port.objects.prefetch_related("parameters", "images").get(pk=pk)
             serializer = DiagramPortSerializer(item)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(serializer.data, status=status.HTTP_200_OK, headers=etag_headers(etag))
         except Port.DoesNotExist:
             return Response(
                 {"message": "The object does not exist"},
@@ -681,19 +834,7 @@ class PortView(viewsets.ViewSet):
 
         # Handle parameters
         if parameters:
-            for param in parameters:
-                try:
-                    parameter_type = ParameterType.objects.get(id=param.get('parameter_type'))
-                    Parameter.objects.create(
-                        port=port_instance,
-                        name=param.get('name', ''),
-                        value=param.get('value', ''),
-                        secret=param.get('secret', False),
-                        parameter_type=parameter_type
-                    )
-                except Exception as e:
-                    print(f"Error creating parameter: {e}")
-                    # Continue even if parameter creation fails
+            sync_parameters("port", port_instance, parameters)
         
         # Handle images if any
         if files:
@@ -792,8 +933,7 @@ class PortView(viewsets.ViewSet):
                         try:
                             img_update = ImageFile.objects.get(pk=image["uuid"])
                             try:
-                                img_update.default = image["default"]
-                                img_update.save(update_fields=["default"])
+                                img_update = write_image_default(img_update, port, image["default"])
                             except Exception as e:
                                 return Response({"message": e.__str__()}, status=500)
                             port_images.append(img_update)
@@ -809,6 +949,8 @@ class PortView(viewsets.ViewSet):
                     if img not in [img.uuid for img in port_images]
                 ]:
                     img = ImageFile.objects.get(pk=item)
+                    if image_in_use(img, port):
+                        continue
                     full_path = img.file.path
                     if os.path.exists(full_path):
                         os.remove(full_path)  # Delete from filesystem
@@ -832,24 +974,7 @@ class PortView(viewsets.ViewSet):
                     port.save()
 
                     # Update parameters
-                    # First, delete existing parameters (need to be improve)
-                    Parameter.objects.filter(port=port).delete()
-                    if parameters:
-                        
-                        # Then create new ones
-                        for param in parameters:
-                            try:
-                                parameter_type = ParameterType.objects.get(id=param.get('parameter_type'))
-                                Parameter.objects.create(
-                                    port=port,
-                                    name=param.get('name', ''),
-                                    value=param.get('value', ''),
-                                    secret=param.get('secret', False),
-                                    parameter_type=parameter_type
-                                )
-                            except Exception as e:
-                                print(f"Error updating parameter: {e}")
-                                # Continue even if parameter update fails
+                    sync_parameters("port", port, parameters)
 
 
                 except Exception as e:
@@ -869,6 +994,9 @@ class PortView(viewsets.ViewSet):
             
             # Delete file paths first
             for img in images:
+                if image_in_use(img, port):
+                    # Image partagée avec une version clonée
+                    continue
                 try:
                     if img.file and os.path.exists(img.file.path):
                         os.remove(img.file.path)
@@ -879,6 +1007,7 @@ class PortView(viewsets.ViewSet):
             
             # Now delete the component (will cascade delete the images too)
             port.delete()
+            Component.bump_revision(pk=port.component_id)
             
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Component.DoesNotExist:
@@ -908,14 +1037,19 @@ class InterfaceView(viewsets.ViewSet):
 
     def list(self, request):
         queryset = Interface.objects.all()
-        serializer = self.serializer_class(queryset, many=True)
-        return Response(serializer.data)
+        return list_response(request, queryset, self.serializer_class)
 
     def retrieve(self, request, pk):
+        etag, version_id = element_etag(Interface, pk, "detail")
+        if etag_matches(request, etag):
+            return not_modified(etag)
         try:
-            item = Interface.objects.select_related("version", "version__sut", "port_from", "port_to_port", "port_to_subcomponent").prefetch_related("parameters", "images").get(pk=pk)
-            serializer = self.serializer_class(item)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            def build():
+                item = Interface.objects.select_related("version", "version__sut", "port_from", "port_to_port", "port_to_subcomponent").prefetch_related("parameters", "images").get(pk=pk)
+                return self.serializer_class(item).data
+
+            data = response_cache.get_or_build(version_id, f"interface:{etag}", build)
+            return Response(data, status=status.HTTP_200_OK, headers=etag_headers(etag))
         except Interface.DoesNotExist:
             return Response(
                 {"message": "The object does not exist"},
@@ -923,10 +1057,13 @@ class InterfaceView(viewsets.ViewSet):
             )
 
     def retrieve_diagram(self, request, pk):
+        etag, _ = element_etag(Interface, pk, "diagram")
+        if etag_matches(request, etag):
+            return not_modified(etag)
         try:
             item = Interface.objects.prefetch_related("parameters", "images").get(pk=pk)
             serializer = DiagramInterfaceSerializer(item)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(serializer.data, status=status.HTTP_200_OK, headers=etag_headers(etag))
         except Interface.DoesNotExist:
             return Response(
                 {"message": "The object does not exist"},
@@ -992,19 +1129,7 @@ class InterfaceView(viewsets.ViewSet):
     
         # Handle parameters
         if parameters:
-            for param in parameters:
-                try:
-                    parameter_type = ParameterType.objects.get(id=param.get('parameter_type'))
-                    Parameter.objects.create(
-                        interface=interface_instance,
-                        name=param.get('name', ''),
-                        value=param.get('value', ''),
-                        secret=param.get('secret', False),
-                        parameter_type=parameter_type
-                    )
-                except Exception as e:
-                    print(f"Error creating parameter: {e}")
-                    # Continue even if parameter creation fails
+            sync_parameters("interface", interface_instance, parameters)
     
         # Handle images if files exist
         if files:
@@ -1120,8 +1245,7 @@ class InterfaceView(viewsets.ViewSet):
                     else:
                         try:
                             img_update = ImageFile.objects.get(pk=image["uuid"])
-                            img_update.default = image["default"]
-                            img_update.save(update_fields=["default"])
+                            img_update = write_image_default(img_update, interface, image["default"])
                             interface_images.append(img_update)
                         except ImageFile.DoesNotExist:
                             return Response(
@@ -1132,6 +1256,8 @@ class InterfaceView(viewsets.ViewSet):
                 # Delete removed images
                 for item in [img for img in current_images if img not in [img.uuid for img in interface_images]]:
                     img = ImageFile.objects.get(pk=item)
+                    if image_in_use(img, interface):
+                        continue
                     if os.path.exists(img.file.path):
                         os.remove(img.file.path)
                     img.delete()
@@ -1146,23 +1272,8 @@ class InterfaceView(viewsets.ViewSet):
                 
                 interface.save()
 
-                # First, delete existing parameters (need to be improve)
-                Parameter.objects.filter(interface=interface).delete()
-                if parameters:
-                    # Then create new ones
-                    for param in parameters:
-                        try:
-                            parameter_type = ParameterType.objects.get(id=param.get('parameter_type'))
-                            Parameter.objects.create(
-                                interface=interface,
-                                name=param.get('name', ''),
-                                value=param.get('value', ''),
-                                secret=param.get('secret', False),
-                                parameter_type=parameter_type
-                            )
-                        except Exception as e:
-                            print(f"Error updating parameter: {e}")
-                            # Continue even if parameter update fails
+                # Update parameters
+                sync_parameters("interface", interface, parameters)
             except Exception as e:
                 return Response({"message": e.__str__()}, status=500)
                 
@@ -1184,6 +1295,9 @@ class InterfaceView(viewsets.ViewSet):
             
             # Delete file paths first
             for img in images:
+                if image_in_use(img, interface):
+                    # Image partagée avec une version clonée
+                    continue
                 try:
                     if img.file and os.path.exists(img.file.path):
                         os.remove(img.file.path)
@@ -1194,6 +1308,7 @@ class InterfaceView(viewsets.ViewSet):
             
             # Now delete the component (will cascade delete the images too)
             interface.delete()
+            Component.bump_revision(ports=interface.port_from_id)
             
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Component.DoesNotExist:
@@ -1220,11 +1335,19 @@ class ParameterView(viewsets.ModelViewSet):
     """
     queryset = Parameter.objects.all()
     serializer_class = ParameterSerializer
+    # Relations read by ParameterSerializer and CompleteParameterSerializer
+    element_relations = (
+        "component",
+        "subcomponent__component",
+        "port__component",
+        "interface__port_from__component",
+        "interface__port_to_port",
+        "interface__port_to_subcomponent",
+    )
 
     def list(self, request):
-        queryset = Parameter.objects.all()
-        serializer = self.serializer_class(queryset, many=True)
-        return Response(serializer.data)
+        queryset = self.get_queryset()
+        return list_response(request, queryset, self.serializer_class)
 
     def retrieve(self, request, pk):
         try:
@@ -1265,6 +1388,10 @@ class ParameterView(viewsets.ModelViewSet):
         try:
             item = Parameter.objects.get(pk=pk)
             item.delete()
+            for field_name in Parameter.OWNER_FIELDS:
+                owner_id = getattr(item, f"{field_name}_id")
+                if owner_id is not None:
+                    Parameter._meta.get_field(field_name).related_model.bump_revision(pk=owner_id)
             return Response(
                 {"message": "The object has been deleted"},
                 status=status.HTTP_204_NO_CONTENT,
@@ -1279,23 +1406,17 @@ class ParameterView(viewsets.ModelViewSet):
     def get_complete_parameters(self, request):
         """Récupère tous les paramètres avec leurs relations complètes"""
         parameters = self.get_queryset()
-        serializer = CompleteParameterSerializer(parameters, many=True)
-        return Response(serializer.data)
+        return list_response(request, parameters, CompleteParameterSerializer)
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().select_related(*self.element_relations)
         # Cherche si l'URL contient un paramètre de version
         version_id = self.request.query_params.get('version', None)
         
         if version_id:
             # Filtrer les paramètres par version
             # Si
-            queryset = queryset.filter(
-                models.Q(component__version__uuid=version_id) | 
-                models.Q(subcomponent__version__uuid=version_id) | 
-                models.Q(port__version__uuid=version_id) | 
-                models.Q(interface__version__uuid=version_id)
-            )
+            queryset = queryset.filter(version=version_id)
             
         return queryset
 
@@ -1314,8 +1435,7 @@ class ParameterTypeView(viewsets.ModelViewSet):
 
     def list(self, request):
         queryset = ParameterType.objects.all()
-        serializer = self.serializer_class(queryset, many=True)
-        return Response(serializer.data)
+        return list_response(request, queryset, self.serializer_class)
 
     def retrieve(self, request, pk):
         try:
@@ -1365,3 +1485,332 @@ class ParameterTypeView(viewsets.ModelViewSet):
                 {"message": "The object does not exist"},
                 status=status.HTTP_404_NOT_FOUND,
             )
+
+
+class VersionDiagramView(viewsets.ViewSet):
+    """
+    A viewset for handling the diagram of a whole Version at once.
+
+    - GET diagram-elements: Retrieves every Component, SubComponent, Port and Interface
+      of the Version, with their parameters and images, keyed by backend id.
+    - GET diagram-json: Retrieves the diagram layout of the Version and its revision.
+    - PUT diagram-json: Replaces the whole diagram layout.
+    - PATCH diagram-json: Applies the cell changes made since a base revision.
+    - POST diagram-json/flush: Writes the buffered layout saves to the database.
+    - POST batch: Creates, updates and deletes elements of the Version in one transaction.
+    - POST import: Imports an NDJSON file of elements and parameters (see diagram.importer).
+    - GET export: Streams every element, parameter and image link of the Version as JSON.
+    - POST clone: Copies the diagram graph of the Version into a new or an empty Version.
+    - GET diff?to=<uuid>: Compares the elements of the Version with those of another one.
+    - GET changes?since=<cursor>: Retrieves the elements changed or deleted after a cursor.
+    - GET reachability?from=<uuid>[&to=<uuid>]: Reachable elements, shortest or simple paths.
+    - GET metrics?order=<metric>&limit=<n>: Fan-in, fan-out, centrality and component size of the elements.
+    - GET validate: Checks the integrity of the elements and parameters of the Version.
+    - GET layout?bbox=min_x,min_y,max_x,max_y: Retrieves the cells intersecting a viewport.
+
+    Layout saves are written at once. With DIAGRAM_LAYOUT_FLUSH_INTERVAL set, they go
+    through the opt-in write-behind buffer of layout_buffer instead, and are
+    acknowledged before being written (see diagram.layout_buffer).
+    """
+    queryset = Version.objects.all()
+
+    def diagram_elements(self, request, pk):
+        """Récupère tous les éléments du diagramme d'une version en un seul appel"""
+        if not Version.objects.filter(pk=pk).exists():
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        elements = {}
+        for element_type, model, serializer_class in (
+            ("component", Component, DiagramComponentSerializer),
+            ("subcomponent", SubComponent, DiagramSubComponentSerializer),
+            ("port", Port, DiagramPortSerializer),
+            ("interface", Interface, DiagramInterfaceSerializer),
+        ):
+            queryset = model.objects.filter(version=pk).prefetch_related("images", "parameters")
+            data = serializer_class(queryset, many=True).data
+            elements[element_type] = {str(item["id"]): item for item in data}
+
+        return Response(elements, status=status.HTTP_200_OK)
+
+    def retrieve_diagram_json(self, request, pk):
+        buffered = layout_buffer.read(pk)
+        if buffered is not None:
+            document, revision = buffered
+            return Response({"revision": revision, "diagram_json": document}, status=status.HTTP_200_OK)
+        try:
+            version = Version.objects.get(pk=pk)
+        except Version.DoesNotExist:
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+        layout = DiagramLayout.objects.filter(version=version).first()
+        return Response(
+            {
+                "revision": layout.revision if layout else 0,
+                "diagram_json": load_document(version.diagram_json),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    def save_diagram_json(self, request, pk):
+        """Remplace tout le diagramme ; avec base_revision, refusé si le diagramme a changé depuis"""
+        document = request.data.get("diagram_json")
+        base_revision = request.data.get("base_revision")
+        if base_revision is not None and not isinstance(base_revision, int):
+            return Response({"message": "base_revision must be an integer"}, status=400)
+        try:
+            document = load_document(document)
+        except (TypeError, ValueError, AttributeError) as e:
+            return Response({"message": f"Invalid diagram_json: {e}"}, status=400)
+        return self._write_diagram_json(pk, base_revision, lambda current: document)
+
+    def patch_diagram_json(self, request, pk):
+        """Applique les modifications de cellules envoyées depuis une révision de base"""
+        patch = request.data
+        base_revision = patch.get("base_revision")
+        if not isinstance(base_revision, int):
+            return Response({"message": "base_revision is required"}, status=400)
+        return self._write_diagram_json(pk, base_revision, lambda current: apply_patch(current, patch))
+
+    def flush_diagram_json(self, request, pk):
+        """Écrit immédiatement en base le layout en attente de la version"""
+        if not Version.objects.filter(pk=pk).exists():
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+        layout_buffer.flush(pk)
+        layout = DiagramLayout.objects.filter(version=pk).first()
+        return Response({"revision": layout.revision if layout else 0}, status=status.HTTP_200_OK)
+
+    def batch(self, request, pk):
+        """Exécute une liste ordonnée de créations, modifications et suppressions d'éléments"""
+        if not Version.objects.filter(pk=pk).exists():
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+        try:
+            ids, results = run_batch(pk, request.data.get("operations"))
+        except BatchError as e:
+            return Response({"message": e.message, "operation": e.index}, status=400)
+        return Response({"ids": ids, "results": results}, status=status.HTTP_200_OK)
+
+    def import_elements(self, request, pk):
+        """Importe un fichier NDJSON (champ "file") d'éléments et de paramètres dans la version"""
+        if not Version.objects.filter(pk=pk).exists():
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"message": "An NDJSON file is required"}, status=400)
+        strict = request.query_params.get("strict") in ("1", "true")
+        report = import_ndjson(pk, upload, strict=strict)
+        if strict and report.error_count:
+            return Response(report.as_dict(), status=400)
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+    def export(self, request, pk):
+        """Exporte toute la version en un document JSON envoyé au fur et à mesure"""
+        layout_buffer.flush(pk)
+        try:
+            version = Version.objects.get(pk=pk)
+        except Version.DoesNotExist:
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+        response = StreamingHttpResponse(export_version(version), content_type="application/json")
+        response["Content-Disposition"] = f'attachment; filename="version-{version.pk}.json"'
+        return response
+
+    def clone(self, request, pk):
+        """
+        Copie le graphe du diagramme de la version dans la version "target" (vide),
+        ou dans une copie de la version si target n'est pas donné.
+        """
+        layout_buffer.flush(pk)
+        try:
+            source = Version.objects.get(pk=pk)
+            target = None
+            if request.data.get("target"):
+                target = Version.objects.get(pk=request.data["target"])
+        except (Version.DoesNotExist, ValueError, ValidationError):
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+        if target is not None and target.pk == source.pk:
+            return Response({"message": "A version cannot be cloned into itself"}, status=400)
+        try:
+            target, counts = clone_version(source, target)
+        except CloneError as e:
+            return Response({"message": str(e)}, status=400)
+        return Response({"version": str(target.pk), "copied": counts}, status=status.HTTP_201_CREATED)
+
+    def diff(self, request, pk):
+        """Compare les éléments de la version avec ceux de la version "to" """
+        other = to_uuid(request.query_params.get("to"))
+        if other is None:
+            return Response({"message": "The to parameter must be the uuid of a version"}, status=400)
+        if Version.objects.filter(pk__in=[pk, other]).count() != len({pk, other}):
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(diff_versions(pk, other), status=status.HTTP_200_OK)
+
+    def changes(self, request, pk):
+        """
+        Éléments, paramètres et images de la version modifiés ou supprimés après le
+        curseur since. Sans since, retourne seulement le curseur courant.
+        """
+        if not Version.objects.filter(pk=pk).exists():
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+        since = request.query_params.get("since")
+        if since is None:
+            return Response({"cursor": current_cursor(pk)}, status=status.HTTP_200_OK)
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({"message": "since must be a change cursor"}, status=400)
+        feed = changes_since(pk, since, {
+            "component": DiagramComponentSerializer,
+            "subcomponent": DiagramSubComponentSerializer,
+            "port": DiagramPortSerializer,
+            "interface": DiagramInterfaceSerializer,
+            "parameter": ChangedParameterSerializer,
+        })
+        return Response(feed, status=status.HTTP_200_OK)
+
+    def reachability(self, request, pk):
+        """
+        Accessibilité dans le graphe des interfaces de la version :
+        - sans "to" : éléments atteignables depuis "from" ;
+        - avec "to" : plus court chemin, ou tous les chemins simples si paths=1.
+        Options : max_depth, external=1 (la première interface traversée doit être
+        externe), containment=0 (ignore le lien entre un composant et ses parties).
+        """
+        source = to_uuid(request.query_params.get("from"))
+        target = to_uuid(request.query_params.get("to")) if request.query_params.get("to") else None
+        if source is None or (request.query_params.get("to") and target is None):
+            return Response({"message": "from and to must be element uuids"}, status=400)
+        try:
+            max_depth = request.query_params.get("max_depth")
+            max_depth = min(int(max_depth), 32) if max_depth else None
+        except ValueError:
+            return Response({"message": "max_depth must be an integer"}, status=400)
+        external_only = request.query_params.get("external") in ("1", "true")
+        containment = request.query_params.get("containment") not in ("0", "false")
+        if not Version.objects.filter(pk=pk).exists():
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        graph = VersionGraph.load(pk, containment=containment)
+
+        def step(node, interface):
+            return {"id": node, "kind": graph.kinds.get(node), "interface": interface}
+
+        if target is None:
+            reached = graph.reachable(source, external_only, max_depth)
+            return Response(
+                {
+                    "from": source,
+                    "reachable": [
+                        {"id": node, "kind": graph.kinds[node], "depth": depth}
+                        for node, depth in sorted(reached.items(), key=lambda item: item[1])
+                    ],
+                },
+                status=status.HTTP_200_OK,
+            )
+        if request.query_params.get("paths") in ("1", "true"):
+            paths, truncated = graph.simple_paths(source, target, max_depth or 8, external_only)
+            return Response(
+                {
+                    "from": source,
+                    "to": target,
+                    "paths": [[step(*item) for item in path] for path in paths],
+                    "truncated": truncated,
+                },
+                status=status.HTTP_200_OK,
+            )
+        path = graph.shortest_path(source, target, external_only, max_depth)
+        return Response(
+            {
+                "from": source,
+                "to": target,
+                "path": [step(*item) for item in path] if path is not None else None,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    def graph_metrics(self, request, pk):
+        """
+        Métriques du graphe de la version pour prioriser les tests (voir
+        diagram.graph_metrics), triées par la métrique "order" (centrality par défaut).
+        """
+        order = request.query_params.get("order", "centrality")
+        if order not in METRICS:
+            return Response({"message": f"order must be one of {', '.join(METRICS)}"}, status=400)
+        try:
+            limit = request.query_params.get("limit")
+            limit = int(limit) if limit else None
+        except ValueError:
+            return Response({"message": "limit must be an integer"}, status=400)
+        if not Version.objects.filter(pk=pk).exists():
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+        try:
+            metrics = version_metrics(pk)
+        except MetricsUnavailable as e:
+            return Response({"message": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        elements = sorted(metrics["elements"], key=lambda element: element[order], reverse=True)
+        return Response({**metrics, "elements": elements[:limit]}, status=status.HTTP_200_OK)
+
+    def validate(self, request, pk):
+        """Vérifie l'intégrité du diagramme de la version (voir diagram.validation)"""
+        if not Version.objects.filter(pk=pk).exists():
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(validate_version(pk).as_dict(), status=status.HTTP_200_OK)
+
+    def layout(self, request, pk):
+        """Récupère les cellules du layout qui intersectent le rectangle bbox"""
+        try:
+            bbox = parse_bbox(request.query_params.get("bbox"))
+        except ValueError as e:
+            return Response({"message": str(e)}, status=400)
+        try:
+            version = Version.objects.get(pk=pk)
+        except Version.DoesNotExist:
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        # Les enregistrements en attente sont écrits pour que l'index soit à jour
+        layout_buffer.flush(pk)
+        if not CellLayout.objects.filter(version=pk).exists() and version.diagram_json:
+            # Layout enregistré avant l'indexation des cellules
+            sync_cell_layouts(pk, load_document(version.diagram_json))
+
+        layout = DiagramLayout.objects.filter(version=pk).first()
+        cells = list(cells_in_bbox(pk, bbox))
+        return Response(
+            {
+                "revision": layout.revision if layout else 0,
+                "bbox": list(bbox),
+                "cells": [cell.cell for cell in cells],
+                "elementMapping": [
+                    {"id": cell.cell_id, "backendId": str(cell.backend_id), "type": cell.element_type}
+                    for cell in cells
+                    if cell.backend_id is not None
+                ],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    def _write_diagram_json(self, pk, base_revision, build):
+        try:
+            revision = layout_buffer.write(pk, base_revision, build)
+        except Version.DoesNotExist:
+            return Response({"message": "The object does not exist"},
+                            status=status.HTTP_404_NOT_FOUND)
+        except StaleLayoutRevision as e:
+            return Response(
+                {"message": "The diagram has changed since the base revision", "revision": e.revision},
+                status=status.HTTP_409_CONFLICT,
+            )
+        except (LayoutPatchError, TypeError, AttributeError, ValueError) as e:
+            return Response({"message": f"Invalid patch: {e}"}, status=400)
+        return Response({"revision": revision}, status=status.HTTP_200_OK)
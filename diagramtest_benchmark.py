@@ -0,0 +1,299 @@
+"""
+Benchmark of the diagram endpoints.
+
+Every list/retrieve/retrieve_diagram/create/update/destroy route (and the parameter
+``complete`` action) is called against a deterministic synthetic Version generated
+from the factories, and its SQL query count, wall time and peak Python memory are
+measured.
+
+- DIAGRAM_BENCH_SCALES: comma separated number of rows per model (default "10",
+  use "10,1000,50000" for the full benchmark).
+- DIAGRAM_BENCH_BUDGETS: JSON file of budgets (default "diagram_benchmark_budgets.json"),
+  ``{"<scale>": {"<route>": {"queries": int, "seconds": float, "peak_kib": int}}}``.
+  A route fails when it goes over its budget; missing keys are not checked.
+- DIAGRAM_BENCH_RECORD=1: write the measured values to the budget file instead of
+  checking them.
+- DIAGRAM_BENCH_OUTPUT: file the measures are appended to (none by default).
+
+Whatever the budgets, the single-object routes fail when their query count grows with
+the size of the Version.
+"""
+import json
+import os
+import random
+import time
+import tracemalloc
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from tests.factories import ComponentFactory, VersionFactory, SubComponentFactory, PortFactory, InterfaceFactory
+from diagram.models import Component, SubComponent, Port, Interface, Parameter, ParameterType
+
+
+pytestmark = pytest.mark.django_db
+
+SCALES = sorted(int(scale) for scale in os.environ.get("DIAGRAM_BENCH_SCALES", "10").split(","))
+BUDGETS_PATH = os.environ.get("DIAGRAM_BENCH_BUDGETS", "diagram_benchmark_budgets.json")
+RECORD = os.environ.get("DIAGRAM_BENCH_RECORD") == "1"
+OUTPUT_PATH = os.environ.get("DIAGRAM_BENCH_OUTPUT")
+BATCH_SIZE = 2000
+
+RESULTS = {}
+
+
+def load_budgets():
+    if not os.path.exists(BUDGETS_PATH):
+        return {}
+    with open(BUDGETS_PATH) as f:
+        return json.load(f)
+
+
+BUDGETS = load_budgets()
+
+
+class SyntheticVersion:
+    """
+    A Version holding ``scale`` rows of each diagram model.
+
+    Component i owns SubComponent i and Port i, Interface i goes from Port i to
+    Port i + 1, and Parameter i belongs in turn to a component, a subcomponent,
+    a port and an interface. Names and CIA flags only depend on the scale.
+    """
+
+    def __init__(self, scale):
+        self.scale = scale
+        rng = random.Random(scale)
+
+        def flags():
+            return {
+                "availability": rng.random() < 0.5,
+                "confidentiality": rng.random() < 0.5,
+                "integrity": rng.random() < 0.5,
+            }
+
+        self.version = VersionFactory()
+        self.parameter_type = ParameterType.objects.create(name=f"bench-{scale}")
+
+        components = [
+            ComponentFactory.build(version=self.version, name=f"component-{i}", **flags())
+            for i in range(scale)
+        ]
+        Component.objects.bulk_create(components, batch_size=BATCH_SIZE)
+
+        subcomponents = [
+            SubComponentFactory.build(version=self.version, component=components[i], name=f"subcomponent-{i}", **flags())
+            for i in range(scale)
+        ]
+        SubComponent.objects.bulk_create(subcomponents, batch_size=BATCH_SIZE)
+
+        ports = [
+            PortFactory.build(version=self.version, component=components[i], name=f"port-{i}", **flags())
+            for i in range(scale)
+        ]
+        Port.objects.bulk_create(ports, batch_size=BATCH_SIZE)
+
+        interfaces = [
+            InterfaceFactory.build(
+                version=self.version,
+                name=f"interface-{i}",
+                type="external" if i % 2 else "internal",
+                port_from=ports[i],
+                port_to_port=ports[(i + 1) % scale],
+                port_to_subcomponent=None,
+                **flags(),
+            )
+            for i in range(scale)
+        ]
+        Interface.objects.bulk_create(interfaces, batch_size=BATCH_SIZE)
+
+        owners = (("component", components), ("subcomponent", subcomponents), ("port", ports), ("interface", interfaces))
+        parameters = []
+        for i in range(scale):
+            owner_field, elements = owners[i % len(owners)]
+            owner = {field: None for field, _ in owners}
+            owner[owner_field] = elements[i]
+            parameters.append(
+                Parameter(
+                    name=f"parameter-{i}",
+                    value=f"value-{i}",
+                    secret=False,
+                    parameter_type=self.parameter_type,
+                    version=self.version,
+                    **owner,
+                )
+            )
+        Parameter.objects.bulk_create(parameters, batch_size=BATCH_SIZE)
+
+        self.component = components[0]
+        self.subcomponent = subcomponents[0]
+        self.port = ports[0]
+        self.interface = interfaces[0]
+        self.parameter = parameters[0]
+
+    def delete(self):
+        self.version.delete()
+        self.parameter_type.delete()
+
+
+@pytest.fixture(scope="module", params=SCALES)
+def synthetic_version(request, django_db_setup, django_db_blocker):
+    with django_db_blocker.unblock():
+        data = SyntheticVersion(request.param)
+    yield data
+    with django_db_blocker.unblock():
+        data.delete()
+
+
+def element_payload(data, **extra):
+    payload = {
+        "name": "bench",
+        "description": "bench",
+        "availability": "False",
+        "confidentiality": "True",
+        "integrity": "False",
+        "notes": "",
+        "images": "[]",
+        "parameters": json.dumps([
+            {"name": "bench", "value": "bench", "secret": False, "parameter_type": str(data.parameter_type.id)}
+        ]),
+    }
+    payload.update(extra)
+    return payload
+
+
+def component_payload(data):
+    return element_payload(data, version=str(data.version.uuid))
+
+
+def child_payload(data):
+    return element_payload(data, component=str(data.component.id))
+
+
+def interface_payload(data):
+    return element_payload(data, port_from=str(data.port.id), port_to_port=str(data.interface.port_to_port_id), type="external")
+
+
+def parameter_payload(data):
+    return {"name": "bench", "value": "bench", "secret": False, "parameter_type": data.parameter_type.name}
+
+
+def parameter_type_payload(data):
+    return {"name": f"bench-type-{data.scale}", "description": "bench", "generic": False}
+
+
+# name: (method, url, payload, format)
+ROUTES = {
+    "component-list": ("get", lambda d: "/api/component/", None, None),
+    "component-retrieve": ("get", lambda d: f"/api/component/{d.component.id}/", None, None),
+    "component-diagram": ("get", lambda d: f"/api/component/{d.component.id}/diagram/", None, None),
+    "component-create": ("post", lambda d: "/api/component/", component_payload, "multipart"),
+    "component-update": ("put", lambda d: f"/api/component/{d.component.id}/", component_payload, "multipart"),
+    "component-destroy": ("delete", lambda d: f"/api/component/{d.component.id}/", None, None),
+    "subcomponent-list": ("get", lambda d: "/api/subcomponent/", None, None),
+    "subcomponent-retrieve": ("get", lambda d: f"/api/subcomponent/{d.subcomponent.id}/", None, None),
+    "subcomponent-diagram": ("get", lambda d: f"/api/subcomponent/{d.subcomponent.id}/diagram/", None, None),
+    "subcomponent-create": ("post", lambda d: "/api/subcomponent/", child_payload, "multipart"),
+    "subcomponent-update": ("put", lambda d: f"/api/subcomponent/{d.subcomponent.id}/", child_payload, "multipart"),
+    "subcomponent-destroy": ("delete", lambda d: f"/api/subcomponent/{d.subcomponent.id}/", None, None),
+    "port-list": ("get", lambda d: "/api/port/", None, None),
+    "port-retrieve": ("get", lambda d: f"/api/port/{d.port.id}/", None, None),
+    "port-diagram": ("get", lambda d: f"/api/port/{d.port.id}/diagram/", None, None),
+    "port-create": ("post", lambda d: "/api/port/", child_payload, "multipart"),
+    "port-update": ("put", lambda d: f"/api/port/{d.port.id}/", child_payload, "multipart"),
+    "port-destroy": ("delete", lambda d: f"/api/port/{d.port.id}/", None, None),
+    "interface-list": ("get", lambda d: "/api/interface/", None, None),
+    "interface-retrieve": ("get", lambda d: f"/api/interface/{d.interface.id}/", None, None),
+    "interface-diagram": ("get", lambda d: f"/api/interface/{d.interface.id}/diagram/", None, None),
+    "interface-create": ("post", lambda d: "/api/interface/", interface_payload, "multipart"),
+    "interface-update": ("put", lambda d: f"/api/interface/{d.interface.id}/", interface_payload, "multipart"),
+    "interface-destroy": ("delete", lambda d: f"/api/interface/{d.interface.id}/", None, None),
+    "parameter-list": ("get", lambda d: f"/api/parameter/?version={d.version.uuid}", None, None),
+    "parameter-complete": ("get", lambda d: f"/api/parameter/complete/?version={d.version.uuid}", None, None),
+    "parameter-retrieve": ("get", lambda d: f"/api/parameter/{d.parameter.id}/", None, None),
+    "parameter-create": ("post", lambda d: "/api/parameter/", parameter_payload, "json"),
+    "parameter-update": ("put", lambda d: f"/api/parameter/{d.parameter.id}/", parameter_payload, "json"),
+    "parameter-destroy": ("delete", lambda d: f"/api/parameter/{d.parameter.id}/", None, None),
+    "parameter-type-list": ("get", lambda d: "/api/parameter-type/", None, None),
+    "parameter-type-retrieve": ("get", lambda d: f"/api/parameter-type/{d.parameter_type.id}/", None, None),
+    "parameter-type-create": ("post", lambda d: "/api/parameter-type/", parameter_type_payload, "json"),
+    "parameter-type-update": ("put", lambda d: f"/api/parameter-type/{d.parameter_type.id}/", parameter_type_payload, "json"),
+    "parameter-type-destroy": ("delete", lambda d: f"/api/parameter-type/{d.parameter_type.id}/", None, None),
+}
+
+# Routes whose work depends on the whole table or Version
+SCALED_ROUTES = {name for name in ROUTES if name.endswith(("-list", "-complete"))}
+
+
+def measure(client, method, url, payload, format):
+    kwargs = {}
+    if payload is not None:
+        kwargs = {"data": payload, "format": format}
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, **kwargs)
+            seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return response, {"queries": len(queries.captured_queries), "seconds": seconds, "peak_kib": peak // 1024}
+
+
+def write_output(scale, route, result):
+    if not OUTPUT_PATH:
+        return
+    with open(OUTPUT_PATH, "a") as f:
+        f.write(
+            f"{scale:>7} {route:<26} {result['queries']:>7} queries "
+            f"{result['seconds'] * 1000:>10.1f} ms {result['peak_kib']:>9} KiB\n"
+        )
+
+
+@pytest.fixture(scope="module", autouse=True)
+def record_budgets():
+    yield
+    if RECORD and RESULTS:
+        budgets = load_budgets()
+        for (scale, route), result in RESULTS.items():
+            budgets.setdefault(str(scale), {})[route] = {
+                "queries": result["queries"],
+                "seconds": round(result["seconds"] * 1.5 + 0.05, 3),
+                "peak_kib": int(result["peak_kib"] * 1.5) + 256,
+            }
+        with open(BUDGETS_PATH, "w") as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+
+
+class Test_DiagramBenchmark:
+
+    # Warm up the process-wide caches (ParameterType, ...) outside the measures
+    @pytest.fixture(autouse=True)
+    def warm_up(self, synthetic_version, api_client):
+        api_client().get(f"/api/parameter/{synthetic_version.parameter.id}/")
+
+    @pytest.mark.parametrize("route", list(ROUTES))
+    def test_route(self, route, synthetic_version, api_client):
+        method, url, payload, format = ROUTES[route]
+        data = synthetic_version
+
+        response, result = measure(api_client(), method, url(data), payload(data) if payload else None, format)
+
+        assert response.status_code < 400, response.content
+        RESULTS[(data.scale, route)] = result
+        write_output(data.scale, route, result)
+
+        if route not in SCALED_ROUTES and data.scale != SCALES[0] and (SCALES[0], route) in RESULTS:
+            # Single-object routes must not depend on the size of the Version
+            assert result["queries"] <= RESULTS[(SCALES[0], route)]["queries"], (
+                f"{route} issues more queries at scale {data.scale} than at scale {SCALES[0]}"
+            )
+
+        budget = BUDGETS.get(str(data.scale), {}).get(route)
+        if budget and not RECORD:
+            for key in ("queries", "seconds", "peak_kib"):
+                if key in budget:
+                    assert result[key] <= budget[key], (
+                        f"{route} at scale {data.scale}: {key} {result[key]} over budget {budget[key]}"
+                    )
@@ -3,6 +3,10 @@ from tests.factories import  ComponentFactory, VersionFactory
 import uuid6 as uuid
 from django.core.files.uploadedfile import SimpleUploadedFile
 import json
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from diagram.models import ChangeEvent, Component, Parameter, ParameterType, Version
+from diagram.caches import response_cache
 
  
 pytestmark = pytest.mark.django_db
@@ -23,12 +27,106 @@ class Test_ComponentView:
         assert response.data[0]["name"] == "Component"
         assert response.data[0]["description"] == "description"
     
+    def test_list_paginated(self, component_factory, api_client):
+        components = [component_factory() for _ in range(3)]
+        client = api_client()
+
+        response = client.get(f"{self.endpoint}?page_size=2")
+
+        assert response.status_code == 200
+        assert [item["id"] for item in response.data["results"]] == sorted(str(c.id) for c in components)[:2]
+        assert response.data["next"] is not None
+
+        response = client.get(response.data["next"])
+
+        assert response.status_code == 200
+        assert len(response.data["results"]) == 1
+        assert response.data["next"] is None
+
     def test_retrieve(self, component_factory, api_client):
         component_factory()
         component = component_factory()
         response = api_client().get(f"{self.endpoint}{component.id}/")
         assert response.status_code == 200
     
+    def test_retrieve_etag(self, component_factory, api_client):
+        component = component_factory()
+        client = api_client()
+
+        for url in (f"{self.endpoint}{component.id}/", f"{self.endpoint}{component.id}/diagram/"):
+            response = client.get(url)
+            assert response.status_code == 200
+            etag = response["ETag"]
+
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            assert response.status_code == 304
+
+            component.notes = f"notes for {url}"
+            component.save()
+
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            assert response.status_code == 200
+            assert response["ETag"] != etag
+
+    def test_retrieve_etag_shared_data(self, component_factory, api_client):
+        component = component_factory()
+        client = api_client()
+        url = f"{self.endpoint}{component.id}/"
+        etag = client.get(url)["ETag"]
+
+        # Writes to the Version data of other apps bump its generation
+        response_cache.bump(component.version_id)
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+        # The diagram representation only shows the component
+        etag = client.get(f"{url}diagram/")["ETag"]
+        response_cache.bump(component.version_id)
+        assert client.get(f"{url}diagram/", HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    def test_retrieve_after_version_saved(self, component_factory, api_client, django_capture_on_commit_callbacks):
+        component = component_factory()
+        client = api_client()
+        url = f"{self.endpoint}{component.id}/"
+        etag = client.get(url)["ETag"]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            component.version.save()
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+
+    def test_save_locks_version_first(self, component_factory):
+        component = component_factory()
+        component.notes = "locked"
+
+        with CaptureQueriesContext(connection) as queries:
+            component.save(update_fields=["notes"])
+
+        # The Version is locked before the element row, as in the bulk writes
+        statements = [query["sql"] for query in queries.captured_queries if not query["sql"].startswith(("SAVEPOINT", "RELEASE"))]
+        assert Version._meta.db_table in statements[0]
+        event = ChangeEvent.objects.filter(version=component.version_id).latest("id")
+        component.refresh_from_db()
+        assert (event.element_id, event.operation) == (component.pk, ChangeEvent.UPSERT)
+        # The sequence is stored with the element row, without another update
+        assert component.change_seq == event.id
+        assert not any(statement.startswith("UPDATE") and "change_seq" in statement and "notes" not in statement
+                       for statement in statements)
+
+    def test_concurrent_saves_revision(self, component_factory):
+        component = component_factory()
+        first = Component.objects.get(pk=component.pk)
+        second = Component.objects.get(pk=component.pk)
+
+        first.notes = "first"
+        first.save()
+        second.notes = "second"
+        second.save()
+        assert second.revision == first.revision + 1
+
     def test_create(self, api_client):
         version = VersionFactory()
         
@@ -122,4 +220,37 @@ class Test_ComponentView:
     def test_destroy(self, component_factory, api_client):
         component = component_factory()
         response = api_client().delete(f"{self.endpoint}{component.id}/")
-        assert response.status_code == 204
\ No newline at end of file
+        assert response.status_code == 204
+
+    def test_update_parameters_diff(self, component_factory, api_client):
+        component = component_factory()
+        parameter_type = ParameterType.objects.create(name="IP")
+        kept = Parameter.objects.create(component=component, name="ip", value="10.0.0.1", parameter_type=parameter_type)
+        changed = Parameter.objects.create(component=component, name="mask", value="/24", parameter_type=parameter_type)
+        removed = Parameter.objects.create(component=component, name="gateway", value="10.0.0.254", parameter_type=parameter_type)
+
+        parameters = [
+            {"id": str(kept.id), "name": "ip", "value": "10.0.0.1", "secret": False, "parameter_type": str(parameter_type.id)},
+            {"id": str(changed.id), "name": "mask", "value": "/16", "secret": False, "parameter_type": str(parameter_type.id)},
+            {"name": "dns", "value": "10.0.0.53", "secret": False, "parameter_type": str(parameter_type.id)},
+        ]
+        data = {
+            "name": component.name,
+            "description": "description",
+            "availability": "False",
+            "confidentiality": "False",
+            "integrity": "False",
+            "version": str(component.version.uuid),
+            "notes": "",
+            "images": "[]",
+            "parameters": json.dumps(parameters),
+        }
+
+        response = api_client().put(f"{self.endpoint}{component.id}/", data, format="multipart")
+
+        assert response.status_code == 200
+        values = dict(Parameter.objects.filter(component=component).values_list("name", "value"))
+        assert values == {"ip": "10.0.0.1", "mask": "/16", "dns": "10.0.0.53"}
+        assert Parameter.objects.filter(pk=kept.pk).exists()
+        assert Parameter.objects.get(pk=changed.pk).value == "/16"
+        assert not Parameter.objects.filter(pk=removed.pk).exists()
\ No newline at end of file
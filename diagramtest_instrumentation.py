@@ -0,0 +1,102 @@
+import logging
+import re
+
+import pytest
+from diagram.instrumentation import metrics
+
+
+pytestmark = pytest.mark.django_db
+
+MIDDLEWARE = "diagram.instrumentation.DiagramMetricsMiddleware"
+
+
+@pytest.fixture
+def instrumented(settings):
+    settings.MIDDLEWARE = [*settings.MIDDLEWARE, MIDDLEWARE]
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def sample(text, name, **labels):
+    """Value of the sample of a metric whose labels include the given ones"""
+    for line in text.splitlines():
+        match = re.fullmatch(rf"{name}\{{(.*)\}} (\S+)", line)
+        if match is None:
+            continue
+        pairs = dict(re.findall(r'(\w+)="([^"]*)"', match.group(1)))
+        if all(pairs.get(key) == value for key, value in labels.items()):
+            return float(match.group(2))
+    return None
+
+
+class Test_DiagramMetrics:
+    endpoint = "/api/metrics/"
+
+    def test_request_metrics(self, instrumented, component_factory, api_client):
+        component = component_factory()
+        client = api_client()
+
+        response = client.get(f"/api/component/{component.pk}/")
+        assert response.status_code == 200
+        client.get(f"/api/component/{component.pk}/")
+
+        response = client.get(self.endpoint)
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain")
+        text = response.content.decode()
+        assert "# TYPE diagram_request_duration_seconds histogram" in text
+
+        route = next(
+            pairs["route"] for pairs in (dict(re.findall(r'(\w+)="([^"]*)"', line)) for line in text.splitlines())
+            if pairs.get("route", "").endswith("component-detail")
+        )
+        labels = {"route": route, "method": "GET", "status": "200"}
+        assert sample(text, "diagram_request_duration_seconds_count", **labels) == 2
+        assert sample(text, "diagram_request_duration_seconds_bucket", le="+Inf", **labels) == 2
+        assert sample(text, "diagram_request_duration_seconds_sum", **labels) > 0
+        assert sample(text, "diagram_sql_queries_total", **labels) >= 2
+        assert sample(text, "diagram_sql_seconds_total", **labels) > 0
+        assert sample(text, "diagram_serializer_seconds_total", **labels) > 0
+        assert sample(text, "diagram_response_bytes_total", **labels) > 0
+        # The metrics endpoint itself is not recorded
+        assert not re.search(r'route="([^"]*:)?metrics"', text)
+
+    def test_buckets_are_cumulative(self, instrumented, component_factory, api_client):
+        component = component_factory()
+        api_client().get(f"/api/component/{component.pk}/")
+
+        text = api_client().get(self.endpoint).content.decode()
+        counts = [
+            float(value) for value in re.findall(r'diagram_request_duration_seconds_bucket\{[^}]*method="GET"[^}]*\} (\S+)', text)
+        ]
+        assert counts
+        assert counts == sorted(counts)
+        assert counts[-1] == 1
+
+    def test_error_status(self, instrumented, api_client):
+        api_client().get("/api/component/00000000-0000-0000-0000-000000000000/")
+
+        text = api_client().get(self.endpoint).content.decode()
+        assert sample(text, "diagram_request_duration_seconds_count", method="GET", status="404") == 1
+
+    def test_forbidden_address(self, instrumented, api_client):
+        response = api_client().get(self.endpoint, REMOTE_ADDR="10.0.0.1")
+
+        assert response.status_code == 403
+
+    def test_slow_request_log(self, instrumented, settings, component_factory, api_client, caplog):
+        settings.DIAGRAM_SLOW_REQUEST_MS = 0
+        component = component_factory()
+
+        with caplog.at_level(logging.WARNING, logger="diagram.instrumentation"):
+            api_client().get(f"/api/component/{component.pk}/")
+
+        assert any("Slow request GET" in record.getMessage() for record in caplog.records)
+
+    def test_serializer_time_outside_requests(self, component_factory):
+        from diagram.serializers import ComponentSerializer
+
+        # Without a recorder (shell, commands) the serializers are not timed
+        assert ComponentSerializer(component_factory()).data["name"] == "Component"
+        assert not metrics.to_prometheus().count("diagram_request_duration_seconds_count")
@@ -4,6 +4,7 @@ import uuid6 as uuid
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils.datastructures import MultiValueDict
 import json
+from diagram.models import Parameter
 
 
 pytestmark = pytest.mark.django_db
@@ -178,6 +179,52 @@ class Test_InterfaceView:
         assert response.data["port_to_port"] is None
         assert str(response.data["port_to_subcomponent"]) == str(subcomponent.id)
     
+    def test_retrieve_etag_after_target_deleted(self, component_factory, port_factory, interface_factory, api_client):
+        component = component_factory()
+        port_from = port_factory(component=component, version=component.version)
+        port_to = port_factory(component=component, version=component.version)
+        interface = interface_factory(port_from=port_from, port_to_port=port_to, port_to_subcomponent=None,
+                                      version=component.version)
+        client = api_client()
+        url = f"{self.endpoint}{interface.id}/"
+        etag = client.get(url)["ETag"]
+
+        # La cible est supprimée : l'interface perd son port_to_port (SET_NULL)
+        response = client.delete(f"/api/port/{port_to.id}/")
+        assert response.status_code == 204
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.data["port_to_port"] is None
+
+    def test_retrieve_etag_after_end_changed(self, component_factory, port_factory, interface_factory, api_client):
+        component = component_factory()
+        port_from = port_factory(component=component, version=component.version)
+        port_to = port_factory(component=component, version=component.version)
+        interface = interface_factory(port_from=port_from, port_to_port=port_to, port_to_subcomponent=None,
+                                      version=component.version)
+        client = api_client()
+        url = f"{self.endpoint}{interface.id}/"
+
+        # Les interfaces affichent leurs extrémités : leur ETag suit celles-ci
+        etag = client.get(url)["ETag"]
+        port_to.name = "Renamed"
+        port_to.save()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+        etag = response["ETag"]
+        Parameter.objects.create(port=port_from, name="ip", value="10.0.0.1")
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+        etag = response["ETag"]
+        component.name = "Renamed component"
+        component.save()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code == 304
+
     def test_destroy(self, interface_factory, api_client):
         interface = interface_factory()
         response = api_client().delete(f"{self.endpoint}{interface.id}/")
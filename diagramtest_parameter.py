@@ -0,0 +1,100 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from tests.factories import ComponentFactory, VersionFactory, SubComponentFactory, PortFactory, InterfaceFactory
+from diagram.models import Parameter, ParameterType
+from diagram.caches import ParameterTypeCache, parameter_types
+
+
+pytestmark = pytest.mark.django_db
+
+class Test_ParameterView:
+    endpoint = "/api/parameter/"
+
+    def create_parameters(self, version, parameter_type, component_factory, sub_component_factory, port_factory, interface_factory):
+        component = component_factory(version=version)
+        subcomponent = sub_component_factory(component=component, version=version)
+        port_from = port_factory(component=component, version=version)
+        port_to = port_factory(component=component, version=version)
+        interface = interface_factory(port_from=port_from, port_to_port=port_to, port_to_subcomponent=None, version=version)
+        for owner in ({"component": component}, {"subcomponent": subcomponent}, {"port": port_from}, {"interface": interface}):
+            Parameter.objects.create(name="param", value="value", parameter_type=parameter_type, **owner)
+
+    def test_complete(self, component_factory, sub_component_factory, port_factory, interface_factory, api_client):
+        version = VersionFactory()
+        parameter_type = ParameterType.objects.create(name="IP")
+        self.create_parameters(version, parameter_type, component_factory, sub_component_factory, port_factory, interface_factory)
+
+        response = api_client().get(f"{self.endpoint}complete/?version={version.uuid}")
+
+        assert response.status_code == 200
+        assert len(response.data) == 4
+        by_type = {item["element_type"]: item for item in response.data}
+        assert by_type["component"]["parent_component"] is None
+        assert by_type["subcomponent"]["parent_info"].startswith("Component: ")
+        assert by_type["interface"]["connection_details"]["port_to"] is not None
+        assert by_type["port"]["parameter_type"] == "IP"
+
+    @pytest.mark.parametrize("url", ["complete/", ""])
+    def test_constant_queries(self, url, component_factory, sub_component_factory, port_factory, interface_factory, api_client):
+        version = VersionFactory()
+        parameter_type = ParameterType.objects.create(name="IP")
+        self.create_parameters(version, parameter_type, component_factory, sub_component_factory, port_factory, interface_factory)
+        client = api_client()
+        # Load the ParameterType cache before measuring
+        client.get(f"{self.endpoint}{url}?version={version.uuid}")
+
+        with CaptureQueriesContext(connection) as small:
+            client.get(f"{self.endpoint}{url}?version={version.uuid}")
+
+        for _ in range(10):
+            self.create_parameters(version, parameter_type, component_factory, sub_component_factory, port_factory, interface_factory)
+
+        with CaptureQueriesContext(connection) as large:
+            response = client.get(f"{self.endpoint}{url}?version={version.uuid}")
+
+        assert response.status_code == 200
+        assert len(response.data) == 44
+        assert len(large.captured_queries) == len(small.captured_queries)
+
+
+class Test_ParameterTypeCache:
+
+    def test_missing_key_loaded_alone(self, django_assert_num_queries):
+        cache = ParameterTypeCache()
+        known = ParameterType.objects.create(name="IP")
+        assert cache.get_by_id(known.id) == known
+
+        created = ParameterType.objects.create(name="Port")
+        # Only the missing type is read, not the whole catalogue
+        with django_assert_num_queries(1):
+            assert cache.get_by_id(created.id) == created
+        with django_assert_num_queries(0):
+            assert cache.get_by_name("Port") == created
+            assert cache.in_bulk([known.id, created.id]) == {known.id: known, created.id: created}
+
+    def test_negative_lookups_cached(self, django_assert_num_queries):
+        cache = ParameterTypeCache()
+        ParameterType.objects.create(name="IP")
+        cache.get_by_name("IP")
+
+        with django_assert_num_queries(2):
+            assert cache.get_by_name("unknown") is None
+            assert cache.in_bulk([-1, -2]) == {}
+        with django_assert_num_queries(0):
+            assert cache.get_by_name("unknown") is None
+            assert cache.get_by_id(-1) is None
+            assert cache.in_bulk([-2]) == {}
+
+    def test_invalidated_on_commit(self, django_capture_on_commit_callbacks):
+        assert parameter_types.get_by_name("unknown") is None
+
+        with django_capture_on_commit_callbacks() as callbacks:
+            parameter_type = ParameterType.objects.create(name="unknown")
+        # The lookups of the transaction see the new type
+        assert parameter_types.get_by_name("unknown") == parameter_type
+        # A reload before the commit read the old rows: it is dropped once committed
+        assert parameter_types.invalidate in callbacks
+        for callback in callbacks:
+            callback()
+        assert parameter_types._by_id is None
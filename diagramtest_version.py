@@ -0,0 +1,750 @@
+import json
+import logging
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.core.exceptions import ValidationError
+from django.test.utils import CaptureQueriesContext
+from tests.factories import ComponentFactory, VersionFactory, SubComponentFactory, PortFactory, InterfaceFactory
+from diagram.models import ChangeEvent, Component, ImageFile, Port, Interface, Parameter, ParameterType, SubComponent
+from uuid6 import uuid7
+from diagram.clone import clone_version
+from diagram.diff import COMPARED_FIELDS, match
+from diagram.signals import PendingDeletions
+from diagram.views import sync_parameters, write_image_default
+from diagram.layout import apply_patch, read_layout, write_layout
+from diagram.layout_buffer import LayoutWriteBehindBuffer
+from diagram.snapshot import load_snapshot
+from diagram.cia import recompute_version
+
+
+pytestmark = pytest.mark.django_db
+
+ENDPOINT = "/api/version/"
+
+
+@pytest.fixture
+def diagram_factory(component_factory, sub_component_factory, port_factory, interface_factory):
+    """Adds to a Version a component, its sub-component and an interface between two of its ports"""
+    def create(version):
+        component = component_factory(version=version)
+        subcomponent = sub_component_factory(component=component, version=version)
+        port_from = port_factory(component=component, version=version)
+        port_to = port_factory(component=component, version=version)
+        interface = interface_factory(port_from=port_from, port_to_port=port_to, version=version)
+        return component, subcomponent, port_from, interface
+    return create
+
+
+@pytest.fixture
+def chain(component_factory, sub_component_factory, port_factory, interface_factory):
+    """c1.p1 --external--> c2.p2a, c2.p2b --internal--> c3.sub3"""
+    version = VersionFactory()
+    c1, c2, c3 = (component_factory(version=version) for _ in range(3))
+    p1 = port_factory(component=c1, version=version)
+    p2a = port_factory(component=c2, version=version)
+    p2b = port_factory(component=c2, version=version)
+    sub3 = sub_component_factory(component=c3, version=version)
+    i1 = interface_factory(port_from=p1, port_to_port=p2a, port_to_subcomponent=None, type="external", version=version)
+    i2 = interface_factory(port_from=p2b, port_to_port=None, port_to_subcomponent=sub3, type="internal", version=version)
+    return version, (c1, c2, c3, p1, p2a, p2b, sub3, i1, i2)
+
+
+class Test_VersionDiagramElements:
+    endpoint = ENDPOINT
+
+    def test_diagram_elements(self, diagram_factory, api_client):
+        version = VersionFactory()
+        component, subcomponent, port, interface = diagram_factory(version)
+
+        response = api_client().get(f"{self.endpoint}{version.uuid}/diagram-elements/")
+
+        assert response.status_code == 200
+        assert response.data["component"][str(component.id)]["name"] == component.name
+        assert str(subcomponent.id) in response.data["subcomponent"]
+        assert str(port.id) in response.data["port"]
+        assert str(interface.id) in response.data["interface"]
+        assert "parameters" in response.data["port"][str(port.id)]
+        assert "images" in response.data["interface"][str(interface.id)]
+
+    def test_diagram_elements_constant_queries(self, diagram_factory, api_client):
+        version = VersionFactory()
+        diagram_factory(version)
+        client = api_client()
+
+        with CaptureQueriesContext(connection) as small:
+            client.get(f"{self.endpoint}{version.uuid}/diagram-elements/")
+
+        for _ in range(5):
+            diagram_factory(version)
+
+        with CaptureQueriesContext(connection) as large:
+            response = client.get(f"{self.endpoint}{version.uuid}/diagram-elements/")
+
+        assert response.status_code == 200
+        assert len(response.data["component"]) == 6
+        assert len(large.captured_queries) == len(small.captured_queries)
+
+    def test_diagram_elements_not_found(self, api_client):
+        response = api_client().get(f"{self.endpoint}0195fbd5-5a25-7278-9dd8-6b5dea203f41/diagram-elements/")
+        assert response.status_code == 404
+
+
+class Test_VersionDiagramLayout:
+    endpoint = ENDPOINT
+
+    def test_patch_diagram_json(self, api_client, settings):
+        settings.DIAGRAM_LAYOUT_FLUSH_INTERVAL = 0
+        version = VersionFactory()
+        client = api_client()
+        url = f"{self.endpoint}{version.uuid}/diagram-json/"
+        document = {
+            "timestamp": 1,
+            "graphStructure": {"cells": [
+                {"id": "a", "type": "component", "position": {"x": 0, "y": 0}},
+                {"id": "b", "type": "port", "position": {"x": 10, "y": 0}},
+            ]},
+            "elementMapping": {"cells": [{"id": "a", "backendId": None, "type": "component"}]},
+        }
+
+        response = client.put(url, {"diagram_json": document}, format="json")
+        assert response.status_code == 200
+        revision = response.data["revision"]
+
+        patch = {
+            "base_revision": revision,
+            "changed": [{"id": "a", "ops": [{"op": "replace", "path": "/position/x", "value": 42}]}],
+            "removed": ["b"],
+            "added": [{"id": "c", "type": "port", "position": {"x": 5, "y": 5}}],
+        }
+        response = client.patch(url, patch, format="json")
+        assert response.status_code == 200
+        assert response.data["revision"] == revision + 1
+
+        version.refresh_from_db()
+        cells = json.loads(version.diagram_json)["graphStructure"]["cells"]
+        assert [cell["id"] for cell in cells] == ["a", "c"]
+        assert cells[0]["position"]["x"] == 42
+
+        response = client.patch(url, patch, format="json")
+        assert response.status_code == 409
+        assert response.data["revision"] == revision + 1
+
+        # A full save from a stale revision does not overwrite the patch either
+        response = client.put(url, {"diagram_json": document, "base_revision": revision}, format="json")
+        assert response.status_code == 409
+        response = client.put(url, {"diagram_json": document, "base_revision": revision + 1}, format="json")
+        assert response.status_code == 200
+        assert response.data["revision"] == revision + 2
+
+    def test_buffered_diagram_json(self, api_client, settings):
+        settings.DIAGRAM_LAYOUT_FLUSH_INTERVAL = 60
+        version = VersionFactory()
+        stored = version.diagram_json
+        client = api_client()
+        url = f"{self.endpoint}{version.uuid}/diagram-json/"
+        document = {"graphStructure": {"cells": [{"id": "a", "position": {"x": 0, "y": 0}}]},
+                    "elementMapping": {"cells": []}}
+
+        response = client.put(url, {"diagram_json": document}, format="json")
+        revision = response.data["revision"]
+        for x in range(1, 4):
+            patch = {
+                "base_revision": revision,
+                "changed": [{"id": "a", "ops": [{"op": "replace", "path": "/position/x", "value": x}]}],
+            }
+            response = client.patch(url, patch, format="json")
+            assert response.status_code == 200
+            revision = response.data["revision"]
+
+        # Les enregistrements sont acquittés sans être écrits en base
+        version.refresh_from_db()
+        assert version.diagram_json == stored
+        response = client.get(url)
+        assert response.data["revision"] == revision
+        assert response.data["diagram_json"]["graphStructure"]["cells"][0]["position"]["x"] == 3
+
+        response = client.post(f"{url}flush/")
+        assert response.status_code == 200
+        assert response.data["revision"] == revision
+        version.refresh_from_db()
+        assert json.loads(version.diagram_json)["graphStructure"]["cells"][0]["position"]["x"] == 3
+
+    def test_buffered_diagram_json_two_workers(self, settings, caplog):
+        settings.DIAGRAM_LAYOUT_FLUSH_INTERVAL = 60
+        version = VersionFactory()
+        document = {"graphStructure": {"cells": [{"id": "a", "position": {"x": 0}}, {"id": "b", "position": {"x": 0}}]},
+                    "elementMapping": {"cells": []}}
+        revision = write_layout(version.pk, None, lambda current: document)
+
+        def move(cell_id, x):
+            patch = {"changed": [{"id": cell_id, "ops": [{"op": "replace", "path": "/position/x", "value": x}]}]}
+            return lambda current: apply_patch(current, patch)
+
+        # Deux processus acceptent chacun un enregistrement fait sur la même révision
+        first, second = LayoutWriteBehindBuffer(), LayoutWriteBehindBuffer()
+        assert first.write(version.pk, revision, move("a", 1)) == revision + 1
+        assert second.write(version.pk, revision, move("b", 2)) == revision + 1
+        assert second.write(version.pk, revision + 1, lambda current: apply_patch(current, {"removed": ["a"]}))
+        first.flush(version.pk)
+        second.flush(version.pk)
+
+        # The saves of the second worker are replayed over those of the first one
+        document, stored_revision, _ = read_layout(version.pk)
+        assert stored_revision == revision + 3
+        assert [(cell["id"], cell["position"]["x"]) for cell in document["graphStructure"]["cells"]] == [("b", 2)]
+
+        # A save that no longer applies is dropped, not written over the other one
+        assert first.write(version.pk, stored_revision, move("b", 3)) == stored_revision + 1
+        assert second.write(version.pk, stored_revision, lambda current: apply_patch(current, {"removed": ["b"]}))
+        second.flush(version.pk)
+        with caplog.at_level(logging.ERROR, logger="diagram.layout_buffer"):
+            first.flush(version.pk)
+        document, final_revision, _ = read_layout(version.pk)
+        assert final_revision == stored_revision + 1
+        assert document["graphStructure"]["cells"] == []
+        # The lost save is reported
+        assert "Dropped 1 buffered layout saves" in caplog.text
+
+    def test_layout_bbox(self, api_client, settings):
+        settings.DIAGRAM_LAYOUT_FLUSH_INTERVAL = 0
+        settings.DIAGRAM_LAYOUT_TILE_SIZE = 100
+        version = VersionFactory()
+        client = api_client()
+        component = ComponentFactory(version=version)
+        document = {
+            "graphStructure": {"cells": [
+                {"id": "a", "position": {"x": 0, "y": 0}, "size": {"width": 50, "height": 50}, "z": 2},
+                {"id": "b", "position": {"x": 1000, "y": 1000}, "size": {"width": 50, "height": 50}, "z": 1},
+                {"id": "big", "position": {"x": -5000, "y": -5000}, "size": {"width": 10000, "height": 10000}, "z": 0},
+                {"id": "l", "source": {"id": "a"}, "target": {"id": "b"}, "z": 3},
+            ]},
+            "elementMapping": {"cells": [{"id": "a", "backendId": str(component.id), "type": "component"}]},
+        }
+        client.put(f"{self.endpoint}{version.uuid}/diagram-json/", {"diagram_json": document}, format="json")
+
+        response = client.get(f"{self.endpoint}{version.uuid}/layout/", {"bbox": "-10,-10,60,60"})
+        assert response.status_code == 200
+        assert [cell["id"] for cell in response.data["cells"]] == ["big", "a", "l"]
+        assert response.data["elementMapping"] == [
+            {"id": "a", "backendId": str(component.id), "type": "component"}
+        ]
+
+        response = client.get(f"{self.endpoint}{version.uuid}/layout/", {"bbox": "500,-100,600,-10"})
+        assert [cell["id"] for cell in response.data["cells"]] == ["big"]
+
+        response = client.get(f"{self.endpoint}{version.uuid}/layout/", {"bbox": "1,2"})
+        assert response.status_code == 400
+
+
+class Test_VersionBatch:
+    endpoint = ENDPOINT
+
+    def test_batch(self, api_client):
+        version = VersionFactory()
+        client = api_client()
+        parameter_type = ParameterType.objects.create(name="ip")
+        existing = ComponentFactory(version=version)
+        old_port = PortFactory(component=existing, version=version)
+        operations = [
+            {"op": "create", "type": "component", "temp_id": "c1", "data": {
+                "name": "Router", "availability": True,
+                "parameters": [{"name": "ip", "value": "10.0.0.1", "parameter_type": str(parameter_type.id)}],
+            }},
+            {"op": "create", "type": "port", "temp_id": "p1", "data": {"name": "eth0", "component": "c1"}},
+            {"op": "create", "type": "interface", "data": {"name": "link", "type": "internal", "port_from": "p1"}},
+            {"op": "update", "type": "component", "id": str(existing.id), "data": {"notes": "updated"}},
+            {"op": "delete", "type": "port", "id": str(old_port.id)},
+        ]
+
+        response = client.post(f"{self.endpoint}{version.uuid}/batch/", {"operations": operations}, format="json")
+        assert response.status_code == 200
+        component = Component.objects.get(pk=response.data["ids"]["c1"])
+        port = Port.objects.get(pk=response.data["ids"]["p1"])
+        assert component.version_id == version.pk and component.availability
+        assert port.component_id == component.id
+        interface = Interface.objects.get(pk=response.data["results"][2]["id"])
+        assert interface.port_from_id == port.id and interface.port_to_port_id is None
+        assert Parameter.objects.get(component=component).version_id == version.pk
+        existing.refresh_from_db()
+        assert existing.notes == "updated"
+        assert not Port.objects.filter(pk=old_port.id).exists()
+
+    def test_batch_invalid(self, api_client):
+        version = VersionFactory()
+        client = api_client()
+        other = ComponentFactory(version=VersionFactory())
+        operations = [
+            {"op": "create", "type": "component", "temp_id": "c1", "data": {"name": "Router"}},
+            {"op": "create", "type": "port", "data": {"name": "eth0", "component": str(other.id)}},
+        ]
+
+        response = client.post(f"{self.endpoint}{version.uuid}/batch/", {"operations": operations}, format="json")
+        assert response.status_code == 400
+        assert response.data["operation"] == 1
+        assert not Component.objects.filter(version=version).exists()
+
+    def test_batch_deleted_reference(self, api_client):
+        version = VersionFactory()
+        client = api_client()
+        component = ComponentFactory(version=version)
+        port = PortFactory(component=component, version=version)
+        url = f"{self.endpoint}{version.uuid}/batch/"
+
+        # The new port would be removed with its component
+        operations = [
+            {"op": "delete", "type": "component", "id": str(component.id)},
+            {"op": "create", "type": "port", "data": {"name": "eth0", "component": str(component.id)}},
+        ]
+        response = client.post(url, {"operations": operations}, format="json")
+        assert response.status_code == 400
+        assert response.data["operation"] == 1
+
+        # The port is deleted with its component
+        operations = [
+            {"op": "create", "type": "interface", "data": {"name": "link", "type": "internal", "port_from": str(port.id)}},
+            {"op": "delete", "type": "component", "id": str(component.id)},
+        ]
+        response = client.post(url, {"operations": operations}, format="json")
+        assert response.status_code == 400
+        assert response.data["operation"] == 0
+        assert Component.objects.filter(pk=component.pk).exists()
+
+        # A port moved to another component survives the deletion
+        other = ComponentFactory(version=version)
+        operations = [
+            {"op": "update", "type": "port", "id": str(port.id), "data": {"component": str(other.id)}},
+            {"op": "delete", "type": "component", "id": str(component.id)},
+        ]
+        response = client.post(url, {"operations": operations}, format="json")
+        assert response.status_code == 200
+        port.refresh_from_db()
+        assert port.component_id == other.id
+
+
+class Test_VersionImportExport:
+    endpoint = ENDPOINT
+
+    def test_import_ndjson(self, api_client):
+        version = VersionFactory()
+        client = api_client()
+        ParameterType.objects.create(name="IP")
+        lines = [
+            {"type": "interface", "key": "l1", "name": "uplink", "port_from": "r/eth0", "port_to_port": "s/1"},
+            {"type": "component", "key": "r", "name": "Router"},
+            {"type": "component", "key": "s", "name": "Switch"},
+            {"type": "port", "key": "r/eth0", "name": "eth0", "component": "r"},
+            {"type": "port", "key": "s/1", "name": "1", "component": "s"},
+            {"type": "parameter", "component": "r", "name": "ip", "value": "10.0.0.1", "parameter_type": "IP"},
+            {"type": "port", "name": "orphan", "component": "missing"},
+        ]
+        content = "\n".join(json.dumps(line) for line in lines).encode() + b"\nnot json\n"
+        upload = SimpleUploadedFile("model.ndjson", content, content_type="application/x-ndjson")
+
+        response = client.post(f"{self.endpoint}{version.uuid}/import/", {"file": upload}, format="multipart")
+        assert response.status_code == 200
+        assert response.data["created"] == {"component": 2, "port": 2, "interface": 1, "parameter": 1}
+        assert [error["line"] for error in response.data["errors"]] == [7, 8]
+
+        interface = Interface.objects.get(version=version)
+        assert interface.port_from.name == "eth0" and interface.port_to_port.name == "1"
+        assert Parameter.objects.get(version=version).component.name == "Router"
+
+    def test_export(self, diagram_factory, api_client):
+        version = VersionFactory()
+        component, subcomponent, port, interface = diagram_factory(version)
+
+        response = api_client().get(f"{self.endpoint}{version.uuid}/export/")
+        assert response.status_code == 200
+        assert response.streaming
+        data = json.loads(b"".join(response.streaming_content))
+        assert data["version"] == str(version.uuid)
+        assert [row["id"] for row in data["component"]] == [str(component.id)]
+        assert data["subcomponent"][0]["component_id"] == str(component.id)
+        assert len(data["port"]) == 2
+        assert data["interface"][0]["port_from_id"] == str(port.id)
+
+
+class Test_VersionClone:
+    endpoint = ENDPOINT
+
+    def test_clone(self, diagram_factory, api_client):
+        version = VersionFactory()
+        component, subcomponent, port, interface = diagram_factory(version)
+        parameter_type = ParameterType.objects.create(name="ip")
+        Parameter.objects.create(port=port, name="ip", value="10.0.0.1", parameter_type=parameter_type)
+        version.diagram_json = json.dumps({
+            "graphStructure": {"cells": [{"id": "a", "position": {"x": 0, "y": 0}}]},
+            "elementMapping": {"cells": [{"id": "a", "backendId": str(component.id), "type": "component"}]},
+        })
+        version.save()
+        target = VersionFactory()
+
+        response = api_client().post(f"{self.endpoint}{version.uuid}/clone/", {"target": str(target.uuid)}, format="json")
+        assert response.status_code == 201
+        assert response.data["copied"] == {
+            "component": 1, "subcomponent": 1, "port": 2, "interface": 1, "parameter": 1,
+        }
+
+        clone = Component.objects.get(version=target)
+        assert clone.id != component.id and clone.name == component.name
+        assert Port.objects.filter(version=target, component=clone).count() == 2
+        cloned_interface = Interface.objects.get(version=target)
+        assert cloned_interface.port_from.version_id == target.pk
+        assert cloned_interface.port_to_port.version_id == target.pk
+        assert Parameter.objects.get(version=target).port.version_id == target.pk
+        target.refresh_from_db()
+        mapping = json.loads(target.diagram_json)["elementMapping"]["cells"]
+        assert mapping[0]["backendId"] == str(clone.id)
+
+        response = api_client().post(f"{self.endpoint}{version.uuid}/clone/", {"target": str(target.uuid)}, format="json")
+        assert response.status_code == 400
+
+    def test_clone_image_copy_on_write(self, component_factory, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        version = VersionFactory()
+        component = component_factory(version=version)
+        image = ImageFile.objects.create(uuid=uuid7(), file=SimpleUploadedFile("a.png", b"png"), default=False)
+        component.images.add(image)
+        target, _ = clone_version(version)
+        clone = Component.objects.get(version=target)
+
+        # L'image est partagée avec la version source : elle est copiée
+        copy = write_image_default(image, clone, True)
+        assert copy.pk != image.pk and copy.default
+        image.refresh_from_db()
+        assert not image.default
+        with copy.file.open("rb") as content:
+            assert content.read() == b"png"
+
+        clone.images.set([copy])
+        assert write_image_default(copy, clone, False) is copy
+        copy.refresh_from_db()
+        assert not copy.default
+
+
+class Test_VersionDiff:
+    endpoint = ENDPOINT
+
+    def test_diff(self, diagram_factory, sub_component_factory, api_client):
+        version = VersionFactory()
+        component, subcomponent, port, interface = diagram_factory(version)
+        parameter_type = ParameterType.objects.create(name="ip")
+        Parameter.objects.create(port=port, name="ip", value="10.0.0.1", parameter_type=parameter_type)
+        target, _ = clone_version(version, VersionFactory())
+
+        Component.objects.filter(version=target).update(name="Renamed")
+        Port.objects.filter(version=target, name=port.name).update(confidentiality=not port.confidentiality)
+        Parameter.objects.filter(version=target).update(value="10.0.0.2")
+        sub_component_factory(component=Component.objects.get(version=target), version=target, name="New")
+
+        response = api_client().get(f"{self.endpoint}{version.uuid}/diff/", {"to": str(target.uuid)})
+        assert response.status_code == 200
+        summary = response.data["summary"]
+        assert summary["component"] == {"added": 0, "removed": 0, "modified": 1, "unchanged": 0}
+        assert response.data["component"]["modified"][0]["changes"] == {
+            "name": {"from": component.name, "to": "Renamed"}
+        }
+        assert summary["subcomponent"]["added"] == 1 and summary["subcomponent"]["unchanged"] == 1
+        assert summary["port"]["modified"] >= 1
+        assert summary["interface"] == {"added": 0, "removed": 0, "modified": 0, "unchanged": 1}
+        assert response.data["parameter"]["modified"][0]["changes"] == {
+            "value": {"from": "10.0.0.1", "to": "10.0.0.2"}
+        }
+
+    def test_diff_retargeted_interface(self, diagram_factory, api_client):
+        version = VersionFactory()
+        component, subcomponent, port, interface = diagram_factory(version)
+        target, _ = clone_version(version, VersionFactory())
+        Interface.objects.filter(version=target).update(
+            port_to_port=None, port_to_subcomponent=SubComponent.objects.get(version=target)
+        )
+
+        response = api_client().get(f"{self.endpoint}{version.uuid}/diff/", {"to": str(target.uuid)})
+
+        assert response.status_code == 200
+        assert response.data["summary"]["interface"] == {"added": 0, "removed": 0, "modified": 1, "unchanged": 0}
+        changes = response.data["interface"]["modified"][0]["changes"]
+        assert changes["target"]["to"] == f"{component.name}/{subcomponent.name}"
+        assert changes["target"]["from"].startswith(f"{component.name}/")
+
+    def test_diff_renamed_same_parent(self):
+        def port(pk, component, name):
+            return {"id": pk, "component": component, "name": name, "description": "", "notes": "",
+                    "availability": False, "integrity": False, "confidentiality": False}
+
+        old_rows = [port(1, "A", "eth0"), port(2, "B", "eth0")]
+        # eth0 of A is renamed, eth0 of B is removed and a port with the same content is added to C
+        new_rows = [port(3, "A", "lan"), port(4, "C", "wan")]
+        key = lambda row: (row["component"], row["name"])
+        parent = lambda row: row["component"]
+
+        pairs, removed, added = match(
+            old_rows, new_rows, key, key, COMPARED_FIELDS["port"], old_parent=parent, new_parent=parent
+        )
+
+        assert [(old["id"], new["id"]) for old, new in pairs] == [(1, 3)]
+        assert [row["id"] for row in removed] == [2]
+        assert [row["id"] for row in added] == [4]
+
+
+class Test_VersionChanges:
+    endpoint = ENDPOINT
+
+    def test_changes(self, diagram_factory, port_factory, api_client, django_capture_on_commit_callbacks):
+        version = VersionFactory()
+        component, subcomponent, port, interface = diagram_factory(version)
+        client = api_client()
+        url = f"{self.endpoint}{version.uuid}/changes/"
+        cursor = client.get(url).data["cursor"]
+        assert cursor > 0
+
+        component.notes = "changed"
+        component.save()
+        new_port = port_factory(component=component, version=version)
+        interface_id = interface.id
+        # Les suppressions sont enregistrées à la validation de la transaction
+        with django_capture_on_commit_callbacks(execute=True):
+            interface.delete()
+
+        response = client.get(url, {"since": cursor})
+        assert response.status_code == 200
+        changes = response.data["changes"]
+        assert [item["notes"] for item in changes["component"]["upserted"]] == ["changed"]
+        assert [item["id"] for item in changes["port"]["upserted"]] == [new_port.id]
+        assert changes["interface"]["deleted"] == [interface_id]
+        assert changes["subcomponent"] == {"upserted": [], "deleted": []}
+
+        component.refresh_from_db()
+        assert component.change_seq > cursor
+        response = client.get(url, {"since": response.data["cursor"]})
+        assert all(not change["upserted"] and not change["deleted"] for change in response.data["changes"].values())
+
+    def test_deletion_tombstones(self, component_factory, port_factory, django_capture_on_commit_callbacks):
+        version = VersionFactory()
+        component = component_factory(version=version)
+        ports = [port_factory(component=component, version=version) for _ in range(3)]
+        parameter = Parameter.objects.create(name="ip", component=component, version=version)
+        deleted = ChangeEvent.objects.filter(version=version.pk, operation=ChangeEvent.DELETE)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            sync_parameters("component", component, [])
+        assert list(deleted.values_list("element_id", flat=True)) == [parameter.id]
+
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            component.delete()
+        # One callback records the tombstones of the whole cascade, once each
+        assert len([callback for callback in callbacks if isinstance(getattr(callback, "__self__", None), PendingDeletions)]) == 1
+        assert sorted(deleted.values_list("element_type", flat=True)) == ["component", "parameter", "port", "port", "port"]
+        assert set(deleted.filter(element_type="port").values_list("element_id", flat=True)) == {port.id for port in ports}
+
+    def test_sync_unknown_parameter_type(self, component_factory, caplog):
+        component = component_factory()
+        unknown = str(uuid7())
+
+        with caplog.at_level(logging.WARNING, logger="diagram.views"):
+            sync_parameters("component", component, [{"name": "ip", "parameter_type": unknown}])
+
+        assert not Parameter.objects.filter(component=component).exists()
+        assert f"unknown parameter type {unknown}" in caplog.text
+
+    def test_broadcast_changes(self, component_factory, settings, django_capture_on_commit_callbacks):
+        pytest.importorskip("channels")
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from diagram.realtime import group_name
+
+        settings.CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+        version = VersionFactory()
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(group_name(version.pk), channel)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            component = component_factory(version=version)
+
+        message = async_to_sync(layer.receive)(channel)
+        assert message["type"] == "diagram.change"
+        assert message["events"][0]["type"] == "component"
+        assert message["events"][0]["id"] == str(component.id)
+        assert message["events"][0]["op"] == "upsert"
+
+
+class Test_VersionGraph:
+    endpoint = ENDPOINT
+
+    def test_reachability(self, chain, api_client):
+        version, (c1, c2, c3, p1, p2a, p2b, sub3, i1, i2) = chain
+        client = api_client()
+        url = f"{self.endpoint}{version.uuid}/reachability/"
+
+        response = client.get(url, {"from": str(p1.id), "containment": "0"})
+        assert [item["id"] for item in response.data["reachable"]] == [p2a.id]
+
+        response = client.get(url, {"from": str(c1.id)})
+        reached = {item["id"] for item in response.data["reachable"]}
+        assert {p1.id, p2a.id, c2.id, p2b.id, sub3.id, c3.id} <= reached
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, {"from": str(p1.id), "to": str(sub3.id)})
+        assert [step["id"] for step in response.data["path"]] == [p1.id, p2a.id, c2.id, p2b.id, sub3.id]
+        assert [step["interface"] for step in response.data["path"]] == [None, i1.id, None, None, i2.id]
+        assert len(queries) <= 3
+
+        response = client.get(url, {"from": str(c2.id), "to": str(sub3.id), "external": "1"})
+        assert response.data["path"] is None
+
+        response = client.get(url, {"from": str(p1.id), "to": str(sub3.id), "paths": "1", "max_depth": "4"})
+        assert len(response.data["paths"]) == 1 and not response.data["truncated"]
+
+    def test_graph_snapshot(self, chain, settings, tmp_path):
+        settings.DIAGRAM_GRAPH_SNAPSHOT_DIR = str(tmp_path)
+        version, (c1, c2, c3, p1, p2a, p2b, sub3, i1, i2) = chain
+
+        snapshot = load_snapshot(version.pk)
+        assert len(snapshot) == 7 and snapshot.m == 2
+        assert load_snapshot(version.pk) is snapshot
+        node = snapshot.index(p1.id)
+        assert snapshot.uuid(node) == p1.id
+        assert snapshot.kind(node) == "port" and snapshot.name(node) == p1.name
+        assert snapshot.uuid(snapshot.parent(node)) == c1.id
+        assert [snapshot.uuid(target) for target in snapshot.neighbors(node)] == [p2a.id]
+        assert snapshot.flag(node, "availability") == p1.availability
+        assert snapshot.kind(snapshot.index(sub3.id)) == "subcomponent"
+        assert snapshot.index(version.pk) is None
+
+        p2a.name = "renamed"
+        p2a.save()
+        updated = load_snapshot(version.pk)
+        assert updated.sequence > snapshot.sequence
+        assert updated.name(updated.index(p2a.id)) == "renamed"
+        assert len(list(tmp_path.glob("*.graph"))) == 1
+
+        # A newer snapshot built by another worker is kept, an older one is removed
+        newer = tmp_path / f"{version.pk}-{updated.sequence + 10}.graph"
+        newer.write_bytes(b"")
+        p2a.name = "again"
+        p2a.save()
+        load_snapshot(version.pk)
+        assert newer.exists() and not (tmp_path / f"{version.pk}-{updated.sequence}.graph").exists()
+
+    def test_graph_metrics(self, chain, api_client, settings, tmp_path):
+        pytest.importorskip("numpy")
+        pytest.importorskip("scipy")
+        settings.DIAGRAM_GRAPH_SNAPSHOT_DIR = str(tmp_path)
+        version, (c1, c2, c3, p1, p2a, p2b, sub3, i1, i2) = chain
+        client = api_client()
+        url = f"{self.endpoint}{version.uuid}/metrics/"
+
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.data["nodes"] == 7 and response.data["components"] == 1 and response.data["exact"]
+        metrics = {element["id"]: element for element in response.data["elements"]}
+        assert metrics[p1.id]["fan_out"] == 1 and metrics[p2a.id]["fan_in"] == 1
+        assert metrics[sub3.id]["fan_in"] == 1 and metrics[c3.id]["fan_in"] == 0
+        assert all(element["component_size"] == 7 for element in metrics.values())
+        # c2 is on every path from the first component to the third one
+        assert response.data["elements"][0]["id"] == c2.id
+        assert metrics[p1.id]["centrality"] > 0 and metrics[c1.id]["centrality"] == 0
+
+        response = client.get(url, {"order": "fan_in", "limit": "2"})
+        assert len(response.data["elements"]) == 2
+        assert client.get(url, {"order": "name"}).status_code == 400
+
+
+class Test_VersionCia:
+    endpoint = ENDPOINT
+
+    def test_cia_propagation(self, chain):
+        version, (c1, c2, c3, p1, p2a, p2b, sub3, i1, i2) = chain
+        elements = (c1, c2, c3, p1, p2a, p2b, sub3, i1, i2)
+        for element in elements:
+            type(element).objects.filter(pk=element.pk).update(
+                availability=False, confidentiality=False, integrity=False,
+                effective_availability=False, effective_confidentiality=False, effective_integrity=False,
+            )
+
+        sub3.refresh_from_db()
+        c2.refresh_from_db()
+        revision, sequence = c2.revision, c2.change_seq
+        sub3.confidentiality = True
+        sub3.save()
+        assert sub3.effective_confidentiality
+        for element in elements:
+            element.refresh_from_db()
+        # The representation of c2 changed: new ETag and change event
+        assert c2.revision == revision + 1 and c2.change_seq > sequence
+        assert ChangeEvent.objects.filter(version=version.pk, element_id=c2.pk, id=c2.change_seq).exists()
+        # The interface reaching sub3, the port it leaves and both components
+        assert [element.effective_confidentiality for element in elements] == [
+            False, True, True, False, False, True, True, False, True,
+        ]
+        assert not any(element.effective_integrity for element in elements)
+
+        Component.objects.filter(version=version).update(effective_confidentiality=False)
+        recompute_version(version.pk)
+        c2.refresh_from_db()
+        assert c2.effective_confidentiality
+
+        # The interface loses its target: p2b and c2 lose the requirement
+        sub3.delete()
+        for element in (i2, p2b, c2):
+            element.refresh_from_db()
+            assert not element.effective_confidentiality
+
+    def test_cia_unchanged_inputs(self, chain, monkeypatch):
+        version, (c1, c2, c3, p1, p2a, p2b, sub3, i1, i2) = chain
+        propagated = []
+        monkeypatch.setattr("diagram.signals.propagate", lambda seeds: propagated.append(seeds) or {})
+        p2b.refresh_from_db()
+        i2.refresh_from_db()
+
+        # Neither the requirements nor the ends change: nothing is propagated
+        p2b.name = "Renamed"
+        p2b.save()
+        i2.name = "Renamed"
+        i2.save()
+        assert propagated == []
+
+        p2b.integrity = not p2b.integrity
+        p2b.save()
+        i2.port_to_port, i2.port_to_subcomponent = p2a, None
+        i2.save()
+        assert propagated == [{"port": [p2b.pk]}, {"subcomponent": [sub3.pk], "interface": [i2.pk]}]
+
+
+class Test_VersionValidate:
+    endpoint = ENDPOINT
+
+    def test_validate(self, chain, component_factory, sub_component_factory, port_factory, interface_factory,
+                      api_client):
+        version, (c1, c2, c3, p1, p2a, p2b, sub3, i1, i2) = chain
+        client = api_client()
+        url = f"{self.endpoint}{version.uuid}/validate/"
+
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.data["valid"] and response.data["checked"]["interface"] == 2
+
+        foreign = port_factory(component=component_factory(version=VersionFactory()), version=version)
+        loop = interface_factory(port_from=p1, port_to_port=p1, port_to_subcomponent=None, version=version)
+        Port.objects.filter(pk=p2b.pk).update(name=p2a.name)
+        sub3.delete()
+        orphan = Parameter.objects.create(name="orphan")
+        assert orphan.version_id is None
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        assert len(queries) <= 8
+        report = response.data
+        assert not report["valid"]
+        issues = {(issue["code"], issue["id"]) for issue in report["issues"]}
+        assert ("targetless_interface", i2.id) in issues
+        assert ("cross_version", foreign.id) in issues
+        assert ("self_loop", loop.id) in issues
+        assert ("orphan_parameter", orphan.id) in issues
+        assert {("duplicate_name", p2a.id), ("duplicate_name", p2b.id)} <= issues
+
+        loop.port_to_subcomponent = sub_component_factory(component=c1, version=version)
+        with pytest.raises(ValidationError):
+            loop.clean()